@@ -0,0 +1,83 @@
+"""
+Benchmark: group commit vs. one transaction per write
+
+Simulates a match-day spike: many players confirm tickets at the same time.
+Each mode creates the same number of tickets concurrently on a fresh
+database file and reports throughput and per-call latency.
+
+Usage:
+    python benchmarks/group_commit.py --writes 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db import Database  # noqa: E402
+from database.models import TICKET_TYPE_HELP_NEEDED  # noqa: E402
+
+
+async def run_mode(path: str, writes: int, concurrency: int, **db_options) -> dict:
+    """Create `writes` tickets from `concurrency` concurrent workers"""
+    db = Database(path, **db_options)
+    await db.init_db()
+    await db.create_user(1, "bench", "Bench")
+    
+    latencies = []
+    counter = iter(range(writes))
+    
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            await db.create_ticket(1, TICKET_TYPE_HELP_NEEDED, f"Benchmark ticket {i}")
+            latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    
+    await db.close()
+    
+    latencies.sort()
+    return {
+        "elapsed": elapsed,
+        "throughput": writes / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--flush-interval-ms", type=float, default=5)
+    parser.add_argument("--flush-max-ops", type=int, default=64)
+    args = parser.parse_args()
+    
+    modes = [
+        ("per-call commit", {"group_commit": False}),
+        ("group commit", {
+            "group_commit": True,
+            "flush_interval": args.flush_interval_ms / 1000,
+            "flush_max_ops": args.flush_max_ops,
+        }),
+    ]
+    
+    print(f"{args.writes} ticket inserts, {args.concurrency} concurrent writers")
+    for name, options in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            result = await run_mode(os.path.join(tmp, "bench.db"), args.writes, args.concurrency, **options)
+        print(
+            f"{name:>16}: {result['elapsed']:.2f}s, {result['throughput']:.0f} writes/s, "
+            f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
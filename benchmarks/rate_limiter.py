@@ -0,0 +1,123 @@
+"""
+Benchmark: token bucket rate limiter vs. the per-user timestamp lists
+
+Simulates a multi-day event: distinct users arrive one after another, each
+sends a short burst of requests and then goes quiet. Time is simulated, so
+the run takes seconds however long the event. The previous limiter kept a
+list of timestamps per user, rebuilt it on every request and never forgot
+a user; utils.rate_limiter.RateLimiter keeps one fixed-size bucket per user
+and drops buckets idle for a whole period.
+
+At every checkpoint both report the cost per request over the last stretch
+of users, the number of users they track and the memory they retain.
+
+Usage:
+    python benchmarks/rate_limiter.py --users 100000 --requests 5
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rate_limiter import RateLimiter  # noqa: E402
+
+
+class LegacyRateLimiter:
+    """The previous RateLimitMiddleware logic: a list of request times per user, never evicted"""
+    
+    def __init__(self, max_requests: int, period: float):
+        self.max_requests = max_requests
+        self.period = period
+        self.user_requests: Dict[int, list] = {}
+    
+    def allow(self, user_id: int, now: float) -> bool:
+        if user_id not in self.user_requests:
+            self.user_requests[user_id] = []
+        
+        self.user_requests[user_id] = [
+            req_time for req_time in self.user_requests[user_id]
+            if now - req_time < self.period
+        ]
+        
+        if len(self.user_requests[user_id]) >= self.max_requests:
+            return False
+        
+        self.user_requests[user_id].append(now)
+        return True
+    
+    def __len__(self) -> int:
+        return len(self.user_requests)
+
+
+def feed(limiter, users: int, requests: int, arrival: float, checkpoints: int, on_checkpoint):
+    """Send the simulated traffic, calling on_checkpoint(users so far) every users / checkpoints users"""
+    step = max(1, users // checkpoints)
+    for user_id in range(1, users + 1):
+        now = user_id * arrival
+        for i in range(requests):
+            limiter.allow(user_id, now + i * 0.5)
+        if user_id % step == 0:
+            on_checkpoint(user_id)
+
+
+def run(make_limiter, users: int, requests: int, arrival: float, checkpoints: int) -> list:
+    """(users so far, ns per request, tracked users, retained bytes) at every checkpoint"""
+    # Timing and memory come from separate runs: tracemalloc slows allocation down
+    timings = []
+    step = max(1, users // checkpoints)
+    started = time.perf_counter()
+    
+    def timed(seen: int):
+        nonlocal started
+        timings.append((time.perf_counter() - started) / (step * requests) * 1e9)
+        started = time.perf_counter()
+    
+    feed(make_limiter(), users, requests, arrival, checkpoints, timed)
+    
+    sizes = []
+    limiter = make_limiter()
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    feed(
+        limiter, users, requests, arrival, checkpoints,
+        lambda seen: sizes.append((seen, len(limiter), tracemalloc.get_traced_memory()[0] - base))
+    )
+    tracemalloc.stop()
+    
+    return [(seen, ns, tracked, retained) for ns, (seen, tracked, retained) in zip(timings, sizes)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=5, help="requests per user")
+    parser.add_argument("--arrival", type=float, default=0.1, help="simulated seconds between new users")
+    parser.add_argument("--max-requests", type=int, default=10)
+    parser.add_argument("--period", type=float, default=60.0)
+    parser.add_argument("--checkpoints", type=int, default=5)
+    args = parser.parse_args()
+    
+    print(
+        f"{args.users} users, {args.requests} requests each, a new user every {args.arrival}s, "
+        f"limit {args.max_requests} per {args.period:.0f}s"
+    )
+    for name, limiter_class in (("timestamp lists", LegacyRateLimiter), ("token bucket", RateLimiter)):
+        print(f"\n{name}:")
+        for seen, ns_per_request, tracked, retained in run(
+            lambda: limiter_class(args.max_requests, args.period),
+            args.users, args.requests, args.arrival, args.checkpoints
+        ):
+            print(
+                f"  {seen:>7} users: {ns_per_request:7.0f} ns/request, "
+                f"{tracked:>7} tracked, {retained / 1024:9.1f} KiB retained"
+            )
+
+
+if __name__ == "__main__":
+    main()
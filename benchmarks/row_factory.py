@@ -0,0 +1,145 @@
+"""
+Benchmark: positional row factory + slotted models vs. Row -> dict -> dataclass
+
+Builds a tickets table of the requested size and reads it back the way
+get_all_tickets does, once with the previous conversion (sqlite3.Row, then
+dict(row), then a regular dataclass) and once with the positional row
+factory building the slotted, frozen Ticket model from columns the codec
+has already converted. Reports the decode time per row and the memory
+retained by the resulting list per row.
+
+The decode time excludes the query itself, which dominates and varies
+between runs: each of --repeat rounds times the same query fetched as
+plain tuples and then both variants back to back, and the median of the
+per-round differences is reported. timeit keeps the garbage collector
+off while timing.
+
+Both variants run on the plain sqlite3 module: aiosqlite executes the same
+calls on its worker thread, so the per-row cost is identical.
+
+Usage:
+    python benchmarks/row_factory.py --rows 50000 --repeat 21
+"""
+import argparse
+import gc
+import os
+import sqlite3
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db import TICKET_COLUMNS, TICKET_SELECT, _columns, _ticket_factory, _to_datetime  # noqa: E402
+
+
+@dataclass
+class LegacyTicket:
+    """Ticket model as it was before slots: a regular mutable dataclass"""
+    id: int
+    user_id: int
+    ticket_type: str
+    description: str
+    status: str
+    created_at: datetime
+    closed_at: Optional[datetime]
+    closed_by: Optional[int]
+    judge_id: Optional[int] = None
+
+
+def raw_read(conn: sqlite3.Connection) -> list:
+    """The same query as plain tuples with no conversion, the baseline for decode times"""
+    conn.row_factory = None
+    return conn.execute(f"SELECT {_columns(TICKET_COLUMNS)} FROM tickets ORDER BY created_at DESC").fetchall()
+
+
+def legacy_read(conn: sqlite3.Connection) -> list:
+    """Row -> dict -> dataclass, as database/db.py used to do"""
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(f"SELECT {_columns(TICKET_COLUMNS)} FROM tickets ORDER BY created_at DESC").fetchall()
+    tickets = []
+    for row in rows:
+        data = dict(row)
+        data["created_at"] = _to_datetime(data["created_at"])
+        data["closed_at"] = _to_datetime(data["closed_at"])
+        tickets.append(LegacyTicket(**data))
+    return tickets
+
+
+def factory_read(conn: sqlite3.Connection) -> list:
+    """Codec-converted columns and a positional row factory building the slotted model"""
+    conn.row_factory = None
+    cursor = conn.execute(f"SELECT {TICKET_SELECT} FROM tickets ORDER BY created_at DESC")
+    cursor.row_factory = _ticket_factory
+    return cursor.fetchall()
+
+
+def build_database(rows: int) -> sqlite3.Connection:
+    """In-memory tickets table with `rows` rows"""
+    conn = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_COLNAMES)
+    conn.execute("""
+        CREATE TABLE tickets (
+            id INTEGER PRIMARY KEY, user_id INTEGER, ticket_type TEXT, description TEXT,
+            status TEXT, created_at INTEGER, closed_at INTEGER, closed_by INTEGER, judge_id INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX idx_tickets_created_at ON tickets(created_at)")
+    now = int(time.time())
+    conn.executemany(
+        "INSERT INTO tickets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (i, i % 500, "help_needed", f"Описание проблемы номер {i}",
+             "closed" if i % 3 == 0 else "open", now - i,
+             now if i % 3 == 0 else None, None, i % 7 or None)
+            for i in range(1, rows + 1)
+        )
+    )
+    return conn
+
+
+def decode_times(reads, conn: sqlite3.Connection, rows: int, repeat: int) -> list:
+    """Median decode time per row of each read over the plain fetch, timed in interleaved rounds"""
+    differences = [[] for _ in reads]
+    for _ in range(repeat):
+        baseline = timeit.timeit(lambda: raw_read(conn), number=1)
+        for times, read in zip(differences, reads):
+            times.append(timeit.timeit(lambda: read(conn), number=1) - baseline)
+    return [statistics.median(times) / rows * 1e6 for times in differences]
+
+
+def retained_memory(read, conn: sqlite3.Connection, rows: int) -> dict:
+    """Memory retained by one result and the peak while building it, per row"""
+    gc.collect()
+    tracemalloc.start()
+    result = read(conn)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(result) == rows
+    return {"retained_bytes_per_row": retained / rows, "peak_bytes_per_row": peak / rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=21)
+    args = parser.parse_args()
+    
+    conn = build_database(args.rows)
+    variants = (("Row -> dict -> dataclass", legacy_read), ("positional factory + slots", factory_read))
+    decode = decode_times([read for _, read in variants], conn, args.rows, args.repeat)
+    print(f"Reading {args.rows} tickets, median of {args.repeat} rounds")
+    for (name, read), us_per_row in zip(variants, decode):
+        memory = retained_memory(read, conn, args.rows)
+        print(
+            f"{name:>27}: {us_per_row:.2f} us/row decode, "
+            f"{memory['retained_bytes_per_row']:.0f} B/row retained, "
+            f"{memory['peak_bytes_per_row']:.0f} B/row peak"
+        )
+
+if __name__ == "__main__":
+    main()
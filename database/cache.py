@@ -0,0 +1,127 @@
+"""
+In-process caches in front of the database
+"""
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import time
+
+from database.models import User
+
+
+class UserCache:
+    """Bounded LRU cache of users by id, with a time-to-live per entry"""
+    
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max(1, max_size)
+        # Database keeps entries current on every user write, so the TTL only
+        # bounds staleness from changes made outside this process
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._users: "OrderedDict[int, Tuple[User, float]]" = OrderedDict()
+        self._ids_by_username: Dict[str, int] = {}
+        
+        # Writes are numbered; while reads are in flight, the number of the
+        # last write to each user tells end_read() whether its row is stale
+        self._version = 0
+        self._reads = 0
+        self._written: Dict[int, int] = {}
+    
+    def _lookup(self, user_id: int) -> Optional[User]:
+        """Return a live entry and mark it recently used"""
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        
+        user, expires_at = entry
+        if expires_at < time.monotonic():
+            self._drop(user_id)
+            return None
+        
+        self._users.move_to_end(user_id)
+        return user
+    
+    def get(self, user_id: int) -> Optional[User]:
+        """Get a cached user by id, or None on a miss"""
+        user = self._lookup(user_id)
+        if user is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        return user
+    
+    def get_by_username(self, username: str) -> Optional[User]:
+        """Get a cached user by username, or None on a miss"""
+        user_id = self._ids_by_username.get(username)
+        user = self._lookup(user_id) if user_id is not None else None
+        if user is None or user.username != username:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        return user
+    
+    def begin_read(self) -> int:
+        """Start a database read that may fill the cache; returns the token for end_read()"""
+        self._reads += 1
+        return self._version
+    
+    def end_read(self, token: int, user: Optional[User] = None):
+        """
+        Finish a read started with begin_read(), caching the user it found.
+        
+        The user is left out if a write to them was recorded after the read
+        began: the row may predate it, and caching it would bring the old
+        values back for the whole TTL.
+        """
+        self._reads -= 1
+        if user is not None and self._written.get(user.id, token) <= token:
+            self._store(user)
+        if not self._reads:
+            self._written.clear()
+    
+    def put(self, user: User):
+        """Store a user just written to the database"""
+        self._mark_written(user.id)
+        self._store(user)
+    
+    def invalidate(self, user_id: int):
+        """Drop a user whose row was just written or deleted"""
+        self._mark_written(user_id)
+        self._drop(user_id)
+    
+    def _mark_written(self, user_id: int):
+        """Record a write to a user for the reads in flight"""
+        if self._reads:
+            self._version += 1
+            self._written[user_id] = self._version
+    
+    def _store(self, user: User):
+        """Store or refresh a user"""
+        self._drop(user.id)
+        self._users[user.id] = (user, time.monotonic() + self.ttl)
+        if user.username:
+            self._ids_by_username[user.username] = user.id
+        
+        while len(self._users) > self.max_size:
+            _, (evicted, _) = self._users.popitem(last=False)
+            if evicted.username and self._ids_by_username.get(evicted.username) == evicted.id:
+                del self._ids_by_username[evicted.username]
+    
+    def _drop(self, user_id: int):
+        """Remove a user's entry"""
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            user = entry[0]
+            if user.username and self._ids_by_username.get(user.username) == user_id:
+                del self._ids_by_username[user.username]
+    
+    def clear(self):
+        """Drop all cached users"""
+        self._users.clear()
+        self._ids_by_username.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._users)}
@@ -1,298 +1,1412 @@
 """
 Database operations using aiosqlite
 """
+import asyncio
+import re
+import sqlite3
+import time
 import aiosqlite
-from datetime import datetime
-from typing import Optional, List
+from contextlib import asynccontextmanager
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, AsyncIterator, Any, Awaitable, Callable, Tuple, Iterable, FrozenSet
 import logging
 
 from database.models import (
-    User, Ticket, Comment,
-    ROLE_PLAYER, ROLE_ADMIN,
-    TICKET_STATUS_OPEN, TICKET_STATUS_CLOSED
+    User, Ticket, Comment, TicketPage, TicketSearchPage, TicketDetail, OutboxMessage, Notice, ChatHealth,
+    TicketStatus, TicketType, ROLE_PLAYER, ROLE_JUDGE, ROLE_ADMIN,
+    TICKET_STATUS_OPEN, TICKET_STATUS_CLOSED,
+    OUTBOX_STATUS_PENDING, OUTBOX_STATUS_DEAD
 )
+from database.migrations import (
+    SCHEMA_VERSION, get_schema_version, apply_migrations,
+    ARCHIVE_SCHEMA, create_archive_schema, META_ADMIN_BOOTSTRAPPED,
+    COUNTER_SCOPE_ALL, COUNTER_SCOPE_USER, COUNTER_SCOPE_JUDGE
+)
+from database.cache import UserCache
+from database.roles import RoleDirectory
 
 logger = logging.getLogger(__name__)
 
+def _now() -> int:
+    """Current time as a Unix epoch"""
+    return int(time.time())
+
+
+def _to_datetime(value: Optional[int]) -> Optional[datetime]:
+    """Convert a stored epoch timestamp to a local datetime"""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value)
+
+
+def _fts_query(text: str) -> Optional[str]:
+    """
+    Turn free user input into an FTS5 query: every word must match as a prefix.
+    
+    Words are quoted, so FTS5 operators and punctuation in the input are
+    never interpreted. Returns None if the input has no words.
+    """
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# Codec: every value crossing the sqlite3 boundary is converted here, once.
+# Adapters turn Python values into storage values for query parameters;
+# converters turn stored values into Python values while rows are fetched.
+# Converters are selected by the type in a column alias, e.g.
+# created_at AS "created_at [epoch]", which connections parse because they
+# are opened with PARSE_COLNAMES; rows then reach the factories already typed.
+EPOCH = "epoch"
+ID_SET = "id_set"
+
+COLUMN_TYPES = {
+    "created_at": EPOCH,
+    "closed_at": EPOCH,
+    "next_attempt_at": EPOCH,
+    "updated_at": EPOCH,
+    "next_probe_at": EPOCH,
+    "routed": ID_SET,
+    "ticket_type": "ticket_type",
+    "status": "ticket_status",
+}
+
+
+def _adapt_datetime(value: datetime) -> int:
+    """Store a datetime as a Unix epoch"""
+    return int(value.timestamp())
+
+
+def _convert_epoch(value: bytes) -> datetime:
+    """
+    Read a stored timestamp as a local datetime.
+    
+    Timestamps are Unix epochs since migration 2; text left over from the
+    old format ('YYYY-MM-DD HH:MM:SS', written by CURRENT_TIMESTAMP in UTC)
+    is still accepted, so rows read mid-migration or from old copies parse.
+    """
+    try:
+        return _to_datetime(int(value))
+    except ValueError:
+        legacy = datetime.fromisoformat(value.decode())
+        if legacy.tzinfo is None:
+            legacy = legacy.replace(tzinfo=timezone.utc)
+        return legacy.astimezone().replace(tzinfo=None)
+
+
+def _adapt_id_set(value: frozenset) -> str:
+    """Store a set of ids as a comma-separated list"""
+    return ",".join(str(item) for item in sorted(value))
+
+
+def _convert_id_set(value: bytes) -> frozenset:
+    """Read a comma-separated id list back as a set"""
+    return frozenset(int(item) for item in value.split(b",") if item)
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_adapter(frozenset, _adapt_id_set)
+sqlite3.register_adapter(TicketStatus, str)
+sqlite3.register_adapter(TicketType, str)
+sqlite3.register_converter(EPOCH, _convert_epoch)
+sqlite3.register_converter(ID_SET, _convert_id_set)
+# Enum converters look members up by their raw stored bytes
+sqlite3.register_converter("ticket_status", {status.value.encode(): status for status in TicketStatus}.__getitem__)
+sqlite3.register_converter("ticket_type", {kind.value.encode(): kind for kind in TicketType}.__getitem__)
+
+
+# Column lists in the order the positional row factories below expect.
+# Queries always name them instead of SELECT *, so the physical column
+# order of a table (judge_id was added later by ALTER TABLE) never matters.
+USER_COLUMNS = ("id", "username", "first_name", "role", "created_at")
+TICKET_COLUMNS = (
+    "id", "user_id", "ticket_type", "description", "status",
+    "created_at", "closed_at", "closed_by", "judge_id"
+)
+COMMENT_COLUMNS = ("id", "ticket_id", "judge_id", "text", "created_at")
+OUTBOX_COLUMNS = ("id", "chat_id", "text", "attempts", "created_at", "digest_key")
+CHAT_HEALTH_COLUMNS = ("chat_id", "state", "failures", "last_error", "updated_at", "next_probe_at")
+
+
+def _columns(columns: Tuple[str, ...]) -> str:
+    """Plain column list for copying rows with INSERT ... SELECT"""
+    return ", ".join(columns)
+
+
+def _select(columns: Tuple[str, ...], alias: Optional[str] = None) -> str:
+    """Select list for a column tuple with codec types on the columns that have one"""
+    items = []
+    for column in columns:
+        source = column if alias is None else f"{alias}.{column}"
+        column_type = COLUMN_TYPES.get(column)
+        items.append(f'{source} AS "{column} [{column_type}]"' if column_type else source)
+    return ", ".join(items)
+
+
+USER_SELECT = _select(USER_COLUMNS)
+TICKET_SELECT = _select(TICKET_COLUMNS)
+COMMENT_SELECT = _select(COMMENT_COLUMNS)
+OUTBOX_SELECT = _select(OUTBOX_COLUMNS)
+CHAT_HEALTH_SELECT = _select(CHAT_HEALTH_COLUMNS)
+
+# IDs per IN (...) list in bulk lookups, well under SQLite's bound parameter limit
+USER_BATCH_SIZE = 500
+
+
+# Row factories: set on a cursor, sqlite3 calls them with each fetched tuple
+# on the connection's worker thread, so models are built straight from the
+# already converted tuple with no Row or dict in between.
+def _user_factory(cursor, row) -> User:
+    """Build User from a USER_COLUMNS row"""
+    return User(*row)
+
+
+def _ticket_factory(cursor, row) -> Ticket:
+    """Build Ticket from a TICKET_COLUMNS row"""
+    return Ticket(*row)
+
+
+def _comment_factory(cursor, row) -> Comment:
+    """Build Comment from a COMMENT_COLUMNS row"""
+    return Comment(*row)
+
+
+def _outbox_factory(cursor, row) -> OutboxMessage:
+    """Build OutboxMessage from an OUTBOX_COLUMNS row"""
+    return OutboxMessage(*row)
+
+
+def _chat_health_factory(cursor, row) -> ChatHealth:
+    """Build ChatHealth from a CHAT_HEALTH_COLUMNS row"""
+    return ChatHealth(*row)
+
+
+def _escalation_factory(cursor, row) -> Tuple[Ticket, FrozenSet[int]]:
+    """Build (Ticket, routed judge ids) from a TICKET_COLUMNS row followed by routed"""
+    return Ticket(*row[:-1]), row[-1]
+
+
+def _user_at(row: tuple, offset: int) -> Optional[User]:
+    """Build User from USER_COLUMNS starting at offset in a joined row, None if the join missed"""
+    if row[offset] is None:
+        return None
+    return User(*row[offset:offset + len(USER_COLUMNS)])
+
+
+async def _fetch_one(db: aiosqlite.Connection, query: str, params: tuple, factory: Callable):
+    """Run a query, or a write with a RETURNING clause, and build its first row with factory"""
+    async with db.execute(query, params) as cursor:
+        cursor.row_factory = factory
+        return await cursor.fetchone()
+
+
+async def _fetch_all(db: aiosqlite.Connection, query: str, params: tuple, factory: Callable) -> list:
+    """Run a query and build every row with factory"""
+    async with db.execute(query, params) as cursor:
+        cursor.row_factory = factory
+        return await cursor.fetchall()
+
+
+async def _enqueue_notices(db: aiosqlite.Connection, notices: Iterable[Notice]):
+    """Write notifications to the outbox inside the caller's write transaction"""
+    now = _now()
+    await db.executemany(
+        "INSERT INTO outbox (chat_id, text, digest_key, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(notice.chat_id, notice.text, notice.digest_key, now + notice.delay, now) for notice in notices]
+    )
+
 
 class Database:
     """Database class for managing SQLite operations"""
     
-    def __init__(self, db_path: str):
+    def __init__(
+        self,
+        db_path: str,
+        readers: int = 4,
+        group_commit: bool = False,
+        flush_interval: float = 0.005,
+        flush_max_ops: int = 64,
+        user_cache_size: int = 10000,
+        user_cache_ttl: float = 300.0,
+        archive_path: Optional[str] = None
+    ):
         self.db_path = db_path
+        self.readers = max(1, readers)
         
-    async def init_db(self):
-        """Initialize database schema"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Create users table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT NOT NULL,
-                    role TEXT NOT NULL DEFAULT 'player',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+        # Closed tickets past their age are moved into this file, attached
+        # to every connection as ARCHIVE_SCHEMA; None disables archiving
+        self.archive_path = archive_path or None
+        
+        # Read-through cache for get_user/get_user_by_username
+        self.user_cache = UserCache(user_cache_size, user_cache_ttl)
+        
+        # Judges and admins, loaded in init_db() and kept current by the
+        # user writes below; get_judges() is served from it
+        self.roles = RoleDirectory()
+        
+        # Every mutation goes through one writer task in submission order.
+        # With group commit, queued writes are flushed together in one
+        # transaction every flush_interval seconds or as soon as
+        # flush_max_ops are waiting; without it each write commits alone.
+        self.group_commit = group_commit
+        self.flush_interval = flush_interval
+        self.flush_max_ops = max(1, flush_max_ops)
+        
+        # Long-lived connections, opened in open() and kept until close().
+        # Readers are read-only and, thanks to WAL, never wait for the writer.
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._reader_pool: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._batch_full = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        
+        # Writer metrics, see writer_stats()
+        self._writes = 0
+        self._batches = 0
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+    
+    def _uri(self, path: str, read_only: bool) -> str:
+        """SQLite URI for a database file, optionally opened read-only"""
+        uri = Path(path).resolve().as_uri()
+        return f"{uri}?mode=ro" if read_only else uri
+    
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        """Open one pooled connection with the shared pragmas applied"""
+        # Transactions are managed explicitly in _write(); column alias
+        # types select the codec converters
+        conn = await aiosqlite.connect(
+            self._uri(self.db_path, read_only), isolation_level=None, uri=True,
+            detect_types=sqlite3.PARSE_COLNAMES
+        )
+        await conn.execute("PRAGMA busy_timeout = 5000")
+        await conn.execute("PRAGMA synchronous = NORMAL")
+        if self.archive_path:
+            await conn.execute(
+                f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (self._uri(self.archive_path, read_only),)
+            )
+        return conn
+    
+    async def open(self):
+        """Open the writer connection and task, and the pool of read-only connections"""
+        async with self._open_lock:
+            if self._writer is not None:
+                return
             
-            # Create tickets table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS tickets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    ticket_type TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'open',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    closed_at TIMESTAMP,
-                    closed_by INTEGER,
-                    judge_id INTEGER,
-                    FOREIGN KEY (user_id) REFERENCES users(id),
-                    FOREIGN KEY (closed_by) REFERENCES users(id),
-                    FOREIGN KEY (judge_id) REFERENCES users(id)
-                )
-            """)
+            writer = await self._connect()
+            try:
+                # WAL lets readers run concurrently with the single writer
+                async with writer.execute("PRAGMA journal_mode = WAL") as cursor:
+                    await cursor.fetchone()
+                if self.archive_path:
+                    async with writer.execute(f"PRAGMA {ARCHIVE_SCHEMA}.journal_mode = WAL") as cursor:
+                        await cursor.fetchone()
+                    # Read-only connections can only attach an archive that exists
+                    await create_archive_schema(writer)
+                
+                reader_pool: asyncio.Queue = asyncio.Queue()
+                for _ in range(self.readers):
+                    conn = await self._connect(read_only=True)
+                    self._reader_conns.append(conn)
+                    reader_pool.put_nowait(conn)
+            except Exception:
+                # Don't leak connection threads if the pool is half-built
+                for conn in self._reader_conns:
+                    await conn.close()
+                self._reader_conns = []
+                await writer.close()
+                raise
             
-            # Create comments table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS comments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ticket_id INTEGER NOT NULL,
-                    judge_id INTEGER NOT NULL,
-                    text TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (ticket_id) REFERENCES tickets(id),
-                    FOREIGN KEY (judge_id) REFERENCES users(id)
-                )
-            """)
+            self._writer = writer
+            self._reader_pool = reader_pool
             
-            # Create indexes for performance
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_user_id ON tickets(user_id)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets(status)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_judge_id ON tickets(judge_id)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_comments_ticket_id ON comments(ticket_id)")
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+            
+            logger.info(f"Database pool opened: 1 writer, {self.readers} read-only readers")
+    
+    async def close(self):
+        """Close all pooled connections"""
+        async with self._open_lock:
+            if self._writer is None:
+                return
             
-            # Migration: Add judge_id column if it doesn't exist
-            # Check if judge_id column exists
-            cursor = await db.execute("PRAGMA table_info(tickets)")
-            columns = [row[1] for row in await cursor.fetchall()]
+            # Let queued writes commit before the writer goes away
+            self._write_queue.put_nowait(None)
+            self._batch_full.set()
+            await self._writer_task
+            self._writer_task = None
+            self._write_queue = None
             
-            if 'judge_id' not in columns:
-                logger.info("Column 'judge_id' not found, adding it now...")
-                await db.execute("ALTER TABLE tickets ADD COLUMN judge_id INTEGER")
-                logger.info("Successfully added judge_id column to tickets table")
+            async with self._write_lock:
+                for conn in self._reader_conns:
+                    await conn.close()
+                # Refresh planner statistics for the indexes before leaving
+                await self._writer.execute("PRAGMA optimize")
+                await self._writer.close()
             
-            await db.commit()
-            logger.info("Database initialized successfully")
+            self._reader_conns = []
+            self._reader_pool = None
+            self._writer = None
+            logger.info("Database pool closed")
+    
+    @asynccontextmanager
+    async def _read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a read-only connection from the pool"""
+        if self._reader_pool is None:
+            await self.open()
+        
+        conn = await self._reader_pool.get()
+        try:
+            yield conn
+        finally:
+            self._reader_pool.put_nowait(conn)
+    
+    @asynccontextmanager
+    async def _write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Run a block on the writer connection inside one transaction; used by the writer task"""
+        async with self._write_lock:
+            conn = self._writer
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                await conn.execute("COMMIT")
+            except BaseException:
+                # A failed COMMIT can leave the transaction open; close it so the next batch can begin
+                try:
+                    await conn.execute("ROLLBACK")
+                except Exception as e:
+                    logger.warning(f"Rollback after a failed write transaction failed: {e}")
+                raise
+    
+    async def _submit_write(self, op: Callable[[aiosqlite.Connection], Awaitable[Any]]) -> Any:
+        """
+        Queue a write operation for the writer task and return its result once committed.
+        
+        Operations run in submission order. With group commit enabled an
+        operation is committed together with other queued writes; otherwise
+        it gets its own transaction.
+        """
+        if self._write_queue is None:
+            await self.open()
+        
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((op, future, time.monotonic()))
+        
+        depth = self._write_queue.qsize()
+        self._max_queue_depth = max(self._max_queue_depth, depth)
+        if depth >= self.flush_max_ops:
+            self._batch_full.set()
+        return await future
+    
+    async def _writer_loop(self):
+        """Take queued writes in order and commit them, one batch per transaction"""
+        queue = self._write_queue
+        max_ops = self.flush_max_ops if self.group_commit else 1
+        stopping = False
+        
+        while not stopping:
+            item = await queue.get()
+            if item is None:
+                break
+            
+            # Give concurrent writers a moment to join this batch
+            if self.group_commit and self.flush_interval > 0 and queue.qsize() < max_ops:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_full.clear()
+            
+            batch = [item]
+            while len(batch) < max_ops and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self._flush_batch(batch)
+    
+    async def _flush_batch(self, batch: List[Tuple[Callable, asyncio.Future, float]]):
+        """Commit a batch of queued writes and resolve each caller's future"""
+        started = time.monotonic()
+        for _, _, enqueued_at in batch:
+            wait = started - enqueued_at
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        self._writes += len(batch)
+        self._batches += 1
+        
+        results = []
+        try:
+            async with self._write() as db:
+                for op, future, _ in batch:
+                    # A failing operation only rolls back its own savepoint
+                    await db.execute("SAVEPOINT queued_write")
+                    try:
+                        result = await op(db)
+                    except Exception as e:
+                        await db.execute("ROLLBACK TO queued_write")
+                        results.append((future, None, e))
+                    else:
+                        results.append((future, result, None))
+                    await db.execute("RELEASE queued_write")
+        except Exception as e:
+            logger.error(f"Commit of {len(batch)} queued writes failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    
+    def writer_stats(self) -> dict:
+        """Writer queue metrics: current and peak depth, and how long writes waited"""
+        return {
+            "queue_depth": self._write_queue.qsize() if self._write_queue is not None else 0,
+            "max_queue_depth": self._max_queue_depth,
+            "writes": self._writes,
+            "batches": self._batches,
+            "avg_wait_ms": self._total_wait / self._writes * 1000 if self._writes else 0.0,
+            "max_wait_ms": self._max_wait * 1000,
+        }
+    
+    async def init_db(self):
+        """Initialize database schema by applying pending migrations"""
+        await self.open()
+        
+        # Fast path: an up-to-date database costs a single PRAGMA read
+        version = await get_schema_version(self._writer)
+        if version == SCHEMA_VERSION:
+            logger.info(f"Database schema is up to date (version {version})")
+        else:
+            version = await self._submit_write(apply_migrations)
+            
+            # Readers parsed the main schema before the migrations created its
+            # tables, so an unqualified name like "tickets" would still resolve to
+            # the attached archive. Reading main's schema makes each reader notice
+            # the changed schema cookie and reload it.
+            for conn in self._reader_conns:
+                async with conn.execute("SELECT count(*) FROM main.sqlite_master") as cursor:
+                    await cursor.fetchone()
+            
+            logger.info(f"Database initialized successfully (schema version {version})")
+        
+        await self._load_roles()
+    
+    async def _load_roles(self):
+        """Fill the role directory with the judges and admins from the database"""
+        async with self._read() as db:
+            staff = await _fetch_all(
+                db,
+                f"SELECT {USER_SELECT} FROM users WHERE role IN (?, ?)",
+                (ROLE_JUDGE, ROLE_ADMIN),
+                _user_factory
+            )
+        self.roles.load(staff)
+        logger.info(f"Role directory loaded: {len(self.roles)} judges and admins")
     
     # User operations
     async def get_user(self, user_id: int) -> Optional[User]:
         """Get user by ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM users WHERE id = ?", (user_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return User(**dict(row))
-                return None
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            return user
+        
+        # A write to this user while the row is read keeps it out of the cache
+        token = self.user_cache.begin_read()
+        try:
+            async with self._read() as db:
+                user = await _fetch_one(
+                    db, f"SELECT {USER_SELECT} FROM users WHERE id = ?", (user_id,), _user_factory
+                )
+        finally:
+            self.user_cache.end_read(token, user)
+        return user
     
     async def create_user(self, user_id: int, username: Optional[str], first_name: str) -> User:
-        """Create new user. First user becomes admin."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if this is the first user
-            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-                count = (await cursor.fetchone())[0]
-                role = ROLE_ADMIN if count == 0 else ROLE_PLAYER
-            
+        """
+        Create new user, or refresh the names of an existing one. First user becomes admin.
+        
+        This is a single upsert, so concurrent first contacts from the same
+        Telegram id resolve to one row and an existing user keeps their role.
+        Whether the admin was already handed out comes from the meta table.
+        """
+        async def op(db: aiosqlite.Connection):
+            user = await _fetch_one(
+                db,
+                f"""
+                INSERT INTO users (id, username, first_name, role, created_at)
+                VALUES (
+                    ?, ?, ?,
+                    CASE WHEN EXISTS (SELECT 1 FROM meta WHERE key = ?) THEN ? ELSE ? END,
+                    ?
+                )
+                ON CONFLICT (id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name
+                RETURNING {USER_SELECT}
+                """,
+                (user_id, username, first_name, META_ADMIN_BOOTSTRAPPED, ROLE_PLAYER, ROLE_ADMIN, _now()),
+                _user_factory
+            )
             await db.execute(
-                "INSERT INTO users (id, username, first_name, role) VALUES (?, ?, ?, ?)",
-                (user_id, username, first_name, role)
+                "INSERT OR IGNORE INTO meta (key, value) VALUES (?, '1')",
+                (META_ADMIN_BOOTSTRAPPED,)
             )
-            await db.commit()
-            
-            user = await self.get_user(user_id)
-            logger.info(f"User created: {user_id} ({username}) with role {role}")
             return user
+        
+        user = await self._submit_write(op)
+        self.user_cache.put(user)
+        self.roles.update(user)
+        logger.info(f"User created: {user_id} ({username}) with role {user.role}")
+        return user
     
-    async def update_user_role(self, user_id: int, role: str) -> bool:
-        """Update user role"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE users SET role = ? WHERE id = ?",
-                (role, user_id)
+    async def update_user_role(
+        self, user_id: int, role: str, notify: Optional[Callable[[User], Iterable[Notice]]] = None
+    ) -> Optional[User]:
+        """
+        Update user role. Returns the updated user, or None if there is no such user.
+        
+        notify, if given, builds the notifications for the updated user; they
+        are written to the outbox in the same transaction.
+        """
+        async def op(db: aiosqlite.Connection):
+            user = await _fetch_one(
+                db,
+                f"UPDATE users SET role = ? WHERE id = ? RETURNING {USER_SELECT}",
+                (role, user_id),
+                _user_factory
             )
-            await db.commit()
-            logger.info(f"User {user_id} role updated to {role}")
-            return True
+            if user is not None and notify is not None:
+                await _enqueue_notices(db, notify(user))
+            return user
+        
+        user = await self._submit_write(op)
+        
+        if user is None:
+            self.user_cache.invalidate(user_id)
+            return None
+        
+        # Replace the cached entry and the directory right away so access
+        # checks and fan-outs see the new role
+        self.user_cache.put(user)
+        self.roles.update(user)
+        logger.info(f"User {user_id} role updated to {role}")
+        return user
     
     async def get_user_by_username(self, username: str) -> Optional[User]:
         """Get user by username"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM users WHERE username = ?", (username,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return User(**dict(row))
-                return None
+        user = self.user_cache.get_by_username(username)
+        if user is not None:
+            return user
+        
+        token = self.user_cache.begin_read()
+        try:
+            async with self._read() as db:
+                user = await _fetch_one(
+                    db, f"SELECT {USER_SELECT} FROM users WHERE username = ?", (username,), _user_factory
+                )
+        finally:
+            self.user_cache.end_read(token, user)
+        return user
+    
+    async def get_users(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """
+        Get several users by ID in one query, keyed by ID; unknown IDs are left out.
+        
+        Cached users are taken from the cache, the rest are read but not
+        cached: bulk lookups are for lists like the unreachable chats, whose
+        users are not the ones about to write to the bot.
+        """
+        users: Dict[int, User] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            user = self.user_cache.get(user_id)
+            if user is not None:
+                users[user_id] = user
+            else:
+                missing.append(user_id)
+        if not missing:
+            return users
+        
+        async with self._read() as db:
+            for start in range(0, len(missing), USER_BATCH_SIZE):
+                chunk = missing[start:start + USER_BATCH_SIZE]
+                for user in await _fetch_all(
+                    db,
+                    f"SELECT {USER_SELECT} FROM users WHERE id IN ({', '.join('?' for _ in chunk)})",
+                    chunk,
+                    _user_factory
+                ):
+                    users[user.id] = user
+        return users
     
     async def get_judges(self) -> List[User]:
-        """Get all judges and admins"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM users WHERE role IN ('judge', 'admin') ORDER BY created_at"
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [User(**dict(row)) for row in rows]
+        """Get all judges and admins, oldest first, from the role directory"""
+        if not self.roles.loaded:
+            await self._load_roles()
+        return list(self.roles.judges())
     
     # Ticket operations
     async def create_ticket(
-        self, user_id: int, ticket_type: str, description: str
+        self,
+        user_id: int,
+        ticket_type: str,
+        description: str,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None,
+        escalate_after: Optional[int] = None,
+        routed: Iterable[int] = ()
     ) -> Ticket:
-        """Create new ticket"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "INSERT INTO tickets (user_id, ticket_type, description) VALUES (?, ?, ?)",
-                (user_id, ticket_type, description)
+        """
+        Create new ticket.
+        
+        notify, if given, builds the notifications for the new ticket; they
+        are written to the outbox in the same transaction. With escalate_after
+        the ticket is also scheduled for escalation that many seconds later if
+        it is still open by then, in the same transaction; routed are the
+        judges already told about it, whom the escalation skips.
+        """
+        async def op(db: aiosqlite.Connection):
+            now = _now()
+            ticket = await _fetch_one(
+                db,
+                f"INSERT INTO tickets (user_id, ticket_type, description, created_at) VALUES (?, ?, ?, ?) RETURNING {TICKET_SELECT}",
+                (user_id, ticket_type, description, now),
+                _ticket_factory
             )
-            await db.commit()
-            ticket_id = cursor.lastrowid
-            
-            ticket = await self.get_ticket(ticket_id)
-            logger.info(f"Ticket created: {ticket_id} by user {user_id}")
+            if escalate_after is not None:
+                await db.execute(
+                    "INSERT INTO ticket_escalations (ticket_id, escalate_at, routed) VALUES (?, ?, ?)",
+                    (ticket.id, now + escalate_after, frozenset(routed))
+                )
+            if notify is not None:
+                await _enqueue_notices(db, notify(ticket))
             return ticket
+        
+        ticket = await self._submit_write(op)
+        logger.info(f"Ticket created: {ticket.id} by user {user_id}")
+        return ticket
+    
+    def _schemas(self) -> Tuple[str, ...]:
+        """Schemas to look tickets up in: the hot tables first, then the archive"""
+        return ("main", ARCHIVE_SCHEMA) if self.archive_path else ("main",)
     
     async def get_ticket(self, ticket_id: int) -> Optional[Ticket]:
-        """Get ticket by ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM tickets WHERE id = ?", (ticket_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return Ticket(**dict(row))
-                return None
+        """Get ticket by ID, falling through to the archive"""
+        async with self._read() as db:
+            for schema in self._schemas():
+                ticket = await _fetch_one(
+                    db, f"SELECT {TICKET_SELECT} FROM {schema}.tickets WHERE id = ?", (ticket_id,), _ticket_factory
+                )
+                if ticket:
+                    return ticket
+            return None
     
     async def get_user_tickets(self, user_id: int, status: Optional[str] = None) -> List[Ticket]:
-        """Get all tickets for a user, optionally filtered by status"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            if status:
-                query = "SELECT * FROM tickets WHERE user_id = ? AND status = ? ORDER BY created_at DESC"
-                params = (user_id, status)
-            else:
-                query = "SELECT * FROM tickets WHERE user_id = ? ORDER BY created_at DESC"
-                params = (user_id,)
-            
-            async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [Ticket(**dict(row)) for row in rows]
+        """Get all tickets for a user including archived ones, optionally filtered by status"""
+        where = "user_id = ? AND status = ?" if status else "user_id = ?"
+        params = (user_id, status) if status else (user_id,)
+        
+        # Archived ids never reappear in the hot table, so UNION ALL can't duplicate
+        query = " UNION ALL ".join(
+            f"SELECT {TICKET_SELECT} FROM {schema}.tickets WHERE {where}"
+            for schema in self._schemas()
+        )
+        
+        async with self._read() as db:
+            return await _fetch_all(
+                db,
+                f"{query} ORDER BY created_at DESC, id DESC",
+                params * len(self._schemas()),
+                _ticket_factory
+            )
     
     async def get_all_tickets(self, status: Optional[str] = None) -> List[Ticket]:
         """Get all tickets, optionally filtered by status"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             if status:
-                query = "SELECT * FROM tickets WHERE status = ? ORDER BY created_at DESC"
+                query = f"SELECT {TICKET_SELECT} FROM tickets WHERE status = ? ORDER BY created_at DESC"
                 params = (status,)
             else:
-                query = "SELECT * FROM tickets ORDER BY created_at DESC"
+                query = f"SELECT {TICKET_SELECT} FROM tickets ORDER BY created_at DESC"
                 params = ()
             
-            async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [Ticket(**dict(row)) for row in rows]
+            return await _fetch_all(db, query, params, _ticket_factory)
     
     async def get_judge_tickets(self, judge_id: int, status: Optional[str] = None) -> List[Ticket]:
         """Get all tickets assigned to a specific judge, optionally filtered by status"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             if status:
-                query = "SELECT * FROM tickets WHERE judge_id = ? AND status = ? ORDER BY created_at DESC"
+                query = f"SELECT {TICKET_SELECT} FROM tickets WHERE judge_id = ? AND status = ? ORDER BY created_at DESC"
                 params = (judge_id, status)
             else:
-                query = "SELECT * FROM tickets WHERE judge_id = ? ORDER BY created_at DESC"
+                query = f"SELECT {TICKET_SELECT} FROM tickets WHERE judge_id = ? ORDER BY created_at DESC"
                 params = (judge_id,)
             
-            async with db.execute(query, params) as cursor:
+            return await _fetch_all(db, query, params, _ticket_factory)
+    
+    async def _get_tickets_page(
+        self,
+        scope: str,
+        owner_id: int,
+        status: Optional[str],
+        after_id: Optional[int],
+        before_id: Optional[int],
+        limit: int
+    ) -> TicketPage:
+        """
+        Fetch one page of tickets ordered newest first, keyed on (created_at, id).
+        
+        scope is one of the COUNTER_SCOPE_* values and owner_id the user or
+        judge it applies to. after_id continues past the last ticket of the
+        previous page, before_id goes back from the first ticket of the next
+        page. Only limit + 1 rows are read, however deep the page is, and the
+        total comes from the trigger-maintained counters. A user's pages also
+        cover their archived tickets.
+        """
+        filters, params = [], ()
+        if scope == COUNTER_SCOPE_USER:
+            filters.append("user_id = ?")
+            params += (owner_id,)
+        elif scope == COUNTER_SCOPE_JUDGE:
+            filters.append("judge_id = ?")
+            params += (owner_id,)
+        if status:
+            filters.append("status = ?")
+            params += (status,)
+        
+        where = " AND ".join(filters) if filters else "1"
+        anchor_id = after_id if after_id is not None else before_id
+        
+        # A user's own list includes their archived tickets: the same page is
+        # read from every schema and merged, each part straight off its index
+        schemas = self._schemas() if scope == COUNTER_SCOPE_USER else ("main",)
+        anchor = " UNION ALL ".join(
+            f"SELECT created_at, id FROM {schema}.tickets WHERE id = ?" for schema in schemas
+        )
+        
+        if anchor_id is None:
+            keyset, order, anchor_params = "", "created_at DESC, id DESC", ()
+        elif after_id is not None:
+            keyset, order = f" AND (created_at, id) < ({anchor})", "created_at DESC, id DESC"
+            anchor_params = (after_id,) * len(schemas)
+        else:
+            keyset, order = f" AND (created_at, id) > ({anchor})", "created_at ASC, id ASC"
+            anchor_params = (before_id,) * len(schemas)
+        
+        query = " UNION ALL ".join(
+            f"SELECT {TICKET_SELECT} FROM {schema}.tickets WHERE {where}{keyset}" for schema in schemas
+        )
+        page_params = (params + anchor_params) * len(schemas) + (limit + 1,)
+        
+        async with self._read() as db:
+            tickets = await _fetch_all(db, f"{query} ORDER BY {order} LIMIT ?", page_params, _ticket_factory)
+            
+            counts = await self._read_counts(db, scope, owner_id)
+            if len(schemas) > 1:
+                counts = await self._add_archived_count(db, counts, owner_id)
+        
+        if anchor_id is not None and not tickets:
+            # Anchor ticket is gone or the list shrank: restart from the first page
+            return await self._get_tickets_page(scope, owner_id, status, None, None, limit)
+        
+        has_more = len(tickets) > limit
+        tickets = tickets[:limit]
+        if before_id is not None:
+            tickets.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = after_id is not None, has_more
+        
+        return TicketPage(
+            tickets=tickets,
+            total=counts.get(status, 0) if status else sum(counts.values()),
+            has_prev=has_prev,
+            has_next=has_next
+        )
+    
+    async def get_all_tickets_page(
+        self,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage:
+        """Get one page of all tickets, optionally filtered by status"""
+        return await self._get_tickets_page(COUNTER_SCOPE_ALL, 0, status, after_id, before_id, limit)
+    
+    async def get_user_tickets_page(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage:
+        """Get one page of a user's tickets, optionally filtered by status"""
+        return await self._get_tickets_page(COUNTER_SCOPE_USER, user_id, status, after_id, before_id, limit)
+    
+    async def get_judge_tickets_page(
+        self,
+        judge_id: int,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage:
+        """Get one page of tickets assigned to a judge, optionally filtered by status"""
+        return await self._get_tickets_page(COUNTER_SCOPE_JUDGE, judge_id, status, after_id, before_id, limit)
+    
+    async def _add_archived_count(self, db: aiosqlite.Connection, counts: Dict[str, int], user_id: int) -> Dict[str, int]:
+        """Add a user's archived tickets, all of them closed, to their hot counts"""
+        async with db.execute(f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.tickets WHERE user_id = ?", (user_id,)) as cursor:
+            archived = (await cursor.fetchone())[0]
+        if archived:
+            counts[TICKET_STATUS_CLOSED] = counts.get(TICKET_STATUS_CLOSED, 0) + archived
+        return counts
+    
+    async def _read_counts(self, db: aiosqlite.Connection, scope: str, owner_id: int) -> Dict[str, int]:
+        """Read per-status ticket counts for one counter scope"""
+        async with db.execute(
+            "SELECT status, count FROM ticket_counters WHERE scope = ? AND owner_id = ?",
+            (scope, owner_id)
+        ) as cursor:
+            return {row[0]: row[1] for row in await cursor.fetchall() if row[1]}
+    
+    async def get_ticket_counts(
+        self, user_id: Optional[int] = None, judge_id: Optional[int] = None
+    ) -> Dict[str, int]:
+        """
+        Get ticket counts per status from the trigger-maintained counters.
+        
+        Counts cover all tickets, or only a user's tickets, or only those
+        assigned to a judge. Statuses with no tickets are left out.
+        """
+        if user_id is not None:
+            scope, owner_id = COUNTER_SCOPE_USER, user_id
+        elif judge_id is not None:
+            scope, owner_id = COUNTER_SCOPE_JUDGE, judge_id
+        else:
+            scope, owner_id = COUNTER_SCOPE_ALL, 0
+        
+        async with self._read() as db:
+            counts = await self._read_counts(db, scope, owner_id)
+            if scope == COUNTER_SCOPE_USER and self.archive_path:
+                counts = await self._add_archived_count(db, counts, owner_id)
+            return counts
+    
+    async def get_judges_ticket_counts(self) -> Dict[int, Dict[str, int]]:
+        """Get per-status ticket counts for every judge with assigned tickets"""
+        async with self._read() as db:
+            async with db.execute(
+                "SELECT owner_id, status, count FROM ticket_counters WHERE scope = ? AND count > 0",
+                (COUNTER_SCOPE_JUDGE,)
+            ) as cursor:
                 rows = await cursor.fetchall()
-                return [Ticket(**dict(row)) for row in rows]
+        
+        counts: Dict[int, Dict[str, int]] = {}
+        for judge_id, status, count in rows:
+            counts.setdefault(judge_id, {})[status] = count
+        return counts
     
-    async def update_ticket_status(
-        self, ticket_id: int, status: str, closed_by: Optional[int] = None, judge_id: Optional[int] = None
-    ) -> bool:
-        """Update ticket status and optionally assign judge"""
-        async with aiosqlite.connect(self.db_path) as db:
-            closed_at = datetime.now() if status == TICKET_STATUS_CLOSED else None
-            if judge_id is not None:
-                await db.execute(
-                    "UPDATE tickets SET status = ?, closed_at = ?, closed_by = ?, judge_id = ? WHERE id = ?",
-                    (status, closed_at, closed_by, judge_id, ticket_id)
-                )
-            else:
-                await db.execute(
-                    "UPDATE tickets SET status = ?, closed_at = ?, closed_by = ? WHERE id = ?",
-                    (status, closed_at, closed_by, ticket_id)
+    async def search_tickets(
+        self,
+        query: str,
+        status: Optional[str] = None,
+        limit: int = 10,
+        cursor: int = 0
+    ) -> TicketSearchPage:
+        """
+        Full-text search over ticket descriptions and comment texts.
+        
+        Tickets are ranked by their best bm25 match in either the description
+        or one of the comments. cursor is the offset returned as next_cursor
+        by the previous page.
+        """
+        match = _fts_query(query)
+        if match is None:
+            return TicketSearchPage(tickets=[], cursor=0, next_cursor=None)
+        
+        status_filter = "WHERE t.status = ?" if status else ""
+        params = (match, match) + ((status,) if status else ()) + (limit + 1, cursor)
+        
+        async with self._read() as db:
+            tickets = await _fetch_all(
+                db,
+                f"""
+                WITH hits (ticket_id, rank) AS (
+                    SELECT rowid, bm25(tickets_fts) FROM tickets_fts WHERE tickets_fts MATCH ?
+                    UNION ALL
+                    SELECT cm.ticket_id, bm25(comments_fts)
+                    FROM comments_fts JOIN comments cm ON cm.id = comments_fts.rowid
+                    WHERE comments_fts MATCH ?
+                ),
+                best (ticket_id, rank) AS (
+                    SELECT ticket_id, MIN(rank) FROM hits GROUP BY ticket_id
                 )
-            await db.commit()
-            logger.info(f"Ticket {ticket_id} status updated to {status}")
-            return True
+                SELECT {_select(TICKET_COLUMNS, 't')} FROM best JOIN tickets t ON t.id = best.ticket_id
+                {status_filter}
+                ORDER BY best.rank, t.id DESC
+                LIMIT ? OFFSET ?
+                """,
+                params,
+                _ticket_factory
+            )
+        
+        return TicketSearchPage(
+            tickets=tickets[:limit],
+            cursor=cursor,
+            next_cursor=cursor + limit if len(tickets) > limit else None
+        )
+    
+    async def update_ticket_status(
+        self,
+        ticket_id: int,
+        status: str,
+        closed_by: Optional[int] = None,
+        judge_id: Optional[int] = None,
+        from_statuses: Optional[Tuple[str, ...]] = None,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None
+    ) -> Optional[Ticket]:
+        """
+        Update ticket status and optionally assign judge.
+        
+        If from_statuses is given, the update only applies while the ticket
+        is in one of those statuses. Returns the updated ticket, or None if
+        no row changed. notify, if given, builds the notifications for the
+        updated ticket; they are written to the outbox in the same transaction.
+        """
+        closed_at = _now() if status == TICKET_STATUS_CLOSED else None
+        
+        assignments = "status = ?, closed_at = ?, closed_by = ?"
+        params: tuple = (status, closed_at, closed_by)
+        if judge_id is not None:
+            assignments += ", judge_id = ?"
+            params += (judge_id,)
+        
+        query = f"UPDATE tickets SET {assignments} WHERE id = ?"
+        params += (ticket_id,)
+        if from_statuses:
+            query += f" AND status IN ({', '.join('?' for _ in from_statuses)})"
+            params += tuple(from_statuses)
+        query += f" RETURNING {TICKET_SELECT}"
+        
+        async def op(db: aiosqlite.Connection):
+            ticket = await _fetch_one(db, query, params, _ticket_factory)
+            if ticket is not None and notify is not None:
+                await _enqueue_notices(db, notify(ticket))
+            return ticket
+        
+        ticket = await self._submit_write(op)
+        if ticket is None:
+            logger.info(f"Ticket {ticket_id} status not updated to {status}: no matching row")
+            return None
+        
+        logger.info(f"Ticket {ticket_id} status updated to {status}")
+        return ticket
     
     async def get_old_open_tickets(self, days: int) -> List[Ticket]:
         """Get tickets older than specified days that are still open or in progress"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                """
-                SELECT * FROM tickets 
+        async with self._read() as db:
+            return await _fetch_all(
+                db,
+                f"""
+                SELECT {TICKET_SELECT} FROM tickets 
                 WHERE status IN ('open', 'in_progress') 
-                AND datetime(created_at) <= datetime('now', '-' || ? || ' days')
+                AND created_at <= ?
+                """,
+                (_now() - days * 86400,),
+                _ticket_factory
+            )
+    
+    async def pop_due_escalations(
+        self, notify: Optional[Callable[[Ticket, FrozenSet[int]], Iterable[Notice]]] = None
+    ) -> List[Ticket]:
+        """
+        Take the escalations that are due and return their tickets still open, earliest due first.
+        
+        Due escalations are removed whether or not the ticket was picked up
+        meanwhile. notify, if given, is called with each returned ticket and
+        the judges it was routed to, and its notifications go to the outbox
+        in the same transaction.
+        """
+        async def op(db: aiosqlite.Connection):
+            now = _now()
+            # CROSS JOIN keeps the due escalations as the outer loop, read in
+            # order off their index, instead of walking every open ticket
+            due = await _fetch_all(
+                db,
+                f"""
+                SELECT {_select(TICKET_COLUMNS, 't')}, {_select(("routed",), 'e')}
+                FROM ticket_escalations e CROSS JOIN tickets t ON t.id = e.ticket_id
+                WHERE e.escalate_at <= ? AND t.status = ?
+                ORDER BY e.escalate_at, e.ticket_id
+                """,
+                (now, TICKET_STATUS_OPEN),
+                _escalation_factory
+            )
+            await db.execute("DELETE FROM ticket_escalations WHERE escalate_at <= ?", (now,))
+            if notify is not None:
+                await _enqueue_notices(db, [notice for ticket, routed in due for notice in notify(ticket, routed)])
+            return [ticket for ticket, _ in due]
+        
+        return await self._submit_write(op)
+    
+    async def close_tickets(
+        self,
+        ticket_ids: List[int],
+        comment_text: str,
+        closed_by: Optional[int] = None,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None
+    ) -> List[Ticket]:
+        """
+        Close several tickets and add the same comment to each in one transaction.
+        
+        Tickets that are already closed are skipped. The comment author is
+        closed_by, or the ticket owner for system closes. notify, if given, is
+        called for each closed ticket and its notifications go to the outbox
+        in the same transaction. Returns the tickets that were actually closed.
+        """
+        if not ticket_ids:
+            return []
+        
+        closed_at = _now()
+        placeholders = ", ".join("?" for _ in ticket_ids)
+        
+        async def op(db: aiosqlite.Connection):
+            tickets = await _fetch_all(
+                db,
+                f"""
+                UPDATE tickets SET status = ?, closed_at = ?, closed_by = ?
+                WHERE id IN ({placeholders}) AND status != ?
+                RETURNING {TICKET_SELECT}
                 """,
-                (days,)
+                (TICKET_STATUS_CLOSED, closed_at, closed_by, *ticket_ids, TICKET_STATUS_CLOSED),
+                _ticket_factory
+            )
+            tickets.sort(key=lambda t: t.id)
+            
+            await db.executemany(
+                "INSERT INTO comments (ticket_id, judge_id, text, created_at) VALUES (?, ?, ?, ?)",
+                [
+                    (ticket.id, closed_by if closed_by is not None else ticket.user_id, comment_text, closed_at)
+                    for ticket in tickets
+                ]
+            )
+            if notify is not None:
+                await _enqueue_notices(db, [notice for ticket in tickets for notice in notify(ticket)])
+            return tickets
+        
+        tickets = await self._submit_write(op)
+        
+        logger.info(f"Closed {len(tickets)} of {len(ticket_ids)} tickets in bulk")
+        return tickets
+    
+    async def archive_closed_tickets(self, days: int, batch_size: int = 500) -> int:
+        """
+        Move tickets closed more than days ago, with their comments, into the archive.
+        
+        Each batch of up to batch_size tickets is copied and deleted in its own
+        transaction, so the writer is never held for long. Rows are copied with
+        INSERT OR IGNORE before the hot copy is deleted, which keeps a retry
+        after an interrupted run safe. Returns the number of tickets moved.
+        """
+        if not self.archive_path:
+            return 0
+        
+        cutoff = _now() - days * 86400
+        moved = 0
+        
+        async def op(db: aiosqlite.Connection) -> int:
+            # Oldest closes first, read off idx_tickets_closed_at; the status
+            # must be a literal for the planner to use that partial index
+            async with db.execute(
+                "SELECT id FROM tickets WHERE status = 'closed' AND closed_at <= ? "
+                "ORDER BY closed_at, id LIMIT ?",
+                (cutoff, batch_size)
             ) as cursor:
-                rows = await cursor.fetchall()
-                return [Ticket(**dict(row)) for row in rows]
+                ticket_ids = [row[0] for row in await cursor.fetchall()]
+            
+            if not ticket_ids:
+                return 0
+            
+            placeholders = ", ".join("?" for _ in ticket_ids)
+            await db.execute(
+                f"""
+                INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.tickets ({_columns(TICKET_COLUMNS)})
+                SELECT {_columns(TICKET_COLUMNS)} FROM tickets WHERE id IN ({placeholders})
+                """,
+                ticket_ids
+            )
+            await db.execute(
+                f"""
+                INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.comments ({_columns(COMMENT_COLUMNS)})
+                SELECT {_columns(COMMENT_COLUMNS)} FROM comments WHERE ticket_id IN ({placeholders})
+                """,
+                ticket_ids
+            )
+            # Delete triggers keep the counters and full-text indexes in step
+            await db.execute(f"DELETE FROM comments WHERE ticket_id IN ({placeholders})", ticket_ids)
+            await db.execute(f"DELETE FROM tickets WHERE id IN ({placeholders})", ticket_ids)
+            return len(ticket_ids)
+        
+        # One queued write per batch, so other writes get in between batches
+        while True:
+            count = await self._submit_write(op)
+            moved += count
+            if count < batch_size:
+                break
+        
+        if moved:
+            logger.info(f"Archived {moved} closed tickets older than {days} days")
+        return moved
     
     # Comment operations
-    async def create_comment(self, ticket_id: int, judge_id: int, text: str) -> Comment:
-        """Create new comment on ticket"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "INSERT INTO comments (ticket_id, judge_id, text) VALUES (?, ?, ?)",
-                (ticket_id, judge_id, text)
+    async def create_comment(
+        self,
+        ticket_id: int,
+        judge_id: int,
+        text: str,
+        notify: Optional[Callable[[Comment], Iterable[Notice]]] = None
+    ) -> Comment:
+        """
+        Create new comment on ticket.
+        
+        notify, if given, builds the notifications for the new comment; they
+        are written to the outbox in the same transaction.
+        """
+        async def op(db: aiosqlite.Connection):
+            comment = await _fetch_one(
+                db,
+                f"INSERT INTO comments (ticket_id, judge_id, text, created_at) VALUES (?, ?, ?, ?) RETURNING {COMMENT_SELECT}",
+                (ticket_id, judge_id, text, _now()),
+                _comment_factory
             )
-            await db.commit()
-            comment_id = cursor.lastrowid
-            
-            comment = await self.get_comment(comment_id)
-            logger.info(f"Comment created: {comment_id} on ticket {ticket_id}")
+            if notify is not None:
+                await _enqueue_notices(db, notify(comment))
             return comment
+        
+        comment = await self._submit_write(op)
+        logger.info(f"Comment created: {comment.id} on ticket {ticket_id}")
+        return comment
     
     async def get_comment(self, comment_id: int) -> Optional[Comment]:
-        """Get comment by ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM comments WHERE id = ?", (comment_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return Comment(**dict(row))
-                return None
+        """Get comment by ID, falling through to the archive"""
+        async with self._read() as db:
+            for schema in self._schemas():
+                comment = await _fetch_one(
+                    db, f"SELECT {COMMENT_SELECT} FROM {schema}.comments WHERE id = ?", (comment_id,), _comment_factory
+                )
+                if comment:
+                    return comment
+            return None
     
     async def get_ticket_comments(self, ticket_id: int) -> List[Comment]:
-        """Get all comments for a ticket"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        """Get all comments for a ticket, falling through to the archive"""
+        async with self._read() as db:
+            for schema in self._schemas():
+                comments = await _fetch_all(
+                    db,
+                    f"SELECT {COMMENT_SELECT} FROM {schema}.comments WHERE ticket_id = ? ORDER BY created_at ASC",
+                    (ticket_id,),
+                    _comment_factory
+                )
+                if comments:
+                    return comments
+            return []
+    
+    async def get_ticket_detail(self, ticket_id: int) -> Optional[TicketDetail]:
+        """
+        Get ticket with owner, assigned judge, closer and comments with authors in two queries.
+        
+        Falls through to the archive when the ticket is not in the hot tables.
+        """
+        async with self._read() as db:
+            for schema in self._schemas():
+                async with db.execute(
+                    f"""
+                    SELECT {_select(TICKET_COLUMNS, 't')}, {_select(USER_COLUMNS, 'o')},
+                           {_select(USER_COLUMNS, 'a')}, {_select(USER_COLUMNS, 'c')}
+                    FROM {schema}.tickets t
+                    LEFT JOIN users o ON o.id = t.user_id
+                    LEFT JOIN users a ON a.id = t.judge_id
+                    LEFT JOIN users c ON c.id = t.closed_by
+                    WHERE t.id = ?
+                    """,
+                    (ticket_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                if row:
+                    break
+            
+            if not row:
+                return None
+            
             async with db.execute(
-                "SELECT * FROM comments WHERE ticket_id = ? ORDER BY created_at ASC",
+                f"""
+                SELECT {_select(COMMENT_COLUMNS, 'cm')}, {_select(USER_COLUMNS, 'u')}
+                FROM {schema}.comments cm
+                LEFT JOIN users u ON u.id = cm.judge_id
+                WHERE cm.ticket_id = ?
+                ORDER BY cm.created_at ASC
+                """,
                 (ticket_id,)
             ) as cursor:
-                rows = await cursor.fetchall()
-                return [Comment(**dict(row)) for row in rows]
-
+                comment_rows = await cursor.fetchall()
+        
+        # Joined rows are the ticket (or comment) columns followed by each user's columns
+        owner_at = len(TICKET_COLUMNS)
+        assignee_at = owner_at + len(USER_COLUMNS)
+        closer_at = assignee_at + len(USER_COLUMNS)
+        author_at = len(COMMENT_COLUMNS)
+        
+        comments = [
+            (_comment_factory(None, comment_row[:author_at]), _user_at(comment_row, author_at))
+            for comment_row in comment_rows
+        ]
+        
+        return TicketDetail(
+            ticket=_ticket_factory(None, row[:owner_at]),
+            owner=_user_at(row, owner_at),
+            assignee=_user_at(row, assignee_at),
+            closer=_user_at(row, closer_at),
+            comments=comments
+        )
+    
+    # Outbox operations
+    async def get_due_outbox(self, limit: int = 100) -> List[OutboxMessage]:
+        """
+        Get pending outbox messages whose next attempt is due, oldest first.
+        
+        Up to limit due messages are returned, plus every other pending
+        message sharing a chat and digest key with one of them, so a digest
+        collects all events of its window even if some are not due yet.
+        Siblings that already failed are only added once due, so their
+        retry backoff is kept.
+        """
+        now = _now()
+        async with self._read() as db:
+            due = await _fetch_all(
+                db,
+                f"""
+                SELECT {OUTBOX_SELECT} FROM outbox
+                WHERE status = ? AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+                """,
+                (OUTBOX_STATUS_PENDING, now, limit),
+                _outbox_factory
+            )
+            
+            digests = {(message.chat_id, message.digest_key) for message in due if message.digest_key}
+            due_ids = {message.id for message in due}
+            for chat_id, digest_key in digests:
+                siblings = await _fetch_all(
+                    db,
+                    f"""
+                    SELECT {OUTBOX_SELECT} FROM outbox
+                    WHERE status = ? AND chat_id = ? AND digest_key = ?
+                      AND (attempts = 0 OR next_attempt_at <= ?)
+                    ORDER BY id
+                    """,
+                    (OUTBOX_STATUS_PENDING, chat_id, digest_key, now),
+                    _outbox_factory
+                )
+                due.extend(message for message in siblings if message.id not in due_ids)
+            return due
+    
+    async def complete_outbox(
+        self,
+        delivered: List[int],
+        retry: List[Tuple[int, int, str]],
+        dead: List[Tuple[int, str]],
+        deferred: Optional[List[Tuple[int, int]]] = None
+    ):
+        """
+        Record the outcome of one delivery batch in a single transaction.
+        
+        Delivered messages are deleted. retry holds (id, delay in seconds,
+        error) for messages to try again later, dead holds (id, error) for
+        messages that will not be retried; both count the failed attempt.
+        deferred holds (id, delay in seconds) for messages held back without
+        an attempt, e.g. because their chat used up its message budget.
+        """
+        now = _now()
+        
+        async def op(db: aiosqlite.Connection):
+            if deferred:
+                await db.executemany(
+                    "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + delay, message_id) for message_id, delay in deferred]
+                )
+            if delivered:
+                await db.execute(
+                    f"DELETE FROM outbox WHERE id IN ({', '.join('?' for _ in delivered)})", delivered
+                )
+            await db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                [(now + delay, error, message_id) for message_id, delay, error in retry]
+            )
+            await db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, status = ?, last_error = ? WHERE id = ?",
+                [(OUTBOX_STATUS_DEAD, error, message_id) for message_id, error in dead]
+            )
+        
+        await self._submit_write(op)
+        
+        if dead:
+            logger.warning(f"Outbox messages moved to dead letters: {[message_id for message_id, _ in dead]}")
+    
+    async def get_outbox_counts(self) -> Dict[str, int]:
+        """Number of outbox messages per status"""
+        async with self._read() as db:
+            async with db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status") as cursor:
+                return {status: count for status, count in await cursor.fetchall()}
+    
+    async def get_chat_health(self) -> List[ChatHealth]:
+        """Get the chats marked undeliverable, most recently updated first"""
+        async with self._read() as db:
+            return await _fetch_all(
+                db,
+                f"SELECT {CHAT_HEALTH_SELECT} FROM chat_health ORDER BY updated_at DESC, chat_id",
+                (),
+                _chat_health_factory
+            )
+    
+    async def save_chat_health(self, unreachable: List[ChatHealth], reachable: List[int]):
+        """Store the health of chats that failed and forget chats that were reached again"""
+        async def op(db: aiosqlite.Connection):
+            await db.executemany("DELETE FROM chat_health WHERE chat_id = ?", [(chat_id,) for chat_id in reachable])
+            await db.executemany(
+                f"""
+                INSERT INTO chat_health ({_columns(CHAT_HEALTH_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    state = excluded.state,
+                    failures = excluded.failures,
+                    last_error = excluded.last_error,
+                    updated_at = excluded.updated_at,
+                    next_probe_at = excluded.next_probe_at
+                """,
+                [
+                    (health.chat_id, health.state, health.failures, health.last_error,
+                     health.updated_at, health.next_probe_at)
+                    for health in unreachable
+                ]
+            )
+        
+        await self._submit_write(op)
@@ -0,0 +1,748 @@
+"""
+In-memory storage engine
+
+Implements the Storage protocol without any disk I/O: users, tickets and
+comments live in dicts, and ticket lists are served from sorted
+(created_at, id) indexes per status, user and judge. Used as a zero-I/O
+baseline for benchmarks and for short events that don't need a database;
+the data can be snapshotted into a SQLite file on shutdown.
+"""
+import os
+import re
+import heapq
+import itertools
+import aiosqlite
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import replace
+from datetime import datetime
+from typing import Optional, List, Dict, Tuple, Callable, Iterable, FrozenSet
+import logging
+
+from database.models import (
+    User, Ticket, Comment, TicketPage, TicketSearchPage, TicketDetail, OutboxMessage, Notice, ChatHealth,
+    TicketStatus, TicketType, OUTBOX_STATUS_PENDING, OUTBOX_STATUS_DEAD, ROLE_PLAYER, ROLE_ADMIN,
+    TICKET_STATUSES, TICKET_STATUS_OPEN, TICKET_STATUS_IN_PROGRESS, TICKET_STATUS_CLOSED
+)
+from database.migrations import (
+    apply_migrations, META_ADMIN_BOOTSTRAPPED,
+    COUNTER_SCOPE_ALL, COUNTER_SCOPE_USER, COUNTER_SCOPE_JUDGE
+)
+from database.db import _now, _to_datetime
+from database.roles import RoleDirectory
+
+logger = logging.getLogger(__name__)
+
+# Index key: (scope, owner_id, status); status None indexes every status
+IndexKey = Tuple[str, int, Optional[str]]
+
+
+def _to_epoch(value: Optional[datetime]) -> Optional[int]:
+    """Convert a model datetime back to the stored epoch"""
+    if value is None:
+        return None
+    return int(value.timestamp())
+
+
+def _sort_key(ticket: Ticket) -> Tuple[int, int]:
+    """Position of a ticket in the (created_at, id) indexes"""
+    return (_to_epoch(ticket.created_at), ticket.id)
+
+
+def _is_fresh(path: str) -> bool:
+    """Whether a snapshot can be written to path: no file there, or an empty one"""
+    return not os.path.exists(path) or os.path.getsize(path) == 0
+
+
+def _words(text: str) -> List[str]:
+    """Lower-cased words of a text, split the same way as the search query"""
+    return re.findall(r"\w+", text.lower())
+
+
+class MemoryDatabase:
+    """Storage engine keeping all data in process memory"""
+    
+    def __init__(self, snapshot_path: Optional[str] = None):
+        # Written as a SQLite database on close() when set
+        self.snapshot_path = snapshot_path or None
+        self.archive_path: Optional[str] = None
+        
+        self._users: Dict[int, User] = {}
+        self._usernames: Dict[str, int] = {}
+        # Every user write goes through _store_user, which keeps it current
+        self.roles = RoleDirectory()
+        self.roles.load(())
+        self._admin_bootstrapped = False
+        
+        self._tickets: Dict[int, Ticket] = {}
+        self._index: Dict[IndexKey, List[Tuple[int, int]]] = {}
+        self._ticket_ids = itertools.count(1)
+        
+        self._comments: Dict[int, Comment] = {}
+        self._ticket_comments: Dict[int, List[int]] = {}
+        self._comment_ids = itertools.count(1)
+        
+        # Undelivered notifications; pending ones also have a next attempt time
+        self._outbox: Dict[int, OutboxMessage] = {}
+        self._outbox_next: Dict[int, int] = {}
+        self._outbox_errors: Dict[int, str] = {}
+        self._outbox_ids = itertools.count(1)
+        
+        self._chat_health: Dict[int, ChatHealth] = {}
+        # ticket id -> (escalate_at, judges the ticket was routed to)
+        self._escalations: Dict[int, Tuple[int, FrozenSet[int]]] = {}
+    
+    async def open(self):
+        """Nothing to open; present for Storage compatibility"""
+    
+    async def close(self):
+        """Write the snapshot if one is configured, next to it if the file already has data"""
+        if not self.snapshot_path:
+            return
+        
+        path = self.snapshot_path
+        if not _is_fresh(path):
+            # Ids restart at 1 every run, so rows can't be merged into an older snapshot
+            root, ext = os.path.splitext(path)
+            path = f"{root}-{datetime.now():%Y%m%d-%H%M%S}{ext}"
+            logger.warning(f"Snapshot file {self.snapshot_path} already has data, writing {path} instead")
+        await self.snapshot(path)
+    
+    async def init_db(self):
+        """Nothing to migrate; present for Storage compatibility"""
+        logger.info("In-memory storage initialized")
+    
+    # Index maintenance
+    def _index_keys(self, ticket: Ticket) -> List[IndexKey]:
+        """Every index a ticket belongs to"""
+        owners = [(COUNTER_SCOPE_ALL, 0), (COUNTER_SCOPE_USER, ticket.user_id)]
+        if ticket.judge_id is not None:
+            owners.append((COUNTER_SCOPE_JUDGE, ticket.judge_id))
+        return [
+            (scope, owner_id, status)
+            for scope, owner_id in owners
+            for status in (ticket.status, None)
+        ]
+    
+    def _store_ticket(self, ticket: Ticket, previous: Optional[Ticket] = None):
+        """Save a new or changed ticket and move it between indexes"""
+        if previous is not None:
+            old_position = _sort_key(previous)
+            for key in self._index_keys(previous):
+                entries = self._index[key]
+                del entries[bisect_left(entries, old_position)]
+        
+        self._tickets[ticket.id] = ticket
+        position = _sort_key(ticket)
+        for key in self._index_keys(ticket):
+            insort(self._index.setdefault(key, []), position)
+    
+    def _store_user(self, user: User):
+        """Save a new or changed user and keep the username index and role directory"""
+        previous = self._users.get(user.id)
+        if previous is not None and previous.username and self._usernames.get(previous.username) == user.id:
+            del self._usernames[previous.username]
+        
+        self._users[user.id] = user
+        if user.username:
+            self._usernames[user.username] = user.id
+        
+        self.roles.update(user)
+    
+    def _enqueue_notices(self, notices: Iterable[Notice]):
+        """Add notifications to the outbox"""
+        now = _now()
+        for notice in notices:
+            message = OutboxMessage(
+                id=next(self._outbox_ids),
+                chat_id=notice.chat_id,
+                text=notice.text,
+                attempts=0,
+                created_at=_to_datetime(now),
+                digest_key=notice.digest_key
+            )
+            self._outbox[message.id] = message
+            self._outbox_next[message.id] = now + notice.delay
+    
+    # User operations
+    async def get_user(self, user_id: int) -> Optional[User]:
+        """Get user by ID"""
+        return self._users.get(user_id)
+    
+    async def create_user(self, user_id: int, username: Optional[str], first_name: str) -> User:
+        """Create new user, or refresh the names of an existing one. First user becomes admin."""
+        existing = self._users.get(user_id)
+        if existing is not None:
+            user = replace(existing, username=username, first_name=first_name)
+        else:
+            role = ROLE_PLAYER if self._admin_bootstrapped else ROLE_ADMIN
+            user = User(
+                id=user_id,
+                username=username,
+                first_name=first_name,
+                role=role,
+                created_at=_to_datetime(_now())
+            )
+        self._admin_bootstrapped = True
+        
+        self._store_user(user)
+        logger.info(f"User created: {user_id} ({username}) with role {user.role}")
+        return user
+    
+    async def update_user_role(
+        self, user_id: int, role: str, notify: Optional[Callable[[User], Iterable[Notice]]] = None
+    ) -> Optional[User]:
+        """Update user role. Returns the updated user, or None if there is no such user."""
+        existing = self._users.get(user_id)
+        if existing is None:
+            return None
+        
+        user = replace(existing, role=role)
+        self._store_user(user)
+        if notify is not None:
+            self._enqueue_notices(notify(user))
+        logger.info(f"User {user_id} role updated to {role}")
+        return user
+    
+    async def get_user_by_username(self, username: str) -> Optional[User]:
+        """Get user by username"""
+        user_id = self._usernames.get(username)
+        return self._users.get(user_id) if user_id is not None else None
+    
+    async def get_users(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """Get several users by ID, keyed by ID; unknown IDs are left out"""
+        return {user_id: self._users[user_id] for user_id in user_ids if user_id in self._users}
+    
+    async def get_judges(self) -> List[User]:
+        """Get all judges and admins"""
+        return list(self.roles.judges())
+    
+    # Ticket operations
+    async def create_ticket(
+        self,
+        user_id: int,
+        ticket_type: str,
+        description: str,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None,
+        escalate_after: Optional[int] = None,
+        routed: Iterable[int] = ()
+    ) -> Ticket:
+        """Create new ticket, scheduling its escalation with escalate_after"""
+        ticket = Ticket(
+            id=next(self._ticket_ids),
+            user_id=user_id,
+            ticket_type=TicketType(ticket_type),
+            description=description,
+            status=TICKET_STATUS_OPEN,
+            created_at=_to_datetime(_now()),
+            closed_at=None,
+            closed_by=None
+        )
+        self._store_ticket(ticket)
+        if escalate_after is not None:
+            self._escalations[ticket.id] = (_now() + escalate_after, frozenset(routed))
+        if notify is not None:
+            self._enqueue_notices(notify(ticket))
+        logger.info(f"Ticket created: {ticket.id} by user {user_id}")
+        return ticket
+    
+    async def get_ticket(self, ticket_id: int) -> Optional[Ticket]:
+        """Get ticket by ID"""
+        return self._tickets.get(ticket_id)
+    
+    def _list(self, scope: str, owner_id: int, status: Optional[str]) -> List[Ticket]:
+        """All tickets of one index, newest first"""
+        entries = self._index.get((scope, owner_id, status), [])
+        return [self._tickets[ticket_id] for _, ticket_id in reversed(entries)]
+    
+    async def get_user_tickets(self, user_id: int, status: Optional[str] = None) -> List[Ticket]:
+        """Get all tickets for a user, optionally filtered by status"""
+        return self._list(COUNTER_SCOPE_USER, user_id, status)
+    
+    async def get_all_tickets(self, status: Optional[str] = None) -> List[Ticket]:
+        """Get all tickets, optionally filtered by status"""
+        return self._list(COUNTER_SCOPE_ALL, 0, status)
+    
+    async def get_judge_tickets(self, judge_id: int, status: Optional[str] = None) -> List[Ticket]:
+        """Get all tickets assigned to a specific judge, optionally filtered by status"""
+        return self._list(COUNTER_SCOPE_JUDGE, judge_id, status)
+    
+    def _get_tickets_page(
+        self,
+        scope: str,
+        owner_id: int,
+        status: Optional[str],
+        after_id: Optional[int],
+        before_id: Optional[int],
+        limit: int
+    ) -> TicketPage:
+        """One page of tickets newest first, with the same anchors as the SQLite engine"""
+        entries = self._index.get((scope, owner_id, status), [])
+        anchor_id = after_id if after_id is not None else before_id
+        anchor = self._tickets.get(anchor_id) if anchor_id is not None else None
+        
+        if anchor_id is None:
+            window = entries[-(limit + 1):][::-1]
+        elif anchor is None:
+            window = []
+        elif after_id is not None:
+            end = bisect_left(entries, _sort_key(anchor))
+            window = entries[max(end - limit - 1, 0):end][::-1]
+        else:
+            start = bisect_right(entries, _sort_key(anchor))
+            window = entries[start:start + limit + 1]
+        
+        if anchor_id is not None and not window:
+            # Anchor ticket is gone or the list shrank: restart from the first page
+            return self._get_tickets_page(scope, owner_id, status, None, None, limit)
+        
+        has_more = len(window) > limit
+        window = window[:limit]
+        if before_id is not None:
+            window.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = after_id is not None, has_more
+        
+        return TicketPage(
+            tickets=[self._tickets[ticket_id] for _, ticket_id in window],
+            total=len(entries),
+            has_prev=has_prev,
+            has_next=has_next
+        )
+    
+    async def get_all_tickets_page(
+        self,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage:
+        """Get one page of all tickets, optionally filtered by status"""
+        return self._get_tickets_page(COUNTER_SCOPE_ALL, 0, status, after_id, before_id, limit)
+    
+    async def get_user_tickets_page(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage:
+        """Get one page of a user's tickets, optionally filtered by status"""
+        return self._get_tickets_page(COUNTER_SCOPE_USER, user_id, status, after_id, before_id, limit)
+    
+    async def get_judge_tickets_page(
+        self,
+        judge_id: int,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage:
+        """Get one page of tickets assigned to a judge, optionally filtered by status"""
+        return self._get_tickets_page(COUNTER_SCOPE_JUDGE, judge_id, status, after_id, before_id, limit)
+    
+    def _counts(self, scope: str, owner_id: int) -> Dict[str, int]:
+        """Per-status ticket counts of one scope, leaving out empty statuses"""
+        counts = {}
+        for status in TICKET_STATUSES:
+            count = len(self._index.get((scope, owner_id, status), ()))
+            if count:
+                counts[status] = count
+        return counts
+    
+    async def get_ticket_counts(
+        self, user_id: Optional[int] = None, judge_id: Optional[int] = None
+    ) -> Dict[str, int]:
+        """Get ticket counts per status for all tickets, a user's or a judge's"""
+        if user_id is not None:
+            return self._counts(COUNTER_SCOPE_USER, user_id)
+        if judge_id is not None:
+            return self._counts(COUNTER_SCOPE_JUDGE, judge_id)
+        return self._counts(COUNTER_SCOPE_ALL, 0)
+    
+    async def get_judges_ticket_counts(self) -> Dict[int, Dict[str, int]]:
+        """Get per-status ticket counts for every judge with assigned tickets"""
+        counts: Dict[int, Dict[str, int]] = {}
+        for (scope, judge_id, status), entries in self._index.items():
+            if scope == COUNTER_SCOPE_JUDGE and status is not None and entries:
+                counts.setdefault(judge_id, {})[status] = len(entries)
+        return counts
+    
+    async def search_tickets(
+        self,
+        query: str,
+        status: Optional[str] = None,
+        limit: int = 10,
+        cursor: int = 0
+    ) -> TicketSearchPage:
+        """
+        Search ticket descriptions and comment texts by word prefixes.
+        
+        Every query word must start some word of the ticket or its comments.
+        There is no relevance ranking: hits come newest first.
+        """
+        terms = _words(query)
+        if not terms:
+            return TicketSearchPage(tickets=[], cursor=0, next_cursor=None)
+        
+        def matches(ticket: Ticket) -> bool:
+            words = _words(ticket.description)
+            for comment_id in self._ticket_comments.get(ticket.id, ()):
+                words += _words(self._comments[comment_id].text)
+            return all(any(word.startswith(term) for word in words) for term in terms)
+        
+        hits = (ticket for ticket in self._list(COUNTER_SCOPE_ALL, 0, status) if matches(ticket))
+        page = list(itertools.islice(hits, cursor, cursor + limit + 1))
+        
+        return TicketSearchPage(
+            tickets=page[:limit],
+            cursor=cursor,
+            next_cursor=cursor + limit if len(page) > limit else None
+        )
+    
+    async def update_ticket_status(
+        self,
+        ticket_id: int,
+        status: str,
+        closed_by: Optional[int] = None,
+        judge_id: Optional[int] = None,
+        from_statuses: Optional[Tuple[str, ...]] = None,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None
+    ) -> Optional[Ticket]:
+        """
+        Update ticket status and optionally assign judge.
+        
+        If from_statuses is given, the update only applies while the ticket
+        is in one of those statuses. Returns the updated ticket, or None if
+        nothing changed.
+        """
+        previous = self._tickets.get(ticket_id)
+        if previous is None or (from_statuses and previous.status not in from_statuses):
+            logger.info(f"Ticket {ticket_id} status not updated to {status}: no matching row")
+            return None
+        
+        ticket = replace(
+            previous,
+            status=TicketStatus(status),
+            closed_at=_to_datetime(_now()) if status == TICKET_STATUS_CLOSED else None,
+            closed_by=closed_by,
+            judge_id=judge_id if judge_id is not None else previous.judge_id
+        )
+        self._store_ticket(ticket, previous)
+        if notify is not None:
+            self._enqueue_notices(notify(ticket))
+        logger.info(f"Ticket {ticket_id} status updated to {status}")
+        return ticket
+    
+    async def get_old_open_tickets(self, days: int) -> List[Ticket]:
+        """Get tickets older than specified days that are still open or in progress"""
+        cutoff = (_now() - days * 86400, float("inf"))
+        old = [
+            entries[:bisect_right(entries, cutoff)]
+            for entries in (
+                self._index.get((COUNTER_SCOPE_ALL, 0, TICKET_STATUS_OPEN), []),
+                self._index.get((COUNTER_SCOPE_ALL, 0, TICKET_STATUS_IN_PROGRESS), [])
+            )
+        ]
+        return [self._tickets[ticket_id] for _, ticket_id in heapq.merge(*old)]
+    
+    async def pop_due_escalations(
+        self, notify: Optional[Callable[[Ticket, FrozenSet[int]], Iterable[Notice]]] = None
+    ) -> List[Ticket]:
+        """Take the escalations that are due and return their tickets still open, earliest due first"""
+        now = _now()
+        due = sorted(
+            (escalate_at, ticket_id)
+            for ticket_id, (escalate_at, _) in self._escalations.items() if escalate_at <= now
+        )
+        tickets = []
+        notices = []
+        for _, ticket_id in due:
+            _, routed = self._escalations.pop(ticket_id)
+            ticket = self._tickets.get(ticket_id)
+            if ticket is not None and ticket.status == TICKET_STATUS_OPEN:
+                tickets.append(ticket)
+                if notify is not None:
+                    notices.extend(notify(ticket, routed))
+        self._enqueue_notices(notices)
+        return tickets
+    
+    async def close_tickets(
+        self,
+        ticket_ids: List[int],
+        comment_text: str,
+        closed_by: Optional[int] = None,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None
+    ) -> List[Ticket]:
+        """
+        Close several tickets and add the same comment to each.
+        
+        Tickets that are already closed are skipped. The comment author is
+        closed_by, or the ticket owner for system closes. Returns the tickets
+        that were actually closed.
+        """
+        closed_at = _now()
+        tickets = []
+        
+        for ticket_id in sorted(set(ticket_ids)):
+            previous = self._tickets.get(ticket_id)
+            if previous is None or previous.status == TICKET_STATUS_CLOSED:
+                continue
+            
+            ticket = replace(
+                previous,
+                status=TICKET_STATUS_CLOSED,
+                closed_at=_to_datetime(closed_at),
+                closed_by=closed_by
+            )
+            self._store_ticket(ticket, previous)
+            self._add_comment(
+                ticket_id, closed_by if closed_by is not None else ticket.user_id, comment_text, closed_at
+            )
+            tickets.append(ticket)
+            if notify is not None:
+                self._enqueue_notices(notify(ticket))
+        
+        logger.info(f"Closed {len(tickets)} of {len(ticket_ids)} tickets in bulk")
+        return tickets
+    
+    async def archive_closed_tickets(self, days: int, batch_size: int = 500) -> int:
+        """The in-memory engine has no archive; nothing is moved"""
+        return 0
+    
+    # Comment operations
+    def _add_comment(self, ticket_id: int, judge_id: int, text: str, created_at: int) -> Comment:
+        """Store a comment and link it to its ticket"""
+        comment = Comment(
+            id=next(self._comment_ids),
+            ticket_id=ticket_id,
+            judge_id=judge_id,
+            text=text,
+            created_at=_to_datetime(created_at)
+        )
+        self._comments[comment.id] = comment
+        self._ticket_comments.setdefault(ticket_id, []).append(comment.id)
+        return comment
+    
+    async def create_comment(
+        self,
+        ticket_id: int,
+        judge_id: int,
+        text: str,
+        notify: Optional[Callable[[Comment], Iterable[Notice]]] = None
+    ) -> Comment:
+        """Create new comment on ticket"""
+        comment = self._add_comment(ticket_id, judge_id, text, _now())
+        if notify is not None:
+            self._enqueue_notices(notify(comment))
+        logger.info(f"Comment created: {comment.id} on ticket {ticket_id}")
+        return comment
+    
+    async def get_comment(self, comment_id: int) -> Optional[Comment]:
+        """Get comment by ID"""
+        return self._comments.get(comment_id)
+    
+    async def get_ticket_comments(self, ticket_id: int) -> List[Comment]:
+        """Get all comments for a ticket"""
+        return [self._comments[comment_id] for comment_id in self._ticket_comments.get(ticket_id, ())]
+    
+    async def get_ticket_detail(self, ticket_id: int) -> Optional[TicketDetail]:
+        """Get ticket with owner, assigned judge, closer and comments with authors"""
+        ticket = self._tickets.get(ticket_id)
+        if ticket is None:
+            return None
+        
+        return TicketDetail(
+            ticket=ticket,
+            owner=self._users.get(ticket.user_id),
+            assignee=self._users.get(ticket.judge_id),
+            closer=self._users.get(ticket.closed_by),
+            comments=[
+                (comment, self._users.get(comment.judge_id))
+                for comment in await self.get_ticket_comments(ticket_id)
+            ]
+        )
+    
+    # Outbox operations
+    async def get_due_outbox(self, limit: int = 100) -> List[OutboxMessage]:
+        """
+        Get pending outbox messages whose next attempt is due, oldest first,
+        plus the pending messages sharing a chat and digest key with them
+        that were not tried yet or are due as well.
+        """
+        now = _now()
+        due_ids = [
+            message_id for _, message_id in sorted(
+                (next_at, message_id) for message_id, next_at in self._outbox_next.items() if next_at <= now
+            )[:limit]
+        ]
+        due = [self._outbox[message_id] for message_id in due_ids]
+        
+        digests = {(message.chat_id, message.digest_key) for message in due if message.digest_key}
+        taken = set(due_ids)
+        for message_id in sorted(self._outbox_next):
+            message = self._outbox[message_id]
+            if message_id in taken or (message.chat_id, message.digest_key) not in digests:
+                continue
+            if message.attempts == 0 or self._outbox_next[message_id] <= now:
+                due.append(message)
+        return due
+    
+    async def complete_outbox(
+        self,
+        delivered: List[int],
+        retry: List[Tuple[int, int, str]],
+        dead: List[Tuple[int, str]],
+        deferred: Optional[List[Tuple[int, int]]] = None
+    ):
+        """Record the outcome of one delivery batch; delivered messages are dropped"""
+        now = _now()
+        for message_id, delay in deferred or []:
+            self._outbox_next[message_id] = now + delay
+        for message_id in delivered:
+            self._outbox.pop(message_id, None)
+            self._outbox_next.pop(message_id, None)
+            self._outbox_errors.pop(message_id, None)
+        for message_id, delay, error in retry:
+            message = self._outbox[message_id]
+            self._outbox[message_id] = replace(message, attempts=message.attempts + 1)
+            self._outbox_next[message_id] = now + delay
+            self._outbox_errors[message_id] = error
+        for message_id, error in dead:
+            message = self._outbox[message_id]
+            self._outbox[message_id] = replace(message, attempts=message.attempts + 1)
+            self._outbox_next.pop(message_id, None)
+            self._outbox_errors[message_id] = error
+        
+        if dead:
+            logger.warning(f"Outbox messages moved to dead letters: {[message_id for message_id, _ in dead]}")
+    
+    async def get_outbox_counts(self) -> Dict[str, int]:
+        """Number of outbox messages per status"""
+        counts = {}
+        pending = len(self._outbox_next)
+        if pending:
+            counts[OUTBOX_STATUS_PENDING] = pending
+        if len(self._outbox) > pending:
+            counts[OUTBOX_STATUS_DEAD] = len(self._outbox) - pending
+        return counts
+    
+    async def get_chat_health(self) -> List[ChatHealth]:
+        """Get the chats marked undeliverable, most recently updated first"""
+        return sorted(
+            self._chat_health.values(), key=lambda health: (-health.updated_at.timestamp(), health.chat_id)
+        )
+    
+    async def save_chat_health(self, unreachable: List[ChatHealth], reachable: List[int]):
+        """Store the health of chats that failed and forget chats that were reached again"""
+        for chat_id in reachable:
+            self._chat_health.pop(chat_id, None)
+        for health in unreachable:
+            self._chat_health[health.chat_id] = health
+    
+    async def snapshot(self, path: str):
+        """
+        Write all users, tickets and comments into a new SQLite database file.
+        
+        The file gets the full schema, so the bot can later run on it with the
+        SQLite engine. Datetimes and enums are stored through the codec
+        adapters registered in database.db. The target must not exist or be
+        empty: this engine's ids restart at 1 every run, so they would collide
+        with unrelated rows of an earlier snapshot.
+        """
+        if not _is_fresh(path):
+            raise FileExistsError(f"Snapshot target {path} already exists and is not empty")
+        
+        conn = await aiosqlite.connect(path, isolation_level=None)
+        try:
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                await apply_migrations(conn)
+                await conn.executemany(
+                    """
+                    INSERT INTO users (id, username, first_name, role, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (user.id, user.username, user.first_name, user.role, user.created_at)
+                        for user in self._users.values()
+                    ]
+                )
+                await conn.executemany(
+                    """
+                    INSERT INTO tickets (id, user_id, ticket_type, description, status,
+                                         created_at, closed_at, closed_by, judge_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (
+                            ticket.id, ticket.user_id, ticket.ticket_type, ticket.description,
+                            ticket.status, ticket.created_at, ticket.closed_at,
+                            ticket.closed_by, ticket.judge_id
+                        )
+                        for ticket in self._tickets.values()
+                    ]
+                )
+                await conn.executemany(
+                    """
+                    INSERT INTO comments (id, ticket_id, judge_id, text, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (comment.id, comment.ticket_id, comment.judge_id, comment.text, comment.created_at)
+                        for comment in self._comments.values()
+                    ]
+                )
+                await conn.executemany(
+                    """
+                    INSERT INTO outbox (id, chat_id, text, status, attempts, next_attempt_at, last_error,
+                                        created_at, digest_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (
+                            message.id, message.chat_id, message.text,
+                            OUTBOX_STATUS_PENDING if message.id in self._outbox_next else OUTBOX_STATUS_DEAD,
+                            message.attempts, self._outbox_next.get(message.id, _now()),
+                            self._outbox_errors.get(message.id), message.created_at, message.digest_key
+                        )
+                        for message in self._outbox.values()
+                    ]
+                )
+                await conn.executemany(
+                    """
+                    INSERT INTO chat_health (chat_id, state, failures, last_error, updated_at, next_probe_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (
+                            health.chat_id, health.state, health.failures, health.last_error,
+                            health.updated_at, health.next_probe_at
+                        )
+                        for health in self._chat_health.values()
+                    ]
+                )
+                await conn.executemany(
+                    "INSERT INTO ticket_escalations (ticket_id, escalate_at, routed) VALUES (?, ?, ?)",
+                    [
+                        (ticket_id, escalate_at, routed)
+                        for ticket_id, (escalate_at, routed) in self._escalations.items()
+                    ]
+                )
+                if self._admin_bootstrapped:
+                    await conn.execute(
+                        "INSERT INTO meta (key, value) VALUES (?, '1')",
+                        (META_ADMIN_BOOTSTRAPPED,)
+                    )
+            except BaseException:
+                await conn.execute("ROLLBACK")
+                raise
+            await conn.execute("COMMIT")
+        finally:
+            await conn.close()
+        
+        logger.info(
+            f"In-memory snapshot written to {path}: {len(self._users)} users, "
+            f"{len(self._tickets)} tickets, {len(self._comments)} comments"
+        )
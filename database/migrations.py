@@ -0,0 +1,419 @@
+"""
+Versioned schema migrations tracked in PRAGMA user_version
+"""
+import aiosqlite
+from typing import Awaitable, Callable, List, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Timestamps are stored as integer Unix epochs (seconds, UTC) so range
+# filters on them stay sargable; this default matches CURRENT_TIMESTAMP.
+EPOCH_NOW = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+# Scopes of the ticket_counters table; owner_id is 0 for the global scope
+COUNTER_SCOPE_ALL = "all"
+COUNTER_SCOPE_USER = "user"
+COUNTER_SCOPE_JUDGE = "judge"
+
+# meta key set once the first registered user has been made admin
+META_ADMIN_BOOTSTRAPPED = "admin_bootstrapped"
+
+
+async def _create_schema(db: aiosqlite.Connection):
+    """Create base tables (no-op for tables that already exist)"""
+    # Create users table
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'player',
+            created_at TIMESTAMP NOT NULL DEFAULT {EPOCH_NOW}
+        )
+    """)
+    
+    # Create tickets table
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ticket_type TEXT NOT NULL,
+            description TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at TIMESTAMP NOT NULL DEFAULT {EPOCH_NOW},
+            closed_at TIMESTAMP,
+            closed_by INTEGER,
+            judge_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (closed_by) REFERENCES users(id),
+            FOREIGN KEY (judge_id) REFERENCES users(id)
+        )
+    """)
+    
+    # Create comments table
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER NOT NULL,
+            judge_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT {EPOCH_NOW},
+            FOREIGN KEY (ticket_id) REFERENCES tickets(id),
+            FOREIGN KEY (judge_id) REFERENCES users(id)
+        )
+    """)
+    
+    # Databases created before judge assignment existed lack judge_id
+    cursor = await db.execute("PRAGMA table_info(tickets)")
+    columns = [row[1] for row in await cursor.fetchall()]
+    
+    if 'judge_id' not in columns:
+        logger.info("Column 'judge_id' not found, adding it now...")
+        await db.execute("ALTER TABLE tickets ADD COLUMN judge_id INTEGER")
+        logger.info("Successfully added judge_id column to tickets table")
+
+
+async def _epoch_timestamps(db: aiosqlite.Connection):
+    """Convert text timestamps to integer epochs in place"""
+    # CURRENT_TIMESTAMP values are UTC; closed_at used to be written
+    # from datetime.now(), i.e. local time.
+    for table, column, modifier in (
+        ("users", "created_at", ""),
+        ("tickets", "created_at", ""),
+        ("tickets", "closed_at", ", 'utc'"),
+        ("comments", "created_at", ""),
+    ):
+        cursor = await db.execute(
+            f"UPDATE {table} SET {column} = CAST(strftime('%s', {column}{modifier}) AS INTEGER) "
+            f"WHERE typeof({column}) = 'text'"
+        )
+        if cursor.rowcount:
+            logger.info(f"Converted {cursor.rowcount} {table}.{column} values to epoch timestamps")
+
+
+async def _list_indexes(db: aiosqlite.Connection):
+    """Create indexes matching the ticket list queries"""
+    # Equality columns first, then created_at so ORDER BY created_at DESC
+    # (and the implicit rowid tie-breaker) is read straight from the index
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_created_at ON tickets(created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_status_created ON tickets(status, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_judge_status_created ON tickets(judge_id, status, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_user_created ON tickets(user_id, created_at)")
+    # Small partial index for the auto-close scan over unfinished tickets
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tickets_active_created ON tickets(created_at) "
+        "WHERE status IN ('open', 'in_progress')"
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_comments_ticket_created ON comments(ticket_id, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_staff_created ON users(created_at) "
+        "WHERE role IN ('judge', 'admin')"
+    )
+    
+    # Single-column indexes superseded by the composite ones above
+    await db.execute("DROP INDEX IF EXISTS idx_tickets_user_id")
+    await db.execute("DROP INDEX IF EXISTS idx_tickets_status")
+    await db.execute("DROP INDEX IF EXISTS idx_tickets_judge_id")
+    await db.execute("DROP INDEX IF EXISTS idx_comments_ticket_id")
+
+
+def _counter_changes(row: str, delta: int) -> str:
+    """Trigger statements applying delta to every counter the given row (NEW/OLD) belongs to"""
+    if delta > 0:
+        bump = f"""
+            INSERT INTO ticket_counters (scope, owner_id, status, count)
+            SELECT '{{scope}}', {{owner}}, {row}.status, 1 WHERE {{owner}} IS NOT NULL
+            ON CONFLICT (scope, owner_id, status) DO UPDATE SET count = count + 1;
+        """
+    else:
+        bump = f"""
+            UPDATE ticket_counters SET count = count - 1
+            WHERE scope = '{{scope}}' AND owner_id = {{owner}} AND status = {row}.status;
+        """
+    return "".join(
+        bump.format(scope=scope, owner=owner)
+        for scope, owner in (
+            (COUNTER_SCOPE_ALL, "0"),
+            (COUNTER_SCOPE_USER, f"{row}.user_id"),
+            (COUNTER_SCOPE_JUDGE, f"{row}.judge_id"),
+        )
+    )
+
+
+async def _ticket_counters(db: aiosqlite.Connection):
+    """Add trigger-maintained ticket counts per status, per user and per judge"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ticket_counters (
+            scope TEXT NOT NULL,
+            owner_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, owner_id, status)
+        ) WITHOUT ROWID
+    """)
+    
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_count_insert AFTER INSERT ON tickets
+        BEGIN
+            {_counter_changes("NEW", 1)}
+        END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_count_delete AFTER DELETE ON tickets
+        BEGIN
+            {_counter_changes("OLD", -1)}
+        END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_count_update AFTER UPDATE OF status, user_id, judge_id ON tickets
+        WHEN OLD.status IS NOT NEW.status
+            OR OLD.user_id IS NOT NEW.user_id
+            OR OLD.judge_id IS NOT NEW.judge_id
+        BEGIN
+            {_counter_changes("OLD", -1)}
+            {_counter_changes("NEW", 1)}
+        END
+    """)
+    
+    # Seed counters from the existing tickets
+    await db.execute("DELETE FROM ticket_counters")
+    await db.execute(f"""
+        INSERT INTO ticket_counters (scope, owner_id, status, count)
+        SELECT '{COUNTER_SCOPE_ALL}', 0, status, COUNT(*) FROM tickets GROUP BY status
+    """)
+    await db.execute(f"""
+        INSERT INTO ticket_counters (scope, owner_id, status, count)
+        SELECT '{COUNTER_SCOPE_USER}', user_id, status, COUNT(*) FROM tickets GROUP BY user_id, status
+    """)
+    await db.execute(f"""
+        INSERT INTO ticket_counters (scope, owner_id, status, count)
+        SELECT '{COUNTER_SCOPE_JUDGE}', judge_id, status, COUNT(*) FROM tickets
+        WHERE judge_id IS NOT NULL GROUP BY judge_id, status
+    """)
+
+
+async def _full_text_search(db: aiosqlite.Connection):
+    """Add FTS5 indexes over ticket descriptions and comment texts, kept in sync by triggers"""
+    for table, column in (("tickets", "description"), ("comments", "text")):
+        fts = f"{table}_fts"
+        await db.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {column},
+                content='{table}',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {fts} (rowid, {column}) VALUES (NEW.id, NEW.{column});
+            END
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column});
+            END
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {column} ON {table}
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column});
+                INSERT INTO {fts} (rowid, {column}) VALUES (NEW.id, NEW.{column});
+            END
+        """)
+        # Index the rows that already exist
+        await db.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+async def _meta_table(db: aiosqlite.Connection):
+    """Add a key/value meta table and record whether the bootstrap admin exists"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+    # Databases that already have users handed out the admin role long ago
+    await db.execute(
+        "INSERT OR IGNORE INTO meta (key, value) SELECT ?, '1' WHERE EXISTS (SELECT 1 FROM users)",
+        (META_ADMIN_BOOTSTRAPPED,)
+    )
+
+
+async def _outbox(db: aiosqlite.Connection):
+    """Add the notification outbox drained by the outbox worker"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL
+        )
+    """)
+    # Delivered rows are deleted, so the worker's scan only sees pending work
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at) WHERE status = 'pending'"
+    )
+
+
+async def _outbox_digests(db: aiosqlite.Connection):
+    """Let outbox messages to the same chat be coalesced into one digest"""
+    await db.execute("ALTER TABLE outbox ADD COLUMN digest_key TEXT")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_digest ON outbox(chat_id, digest_key)
+        WHERE status = 'pending' AND digest_key IS NOT NULL
+    """)
+
+
+async def _chat_health(db: aiosqlite.Connection):
+    """Track chats the bot cannot deliver to, so senders skip them"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_health (
+            chat_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            failures INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            updated_at TIMESTAMP NOT NULL,
+            next_probe_at TIMESTAMP NOT NULL
+        )
+    """)
+
+
+async def _ticket_escalations(db: aiosqlite.Connection):
+    """Add the pending escalations of tickets routed to a few judges only"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ticket_escalations (
+            ticket_id INTEGER PRIMARY KEY,
+            escalate_at TIMESTAMP NOT NULL
+        )
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ticket_escalations_due ON ticket_escalations(escalate_at)"
+    )
+
+
+async def _closed_index(db: aiosqlite.Connection):
+    """Index closed tickets by close time for the archiving job"""
+    # Partial, so it only holds closed tickets; the leading status column
+    # makes the planner prefer it over idx_tickets_status_created
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tickets_closed_at ON tickets(status, closed_at) WHERE status = 'closed'"
+    )
+
+
+async def _judge_index(db: aiosqlite.Connection):
+    """Index a judge's tickets by creation time for their list across all statuses"""
+    # idx_tickets_judge_status_created only orders tickets within one status
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_judge_created ON tickets(judge_id, created_at)")
+
+
+async def _escalation_routed(db: aiosqlite.Connection):
+    """Remember which judges a ticket was routed to, so its escalation skips them"""
+    # Comma-separated judge ids; rows from before this step escalate to everyone
+    await db.execute("ALTER TABLE ticket_escalations ADD COLUMN routed TEXT NOT NULL DEFAULT ''")
+
+
+# Ordered list of (version, description, step). Append new steps at the end
+# and never edit a released one. Steps must not rebuild tables: use
+# ALTER TABLE ... ADD COLUMN and CREATE INDEX, which leave rows in place.
+MIGRATIONS: List[Tuple[int, str, Callable[[aiosqlite.Connection], Awaitable[None]]]] = [
+    (1, "base schema", _create_schema),
+    (2, "integer epoch timestamps", _epoch_timestamps),
+    (3, "ticket list indexes", _list_indexes),
+    (4, "trigger-maintained ticket counters", _ticket_counters),
+    (5, "full-text search", _full_text_search),
+    (6, "meta table with admin bootstrap flag", _meta_table),
+    (7, "notification outbox", _outbox),
+    (8, "outbox digest keys", _outbox_digests),
+    (9, "chat delivery health", _chat_health),
+    (10, "ticket escalations", _ticket_escalations),
+    (11, "closed ticket index", _closed_index),
+    (12, "judge ticket index", _judge_index),
+    (13, "escalation routed judges", _escalation_routed),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """Read the schema version stored in the database header"""
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+    """
+    Apply pending migrations and return the resulting schema version.
+    
+    Must run inside the caller's write transaction, so either every
+    pending step lands together with the new user_version or none does.
+    """
+    # Re-read under the write lock: another process may have migrated already
+    version = await get_schema_version(db)
+    
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than supported version {SCHEMA_VERSION}"
+        )
+    
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        logger.info(f"Applying migration {step_version}: {description}")
+        await step(db)
+        version = step_version
+    
+    # PRAGMA does not accept bound parameters; version is always an int here
+    await db.execute(f"PRAGMA user_version = {int(version)}")
+    return version
+
+
+# Alias of the attached archive database holding moved-out closed tickets
+ARCHIVE_SCHEMA = "archive"
+
+
+async def create_archive_schema(db: aiosqlite.Connection):
+    """
+    Create the archive tables in the attached archive database.
+    
+    Archived rows keep their original ids, so the archive has no
+    AUTOINCREMENT, triggers or full-text indexes, only the indexes
+    that the fall-through lookups use.
+    """
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.tickets (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            ticket_type TEXT NOT NULL,
+            description TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            closed_at TIMESTAMP,
+            closed_by INTEGER,
+            judge_id INTEGER
+        )
+    """)
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.comments (
+            id INTEGER PRIMARY KEY,
+            ticket_id INTEGER NOT NULL,
+            judge_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    """)
+    await db.execute(
+        f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_tickets_user_created ON tickets(user_id, created_at)"
+    )
+    await db.execute(
+        f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_comments_ticket_created ON comments(ticket_id, created_at)"
+    )
@@ -3,10 +3,42 @@ Database models and schema definitions
 """
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from enum import Enum
+from typing import Optional, List, Tuple
+
+class _StrEnum(str, Enum):
+    """
+    Enum whose members are their own string values.
+    
+    Members compare and hash equal to the plain strings stored in the
+    database and used in callback data, and format as the bare value.
+    """
+    
+    def __str__(self) -> str:
+        return self.value
+    
+    __format__ = str.__format__
+
+
+class TicketType(_StrEnum):
+    """Ticket types"""
+    MATCH_RESCHEDULE = "match_reschedule"
+    OPPONENT_COMPLAINT = "opponent_complaint"
+    HELP_NEEDED = "help_needed"
+
+
+class TicketStatus(_StrEnum):
+    """Ticket statuses"""
+    OPEN = "open"
+    IN_PROGRESS = "in_progress"
+    CLOSED = "closed"
 
 
-@dataclass
+# Models are slotted and immutable: they are built straight from query rows
+# and the same instances are shared through the user cache.
+
+
+@dataclass(slots=True, frozen=True)
 class User:
     """User model"""
     id: int
@@ -16,21 +48,21 @@ class User:
     created_at: datetime
     
     
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Ticket:
     """Ticket (complaint) model"""
     id: int
     user_id: int
-    ticket_type: str  # match_reschedule, opponent_complaint, help_needed
+    ticket_type: TicketType
     description: str
-    status: str  # open, in_progress, closed
+    status: TicketStatus
     created_at: datetime
     closed_at: Optional[datetime]
     closed_by: Optional[int]
     judge_id: Optional[int] = None  # Judge assigned to the ticket
     
     
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Comment:
     """Comment model for judge notes on tickets"""
     id: int
@@ -38,12 +70,71 @@ class Comment:
     judge_id: int
     text: str
     created_at: datetime
+    
+    
+@dataclass(slots=True, frozen=True)
+class TicketPage:
+    """One page of a keyset-paginated ticket list"""
+    tickets: List[Ticket]
+    total: int  # Number of tickets matching the filter across all pages
+    has_prev: bool
+    has_next: bool
+    
+    
+@dataclass(slots=True, frozen=True)
+class TicketSearchPage:
+    """One page of ranked full-text search results"""
+    tickets: List[Ticket]
+    cursor: int  # Offset of this page in the ranked results
+    next_cursor: Optional[int]  # None on the last page
+    
+    
+@dataclass(slots=True, frozen=True)
+class TicketDetail:
+    """Ticket together with the users and comments shown in its detail view"""
+    ticket: Ticket
+    owner: Optional[User]
+    assignee: Optional[User]  # Judge assigned to the ticket
+    closer: Optional[User]  # None for system closes
+    comments: List[Tuple[Comment, Optional[User]]]  # Each comment with its author
+    
+    
+@dataclass(slots=True, frozen=True)
+class OutboxMessage:
+    """Pending notification in the outbox"""
+    id: int
+    chat_id: int
+    text: str
+    attempts: int  # Failed deliveries so far
+    created_at: datetime
+    digest_key: Optional[str] = None
+    
+    
+@dataclass(slots=True, frozen=True)
+class Notice:
+    """Notification to write to the outbox together with a change"""
+    chat_id: int
+    text: str
+    # Pending messages with the same key to one chat are sent as a single digest
+    digest_key: Optional[str] = None
+    delay: int = 0  # Seconds to hold the message back: the digest's coalescing window
+    
+    
+@dataclass(slots=True, frozen=True)
+class ChatHealth:
+    """Delivery health of a chat the bot currently cannot reach"""
+    chat_id: int
+    state: str  # blocked, deactivated, not_found
+    failures: int  # Consecutive failed deliveries
+    last_error: Optional[str]
+    updated_at: datetime
+    next_probe_at: datetime  # Messages are held until then; the next one probes the chat
 
 
 # Ticket type constants
-TICKET_TYPE_MATCH_RESCHEDULE = "match_reschedule"
-TICKET_TYPE_OPPONENT_COMPLAINT = "opponent_complaint"
-TICKET_TYPE_HELP_NEEDED = "help_needed"
+TICKET_TYPE_MATCH_RESCHEDULE = TicketType.MATCH_RESCHEDULE
+TICKET_TYPE_OPPONENT_COMPLAINT = TicketType.OPPONENT_COMPLAINT
+TICKET_TYPE_HELP_NEEDED = TicketType.HELP_NEEDED
 
 TICKET_TYPES = {
     TICKET_TYPE_MATCH_RESCHEDULE: "Перенос матча",
@@ -52,9 +143,9 @@ TICKET_TYPES = {
 }
 
 # Ticket status constants
-TICKET_STATUS_OPEN = "open"
-TICKET_STATUS_IN_PROGRESS = "in_progress"
-TICKET_STATUS_CLOSED = "closed"
+TICKET_STATUS_OPEN = TicketStatus.OPEN
+TICKET_STATUS_IN_PROGRESS = TicketStatus.IN_PROGRESS
+TICKET_STATUS_CLOSED = TicketStatus.CLOSED
 
 TICKET_STATUSES = {
     TICKET_STATUS_OPEN: "Открыта",
@@ -62,6 +153,21 @@ TICKET_STATUSES = {
     TICKET_STATUS_CLOSED: "Закрыта"
 }
 
+# Outbox status constants; delivered messages are deleted
+OUTBOX_STATUS_PENDING = "pending"
+OUTBOX_STATUS_DEAD = "dead"
+
+# Chat health states; reachable chats have no chat_health row
+CHAT_STATE_BLOCKED = "blocked"
+CHAT_STATE_DEACTIVATED = "deactivated"
+CHAT_STATE_NOT_FOUND = "not_found"
+
+CHAT_STATES = {
+    CHAT_STATE_BLOCKED: "Бот заблокирован",
+    CHAT_STATE_DEACTIVATED: "Аккаунт удален",
+    CHAT_STATE_NOT_FOUND: "Чат не найден"
+}
+
 # User role constants
 ROLE_PLAYER = "player"
 ROLE_JUDGE = "judge"
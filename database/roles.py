@@ -0,0 +1,54 @@
+"""
+In-process directory of judges and admins
+"""
+from typing import Dict, Iterable, List, Optional
+
+from database.models import User, ROLE_JUDGE, ROLE_ADMIN
+
+
+class RoleDirectory:
+    """Judges and admins by id, the recipients of every fan-out notification"""
+    
+    def __init__(self):
+        # Loaded once at startup and kept current by the storage engine's user
+        # writes; role changes made outside this process are seen after a restart
+        self.loaded = False
+        self._staff: Dict[int, User] = {}
+        # Staff ordered by created_at, rebuilt on the first read after a change
+        self._ordered: Optional[List[User]] = None
+    
+    def load(self, users: Iterable[User]):
+        """Replace the directory with the staff among users"""
+        self._staff = {user.id: user for user in users if user.role in (ROLE_JUDGE, ROLE_ADMIN)}
+        self._ordered = None
+        self.loaded = True
+    
+    def update(self, user: User):
+        """Record a new or changed user: staff are added or refreshed, everyone else dropped"""
+        if user.role in (ROLE_JUDGE, ROLE_ADMIN):
+            self._staff[user.id] = user
+        elif self._staff.pop(user.id, None) is None:
+            return
+        self._ordered = None
+    
+    def role(self, user_id: int) -> Optional[str]:
+        """Role of a judge or admin, None for everyone else"""
+        user = self._staff.get(user_id)
+        return user.role if user is not None else None
+    
+    def is_judge(self, user_id: int) -> bool:
+        """Whether the user has judge access; admins have it too"""
+        return user_id in self._staff
+    
+    def is_admin(self, user_id: int) -> bool:
+        """Whether the user is an admin"""
+        return self.role(user_id) == ROLE_ADMIN
+    
+    def judges(self) -> List[User]:
+        """Judges and admins, oldest first; the list is shared, do not modify it"""
+        if self._ordered is None:
+            self._ordered = sorted(self._staff.values(), key=lambda user: user.created_at)
+        return self._ordered
+    
+    def __len__(self) -> int:
+        return len(self._staff)
@@ -0,0 +1,163 @@
+"""
+Storage protocol shared by the database engines
+
+Handlers, middlewares, the scheduler and the outbox worker only use the
+methods below, so any engine implementing them can back the bot: the
+SQLite engine in database.db or the in-memory engine in database.memory.
+"""
+from typing import Optional, List, Dict, Tuple, Callable, Iterable, FrozenSet, Protocol, runtime_checkable
+
+from database.models import (
+    User, Ticket, Comment, TicketPage, TicketSearchPage, TicketDetail, OutboxMessage, Notice, ChatHealth
+)
+from database.roles import RoleDirectory
+
+
+@runtime_checkable
+class Storage(Protocol):
+    """Operations the bot needs from a storage engine"""
+    
+    # None when the engine has no archive
+    archive_path: Optional[str]
+    
+    # Judges and admins, kept current by create_user/update_user_role
+    roles: RoleDirectory
+    
+    # Lifecycle
+    async def open(self) -> None: ...
+    
+    async def close(self) -> None: ...
+    
+    async def init_db(self) -> None: ...
+    
+    # User operations
+    async def get_user(self, user_id: int) -> Optional[User]: ...
+    
+    async def create_user(self, user_id: int, username: Optional[str], first_name: str) -> User: ...
+    
+    async def update_user_role(
+        self, user_id: int, role: str, notify: Optional[Callable[[User], Iterable[Notice]]] = None
+    ) -> Optional[User]: ...
+    
+    async def get_user_by_username(self, username: str) -> Optional[User]: ...
+    
+    async def get_users(self, user_ids: Iterable[int]) -> Dict[int, User]: ...
+    
+    async def get_judges(self) -> List[User]: ...
+    
+    # Ticket operations
+    async def create_ticket(
+        self,
+        user_id: int,
+        ticket_type: str,
+        description: str,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None,
+        escalate_after: Optional[int] = None,
+        routed: Iterable[int] = ()
+    ) -> Ticket: ...
+    
+    async def get_ticket(self, ticket_id: int) -> Optional[Ticket]: ...
+    
+    async def get_user_tickets(self, user_id: int, status: Optional[str] = None) -> List[Ticket]: ...
+    
+    async def get_all_tickets(self, status: Optional[str] = None) -> List[Ticket]: ...
+    
+    async def get_judge_tickets(self, judge_id: int, status: Optional[str] = None) -> List[Ticket]: ...
+    
+    async def get_all_tickets_page(
+        self,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage: ...
+    
+    async def get_user_tickets_page(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage: ...
+    
+    async def get_judge_tickets_page(
+        self,
+        judge_id: int,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10
+    ) -> TicketPage: ...
+    
+    async def get_ticket_counts(
+        self, user_id: Optional[int] = None, judge_id: Optional[int] = None
+    ) -> Dict[str, int]: ...
+    
+    async def get_judges_ticket_counts(self) -> Dict[int, Dict[str, int]]: ...
+    
+    async def search_tickets(
+        self,
+        query: str,
+        status: Optional[str] = None,
+        limit: int = 10,
+        cursor: int = 0
+    ) -> TicketSearchPage: ...
+    
+    async def update_ticket_status(
+        self,
+        ticket_id: int,
+        status: str,
+        closed_by: Optional[int] = None,
+        judge_id: Optional[int] = None,
+        from_statuses: Optional[Tuple[str, ...]] = None,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None
+    ) -> Optional[Ticket]: ...
+    
+    async def get_old_open_tickets(self, days: int) -> List[Ticket]: ...
+    
+    async def pop_due_escalations(
+        self, notify: Optional[Callable[[Ticket, FrozenSet[int]], Iterable[Notice]]] = None
+    ) -> List[Ticket]: ...
+    
+    async def close_tickets(
+        self,
+        ticket_ids: List[int],
+        comment_text: str,
+        closed_by: Optional[int] = None,
+        notify: Optional[Callable[[Ticket], Iterable[Notice]]] = None
+    ) -> List[Ticket]: ...
+    
+    async def archive_closed_tickets(self, days: int, batch_size: int = 500) -> int: ...
+    
+    # Comment operations
+    async def create_comment(
+        self,
+        ticket_id: int,
+        judge_id: int,
+        text: str,
+        notify: Optional[Callable[[Comment], Iterable[Notice]]] = None
+    ) -> Comment: ...
+    
+    async def get_comment(self, comment_id: int) -> Optional[Comment]: ...
+    
+    async def get_ticket_comments(self, ticket_id: int) -> List[Comment]: ...
+    
+    async def get_ticket_detail(self, ticket_id: int) -> Optional[TicketDetail]: ...
+    
+    # Outbox operations
+    async def get_due_outbox(self, limit: int = 100) -> List[OutboxMessage]: ...
+    
+    async def complete_outbox(
+        self,
+        delivered: List[int],
+        retry: List[Tuple[int, int, str]],
+        dead: List[Tuple[int, str]],
+        deferred: Optional[List[Tuple[int, int]]] = None
+    ) -> None: ...
+    
+    async def get_outbox_counts(self) -> Dict[str, int]: ...
+    
+    async def get_chat_health(self) -> List[ChatHealth]: ...
+    
+    async def save_chat_health(self, unreachable: List[ChatHealth], reachable: List[int]) -> None: ...
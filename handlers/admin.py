@@ -4,18 +4,26 @@ Handlers for admin actions
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
+from html import escape
 import logging
 
-from database.db import Database
-from database.models import User, ROLE_JUDGE, ROLE_PLAYER
+from database.storage import Storage
+from utils.outbox import OutboxWorker, MESSAGE_LIMIT
+from database.models import (
+    User, Notice, ROLE_JUDGE, ROLE_PLAYER, CHAT_STATES,
+    TICKET_STATUS_OPEN, TICKET_STATUS_IN_PROGRESS, TICKET_STATUS_CLOSED
+)
 
 logger = logging.getLogger(__name__)
 
+# Chats listed by /unreachable, the rest are only counted
+UNREACHABLE_LIST_LIMIT = 50
+
 router = Router()
 
 
 @router.message(Command("add_judge"))
-async def add_judge(message: Message, user: User, db: Database):
+async def add_judge(message: Message, user: User, db: Storage, outbox: OutboxWorker):
     """Add a judge (admin only)"""
     # Parse command
     args = message.text.split(maxsplit=1)
@@ -38,40 +46,39 @@ async def add_judge(message: Message, user: User, db: Database):
     
     if not target_user:
         await message.answer(
-            f"❌ Пользователь @{username} не найден в базе данных.\n\n"
+            f"❌ Пользователь @{escape(username)} не найден в базе данных.\n\n"
             "Пользователь должен сначала запустить бота командой /start"
         )
         return
     
     if target_user.role == ROLE_JUDGE:
         await message.answer(
-            f"ℹ️ Пользователь @{username} уже является судьей."
+            f"ℹ️ Пользователь @{escape(username)} уже является судьей."
         )
         return
     
-    # Update role to judge
-    await db.update_user_role(target_user.id, ROLE_JUDGE)
+    # Update role to judge, queueing their notification in the same transaction
+    await db.update_user_role(
+        target_user.id,
+        ROLE_JUDGE,
+        notify=lambda judge: [Notice(
+            judge.id,
+            "🎉 Вы назначены судьей турнира!\n\n"
+            "Теперь у вас есть доступ к панели судьи.\n"
+            "Используйте /start для обновления меню."
+        )]
+    )
+    outbox.wake()
     
     await message.answer(
-        f"✅ Пользователь @{username} ({target_user.first_name}) назначен судьей!"
+        f"✅ Пользователь @{escape(username)} ({escape(target_user.first_name)}) назначен судьей!"
     )
     
-    # Notify the new judge
-    try:
-        await message.bot.send_message(
-            target_user.id,
-            f"🎉 Вы назначены судьей турнира!\n\n"
-            f"Теперь у вас есть доступ к панели судьи.\n"
-            f"Используйте /start для обновления меню."
-        )
-    except Exception as e:
-        logger.error(f"Failed to notify new judge {target_user.id}: {e}")
-    
     logger.info(f"Admin {user.id} added judge {target_user.id} (@{username})")
 
 
 @router.message(Command("remove_judge"))
-async def remove_judge(message: Message, user: User, db: Database):
+async def remove_judge(message: Message, user: User, db: Storage, outbox: OutboxWorker):
     """Remove a judge (admin only)"""
     # Parse command
     args = message.text.split(maxsplit=1)
@@ -94,13 +101,13 @@ async def remove_judge(message: Message, user: User, db: Database):
     
     if not target_user:
         await message.answer(
-            f"❌ Пользователь @{username} не найден в базе данных."
+            f"❌ Пользователь @{escape(username)} не найден в базе данных."
         )
         return
     
     if target_user.role != ROLE_JUDGE:
         await message.answer(
-            f"ℹ️ Пользователь @{username} не является судьей."
+            f"ℹ️ Пользователь @{escape(username)} не является судьей."
         )
         return
     
@@ -111,28 +118,27 @@ async def remove_judge(message: Message, user: User, db: Database):
         )
         return
     
-    # Update role to player
-    await db.update_user_role(target_user.id, ROLE_PLAYER)
+    # Update role to player, queueing their notification in the same transaction
+    await db.update_user_role(
+        target_user.id,
+        ROLE_PLAYER,
+        notify=lambda player: [Notice(
+            player.id,
+            "ℹ️ Вы сняты с должности судьи турнира.\n\n"
+            "Используйте /start для обновления меню."
+        )]
+    )
+    outbox.wake()
     
     await message.answer(
-        f"✅ Пользователь @{username} ({target_user.first_name}) снят с должности судьи."
+        f"✅ Пользователь @{escape(username)} ({escape(target_user.first_name)}) снят с должности судьи."
     )
     
-    # Notify the removed judge
-    try:
-        await message.bot.send_message(
-            target_user.id,
-            f"ℹ️ Вы сняты с должности судьи турнира.\n\n"
-            f"Используйте /start для обновления меню."
-        )
-    except Exception as e:
-        logger.error(f"Failed to notify removed judge {target_user.id}: {e}")
-    
     logger.info(f"Admin {user.id} removed judge {target_user.id} (@{username})")
 
 
 @router.message(Command("list_judges"))
-async def list_judges(message: Message, db: Database):
+async def list_judges(message: Message, db: Storage):
     """List all judges (admin only)"""
     judges = await db.get_judges()
     
@@ -145,7 +151,71 @@ async def list_judges(message: Message, db: Database):
     for judge in judges:
         username = f"@{judge.username}" if judge.username else "нет username"
         role_emoji = "🔑" if judge.role == "admin" else "👨‍⚖️"
-        text += f"{role_emoji} {judge.first_name} ({username})\n"
+        text += f"{role_emoji} {escape(judge.first_name)} ({username})\n"
+    
+    await message.answer(text)
+
+
+@router.message(Command("stats"))
+async def stats_command(message: Message, db: Storage):
+    """Show ticket statistics (admin only)"""
+    counts = await db.get_ticket_counts()
+    judge_counts = await db.get_judges_ticket_counts()
+    
+    text = f"📊 Статистика заявок ({sum(counts.values())}):\n\n"
+    text += f"🟢 Открытые: {counts.get(TICKET_STATUS_OPEN, 0)}\n"
+    text += f"🟡 В работе: {counts.get(TICKET_STATUS_IN_PROGRESS, 0)}\n"
+    text += f"✅ Закрытые: {counts.get(TICKET_STATUS_CLOSED, 0)}\n"
+    
+    if judge_counts:
+        text += "\n👨‍⚖️ По судьям (в работе / закрыто):\n"
+        for judge in await db.get_judges():
+            judge_stats = judge_counts.get(judge.id, {})
+            username = f"@{judge.username}" if judge.username else "нет username"
+            text += (
+                f"{escape(judge.first_name)} ({username}): "
+                f"{judge_stats.get(TICKET_STATUS_IN_PROGRESS, 0)} / "
+                f"{judge_stats.get(TICKET_STATUS_CLOSED, 0)}\n"
+            )
+    
+    await message.answer(text)
+
+
+@router.message(Command("unreachable"))
+async def unreachable_chats(message: Message, db: Storage):
+    """List chats the bot cannot deliver notifications to (admin only)"""
+    chats = await db.get_chat_health()
+    
+    if not chats:
+        await message.answer("✅ Все уведомления доставляются.")
+        return
+    
+    # Most recently failed first, users of the listed chats in one query
+    shown = chats[:UNREACHABLE_LIST_LIMIT]
+    users = await db.get_users(health.chat_id for health in shown)
+    
+    text = f"🚫 Недоступные чаты ({len(chats)}):\n\n"
+    listed = 0
+    for health in shown:
+        chat_user = users.get(health.chat_id)
+        if chat_user is None:
+            name = str(health.chat_id)
+        else:
+            username = f"@{chat_user.username}" if chat_user.username else "нет username"
+            name = f"{escape(chat_user.first_name)} ({username})"
+        line = (
+            f"• {name}: {CHAT_STATES.get(health.state, health.state)}, "
+            f"ошибок подряд: {health.failures}, "
+            f"следующая проверка {health.next_probe_at}\n"
+        )
+        # Keep room for the "and N more" line
+        if len(text) + len(line) > MESSAGE_LIMIT - 64:
+            break
+        text += line
+        listed += 1
+    
+    if listed < len(chats):
+        text += f"\n…и еще {len(chats) - listed}"
     
     await message.answer(text)
 
@@ -164,6 +234,8 @@ async def help_command(message: Message, user: User):
         text += "/add_judge @username - Назначить судью\n"
         text += "/remove_judge @username - Снять судью\n"
         text += "/list_judges - Список всех судей\n"
+        text += "/stats - Статистика заявок\n"
+        text += "/unreachable - Недоступные для уведомлений чаты\n"
     
     await message.answer(text)
 
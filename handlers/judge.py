@@ -5,65 +5,100 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
+from html import escape
+from typing import Optional, Tuple
 import logging
 
-from database.db import Database
+from database.storage import Storage
+from utils.outbox import OutboxWorker
+from utils.routing import TicketRouter
 from database.models import (
-    User, TICKET_TYPES, TICKET_STATUSES,
+    User, TicketPage, Notice, TICKET_TYPES, TICKET_STATUSES,
     TICKET_STATUS_OPEN, TICKET_STATUS_IN_PROGRESS,
     TICKET_STATUS_CLOSED
 )
 from keyboards.reply import (
+    TICKETS_PER_PAGE,
     get_judge_tickets_keyboard,
     get_judge_ticket_list_keyboard,
     get_judge_ticket_actions_keyboard,
+    get_search_results_keyboard,
     get_cancel_keyboard,
     get_back_to_menu_keyboard
 )
-from states.forms import CommentForm
-from config import MAX_COMMENT_LENGTH
+from states.forms import CommentForm, SearchForm
+from config import MAX_COMMENT_LENGTH, MAX_SEARCH_QUERY_LENGTH
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
 
+async def build_judge_menu_keyboard(db: Storage, user: User):
+    """Judge filter menu with current ticket counts on the buttons"""
+    return get_judge_tickets_keyboard(
+        counts=await db.get_ticket_counts(),
+        my_counts=await db.get_ticket_counts(judge_id=user.id)
+    )
+
+
 @router.callback_query(F.data == "judge_tickets")
-async def judge_tickets_menu(callback: CallbackQuery):
+async def judge_tickets_menu(callback: CallbackQuery, user: User, db: Storage):
     """Show judge tickets menu"""
     await callback.message.edit_text(
         "👨‍⚖️ Панель судьи\n\n"
         "Выберите фильтр для просмотра заявок:",
-        reply_markup=get_judge_tickets_keyboard()
+        reply_markup=await build_judge_menu_keyboard(db, user)
     )
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("judge_filter:"))
-async def judge_filter_tickets(callback: CallbackQuery, user: User, db: Database):
-    """Filter tickets for judges"""
-    filter_type = callback.data.split(":")[1]
-    
-    # Get tickets based on filter
+async def load_judge_tickets_page(
+    db: Storage,
+    user: User,
+    filter_type: str,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None
+) -> Tuple[TicketPage, str]:
+    """Load one page of tickets for a judge filter, returns page and filter name"""
     if filter_type == "open":
-        tickets = await db.get_all_tickets(TICKET_STATUS_OPEN)
+        ticket_page = await db.get_all_tickets_page(
+            TICKET_STATUS_OPEN, after_id, before_id, TICKETS_PER_PAGE
+        )
         filter_name = "Открытые"
     elif filter_type == "in_progress":
-        tickets = await db.get_all_tickets(TICKET_STATUS_IN_PROGRESS)
+        ticket_page = await db.get_all_tickets_page(
+            TICKET_STATUS_IN_PROGRESS, after_id, before_id, TICKETS_PER_PAGE
+        )
         filter_name = "В работе"
     elif filter_type == "my_tickets":
-        tickets = await db.get_judge_tickets(user.id, TICKET_STATUS_IN_PROGRESS)
+        ticket_page = await db.get_judge_tickets_page(
+            user.id, TICKET_STATUS_IN_PROGRESS, after_id, before_id, TICKETS_PER_PAGE
+        )
         filter_name = "Мои в работе"
     else:  # all
-        tickets = await db.get_all_tickets()
+        ticket_page = await db.get_all_tickets_page(
+            None, after_id, before_id, TICKETS_PER_PAGE
+        )
         filter_name = "Все"
     
-    if not tickets:
+    return ticket_page, filter_name
+
+
+@router.callback_query(F.data.startswith("judge_filter:"))
+async def judge_filter_tickets(callback: CallbackQuery, user: User, db: Storage):
+    """Filter tickets for judges"""
+    filter_type = callback.data.split(":")[1]
+    
+    # Get first page of tickets based on filter
+    ticket_page, filter_name = await load_judge_tickets_page(db, user, filter_type)
+    
+    if not ticket_page.tickets:
         try:
             await callback.message.edit_text(
                 f"📋 {filter_name} заявки\n\n"
                 "Нет заявок в этой категории.",
-                reply_markup=get_judge_tickets_keyboard()
+                reply_markup=await build_judge_menu_keyboard(db, user)
             )
         except TelegramBadRequest as e:
             if "message is not modified" in str(e):
@@ -73,9 +108,9 @@ async def judge_filter_tickets(callback: CallbackQuery, user: User, db: Database
     else:
         try:
             await callback.message.edit_text(
-                f"📋 {filter_name} заявки ({len(tickets)}):\n\n"
+                f"📋 {filter_name} заявки ({ticket_page.total}):\n\n"
                 "Выберите заявку для просмотра:",
-                reply_markup=get_judge_ticket_list_keyboard(tickets, filter_type, page=0)
+                reply_markup=get_judge_ticket_list_keyboard(ticket_page, filter_type, page=0)
             )
         except TelegramBadRequest as e:
             if "message is not modified" in str(e):
@@ -87,31 +122,34 @@ async def judge_filter_tickets(callback: CallbackQuery, user: User, db: Database
 
 
 @router.callback_query(F.data.startswith("judge_page:"))
-async def judge_tickets_pagination(callback: CallbackQuery, user: User, db: Database):
+async def judge_tickets_pagination(callback: CallbackQuery, user: User, db: Storage):
     """Handle pagination for judge tickets"""
+    # judge_page:<filter>:<page>:<n|p>:<anchor ticket id>
     parts = callback.data.split(":")
     filter_type = parts[1]
     page = int(parts[2])
     
+    after_id = before_id = None
+    if len(parts) == 5:
+        direction, anchor_id = parts[3], int(parts[4])
+        if direction == "n":
+            after_id = anchor_id
+        else:
+            before_id = anchor_id
+    else:
+        # Buttons from before keyset pagination: start over
+        page = 0
+    
     # Get tickets based on filter
-    if filter_type == "open":
-        tickets = await db.get_all_tickets(TICKET_STATUS_OPEN)
-        filter_name = "Открытые"
-    elif filter_type == "in_progress":
-        tickets = await db.get_all_tickets(TICKET_STATUS_IN_PROGRESS)
-        filter_name = "В работе"
-    elif filter_type == "my_tickets":
-        tickets = await db.get_judge_tickets(user.id, TICKET_STATUS_IN_PROGRESS)
-        filter_name = "Мои в работе"
-    else:  # all
-        tickets = await db.get_all_tickets()
-        filter_name = "Все"
+    ticket_page, filter_name = await load_judge_tickets_page(
+        db, user, filter_type, after_id, before_id
+    )
     
     try:
         await callback.message.edit_text(
-            f"📋 {filter_name} заявки ({len(tickets)}):\n\n"
+            f"📋 {filter_name} заявки ({ticket_page.total}):\n\n"
             "Выберите заявку для просмотра:",
-            reply_markup=get_judge_ticket_list_keyboard(tickets, filter_type, page=page)
+            reply_markup=get_judge_ticket_list_keyboard(ticket_page, filter_type, page=page)
         )
     except TelegramBadRequest as e:
         if "message is not modified" in str(e):
@@ -122,31 +160,122 @@ async def judge_tickets_pagination(callback: CallbackQuery, user: User, db: Data
     await callback.answer()
 
 
+@router.callback_query(F.data == "judge_search")
+async def start_search(callback: CallbackQuery, state: FSMContext):
+    """Start full-text ticket search"""
+    await state.set_state(SearchForm.entering_query)
+    
+    await callback.message.edit_text(
+        "🔍 Поиск заявок\n\n"
+        "Введите слова из описания заявки или комментариев судей:",
+        reply_markup=get_cancel_keyboard()
+    )
+    await callback.answer()
+
+
+@router.message(SearchForm.entering_query)
+async def search_query_entered(message: Message, db: Storage, state: FSMContext):
+    """Handle search query input and show the first page of results"""
+    query = (message.text or "").strip()
+    
+    if len(query) < 2:
+        await message.answer(
+            "❌ Запрос слишком короткий! Минимум 2 символа."
+        )
+        return
+    
+    if len(query) > MAX_SEARCH_QUERY_LENGTH:
+        await message.answer(
+            f"❌ Запрос слишком длинный! Максимум {MAX_SEARCH_QUERY_LENGTH} символов."
+        )
+        return
+    
+    search_page = await db.search_tickets(query, limit=TICKETS_PER_PAGE)
+    
+    # Keep the query for pagination, callback data is too small to carry it
+    await state.set_state(None)
+    await state.update_data(search_query=query)
+    
+    if not search_page.tickets:
+        await message.answer(
+            f"🔍 По запросу «{escape(query)}» ничего не найдено.",
+            reply_markup=get_search_results_keyboard(search_page)
+        )
+        return
+    
+    await message.answer(
+        f"🔍 Результаты по запросу «{escape(query)}»:\n\n"
+        "Выберите заявку для просмотра:",
+        reply_markup=get_search_results_keyboard(search_page)
+    )
+
+
+@router.callback_query(F.data.startswith("judge_search_page:"))
+async def search_pagination(callback: CallbackQuery, db: Storage, state: FSMContext):
+    """Handle pagination for search results"""
+    cursor = int(callback.data.split(":")[1])
+    
+    data = await state.get_data()
+    query = data.get("search_query")
+    
+    if not query:
+        await callback.answer("❌ Поиск устарел, начните новый", show_alert=True)
+        return
+    
+    search_page = await db.search_tickets(query, limit=TICKETS_PER_PAGE, cursor=cursor)
+    
+    try:
+        await callback.message.edit_text(
+            f"🔍 Результаты по запросу «{escape(query)}»:\n\n"
+            "Выберите заявку для просмотра:",
+            reply_markup=get_search_results_keyboard(search_page)
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            await callback.answer("Страница не изменилась")
+        else:
+            raise
+    
+    await callback.answer()
+
+
+@router.callback_query(F.data == "cancel", SearchForm.entering_query)
+async def cancel_search(callback: CallbackQuery, user: User, db: Storage, state: FSMContext):
+    """Cancel search and return to judge menu"""
+    await state.clear()
+    
+    await callback.message.edit_text(
+        "👨‍⚖️ Панель судьи\n\n"
+        "Выберите фильтр для просмотра заявок:",
+        reply_markup=await build_judge_menu_keyboard(db, user)
+    )
+    await callback.answer()
+
+
 @router.callback_query(F.data.startswith("judge_view_ticket:"))
-async def judge_view_ticket(callback: CallbackQuery, db: Database):
+async def judge_view_ticket(callback: CallbackQuery, db: Storage):
     """View ticket details as judge"""
     ticket_id = int(callback.data.split(":")[1])
     
-    ticket = await db.get_ticket(ticket_id)
+    # Ticket, owner, assigned judge, closer and comments with authors in one go
+    detail = await db.get_ticket_detail(ticket_id)
     
-    if not ticket:
+    if not detail:
         await callback.answer("❌ Заявка не найдена", show_alert=True)
         return
     
-    # Get ticket owner
-    owner = await db.get_user(ticket.user_id)
-    owner_name = owner.first_name if owner else "Неизвестный"
+    ticket = detail.ticket
+    comments = detail.comments
+    
+    # Ticket owner
+    owner = detail.owner
+    owner_name = escape(owner.first_name) if owner else "Неизвестный"
     owner_username = f"@{owner.username}" if owner and owner.username else "нет username"
     
-    # Get assigned judge
+    # Assigned judge
     judge_info = ""
-    if ticket.judge_id:
-        assigned_judge = await db.get_user(ticket.judge_id)
-        if assigned_judge:
-            judge_info = f"👨‍⚖️ Судья: {assigned_judge.first_name}\n"
-    
-    # Get comments
-    comments = await db.get_ticket_comments(ticket_id)
+    if detail.assignee:
+        judge_info = f"👨‍⚖️ Судья: {escape(detail.assignee.first_name)}\n"
     
     type_name = TICKET_TYPES.get(ticket.ticket_type, "Неизвестно")
     status_name = TICKET_STATUSES.get(ticket.status, "Неизвестно")
@@ -159,19 +288,17 @@ async def judge_view_ticket(callback: CallbackQuery, db: Database):
         f"📌 Тип: {type_name}\n"
         f"📊 Статус: {status_name}\n"
         f"📅 Создана: {ticket.created_at}\n"
-        f"📝 Описание:\n{ticket.description}\n"
+        f"📝 Описание:\n{escape(ticket.description)}\n"
     )
     
     if comments:
         text += f"\n💬 Комментарии ({len(comments)}):\n"
-        for comment in comments:
-            judge = await db.get_user(comment.judge_id)
-            judge_name = judge.first_name if judge else "Судья"
-            text += f"\n• {judge_name}: {comment.text}\n  ({comment.created_at})"
+        for comment, author in comments:
+            judge_name = escape(author.first_name) if author else "Судья"
+            text += f"\n• {judge_name}: {escape(comment.text)}\n  ({comment.created_at})"
     
     if ticket.closed_at:
-        closer = await db.get_user(ticket.closed_by) if ticket.closed_by else None
-        closer_name = closer.first_name if closer else "Система"
+        closer_name = escape(detail.closer.first_name) if detail.closer else "Система"
         text += f"\n\n🔒 Закрыта: {ticket.closed_at}\n   Кем: {closer_name}"
     
     try:
@@ -188,40 +315,39 @@ async def judge_view_ticket(callback: CallbackQuery, db: Database):
 
 
 @router.callback_query(F.data.startswith("take_ticket:"))
-async def take_ticket(callback: CallbackQuery, user: User, db: Database):
+async def take_ticket(
+    callback: CallbackQuery, user: User, db: Storage, outbox: OutboxWorker, routing: TicketRouter
+):
     """Take ticket into work"""
     ticket_id = int(callback.data.split(":")[1])
+    routing.touch(user.id)
     
-    ticket = await db.get_ticket(ticket_id)
+    # Update status and assign judge, only while the ticket is still open;
+    # the owner's notification is queued in the same transaction
+    ticket = await db.update_ticket_status(
+        ticket_id,
+        TICKET_STATUS_IN_PROGRESS,
+        judge_id=user.id,
+        from_statuses=(TICKET_STATUS_OPEN,),
+        notify=lambda taken: [
+            Notice(taken.user_id, f"🟡 Ваша заявка #{ticket_id} взята в работу судьей {escape(user.first_name)}")
+        ]
+    )
     
     if not ticket:
-        await callback.answer("❌ Заявка не найдена", show_alert=True)
-        return
-    
-    if ticket.status != TICKET_STATUS_OPEN:
-        await callback.answer("❌ Заявка уже взята в работу", show_alert=True)
+        if not await db.get_ticket(ticket_id):
+            await callback.answer("❌ Заявка не найдена", show_alert=True)
+        else:
+            await callback.answer("❌ Заявка уже взята в работу", show_alert=True)
         return
     
-    # Update status and assign judge
-    await db.update_ticket_status(ticket_id, TICKET_STATUS_IN_PROGRESS, judge_id=user.id)
-    
     # Add automatic comment
     await db.create_comment(
         ticket_id,
         user.id,
         f"Заявка взята в работу судьей {user.first_name}"
     )
-    
-    # Notify ticket owner
-    owner = await db.get_user(ticket.user_id)
-    if owner:
-        try:
-            await callback.bot.send_message(
-                owner.id,
-                f"🟡 Ваша заявка #{ticket_id} взята в работу судьей {user.first_name}"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify ticket owner {owner.id}: {e}")
+    outbox.wake()
     
     await callback.answer("✅ Заявка взята в работу")
     
@@ -246,7 +372,10 @@ async def start_add_comment(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(CommentForm.entering_comment)
-async def comment_entered(message: Message, user: User, db: Database, state: FSMContext):
+async def comment_entered(
+    message: Message, user: User, db: Storage, outbox: OutboxWorker, routing: TicketRouter,
+    state: FSMContext
+):
     """Handle comment input"""
     comment_text = message.text.strip()
     
@@ -268,26 +397,20 @@ async def comment_entered(message: Message, user: User, db: Database, state: FSM
     # Get ticket ID from state
     data = await state.get_data()
     ticket_id = data.get("comment_ticket_id")
+    routing.touch(user.id)
     
-    # Create comment
-    await db.create_comment(ticket_id, user.id, comment_text)
+    # Create comment, queueing the owner's notification in the same transaction
+    ticket = await db.get_ticket(ticket_id)
+    notices = [Notice(
+        ticket.user_id,
+        f"💬 Новый комментарий к вашей заявке #{ticket_id}\n\n"
+        f"Судья {escape(user.first_name)}: {escape(comment_text)}"
+    )] if ticket else []
+    await db.create_comment(ticket_id, user.id, comment_text, notify=lambda comment: notices)
+    outbox.wake()
     
     await state.clear()
     
-    # Notify ticket owner
-    ticket = await db.get_ticket(ticket_id)
-    if ticket:
-        owner = await db.get_user(ticket.user_id)
-        if owner:
-            try:
-                await message.bot.send_message(
-                    owner.id,
-                    f"💬 Новый комментарий к вашей заявке #{ticket_id}\n\n"
-                    f"Судья {user.first_name}: {comment_text}"
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify ticket owner {owner.id}: {e}")
-    
     from keyboards.reply import get_judge_ticket_actions_keyboard
     
     await message.answer(
@@ -297,7 +420,7 @@ async def comment_entered(message: Message, user: User, db: Database, state: FSM
 
 
 @router.callback_query(F.data == "cancel", CommentForm.entering_comment)
-async def cancel_comment(callback: CallbackQuery, db: Database, state: FSMContext):
+async def cancel_comment(callback: CallbackQuery, db: Storage, state: FSMContext):
     """Cancel adding comment"""
     data = await state.get_data()
     ticket_id = data.get("comment_ticket_id")
@@ -326,40 +449,39 @@ async def cancel_comment(callback: CallbackQuery, db: Database, state: FSMContex
 
 
 @router.callback_query(F.data.startswith("judge_close_ticket:"))
-async def judge_close_ticket(callback: CallbackQuery, user: User, db: Database):
+async def judge_close_ticket(
+    callback: CallbackQuery, user: User, db: Storage, outbox: OutboxWorker, routing: TicketRouter
+):
     """Close ticket as judge"""
     ticket_id = int(callback.data.split(":")[1])
+    routing.touch(user.id)
     
-    ticket = await db.get_ticket(ticket_id)
+    # Close ticket unless it is already closed; the owner's notification is
+    # queued in the same transaction
+    ticket = await db.update_ticket_status(
+        ticket_id,
+        TICKET_STATUS_CLOSED,
+        user.id,
+        from_statuses=(TICKET_STATUS_OPEN, TICKET_STATUS_IN_PROGRESS),
+        notify=lambda closed: [
+            Notice(closed.user_id, f"🔒 Ваша заявка #{ticket_id} закрыта судьей {escape(user.first_name)}")
+        ]
+    )
     
     if not ticket:
-        await callback.answer("❌ Заявка не найдена", show_alert=True)
-        return
-    
-    if ticket.status == TICKET_STATUS_CLOSED:
-        await callback.answer("❌ Заявка уже закрыта", show_alert=True)
+        if not await db.get_ticket(ticket_id):
+            await callback.answer("❌ Заявка не найдена", show_alert=True)
+        else:
+            await callback.answer("❌ Заявка уже закрыта", show_alert=True)
         return
     
-    # Close ticket
-    await db.update_ticket_status(ticket_id, TICKET_STATUS_CLOSED, user.id)
-    
     # Add automatic comment
     await db.create_comment(
         ticket_id,
         user.id,
         f"Заявка закрыта судьей {user.first_name}"
     )
-    
-    # Notify ticket owner
-    owner = await db.get_user(ticket.user_id)
-    if owner:
-        try:
-            await callback.bot.send_message(
-                owner.id,
-                f"🔒 Ваша заявка #{ticket_id} закрыта судьей {user.first_name}"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify ticket owner {owner.id}: {e}")
+    outbox.wake()
     
     await callback.message.edit_text(
         f"✅ Заявка #{ticket_id} закрыта."
@@ -6,11 +6,15 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
+from html import escape
 import logging
 
-from database.db import Database
-from database.models import User, TICKET_TYPES, TICKET_STATUSES, ROLE_JUDGE, ROLE_ADMIN
+from database.storage import Storage
+from utils.outbox import OutboxWorker, DIGEST_NEW_TICKETS
+from utils.routing import TicketRouter
+from database.models import User, Ticket, Notice, TICKET_TYPES, TICKET_STATUSES, ROLE_JUDGE, ROLE_ADMIN
 from keyboards.reply import (
+    TICKETS_PER_PAGE,
     get_main_menu_keyboard,
     get_ticket_type_keyboard,
     get_confirm_ticket_keyboard,
@@ -19,7 +23,7 @@ from keyboards.reply import (
     get_back_to_menu_keyboard
 )
 from states.forms import TicketForm
-from config import MAX_DESCRIPTION_LENGTH
+from config import MAX_DESCRIPTION_LENGTH, NEW_TICKET_DIGEST_WINDOW
 
 logger = logging.getLogger(__name__)
 
@@ -27,13 +31,13 @@ router = Router()
 
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, user: User, db: Database):
+async def cmd_start(message: Message, user: User, db: Storage):
     """Handle /start command"""
     is_judge = user.role in [ROLE_JUDGE, ROLE_ADMIN]
     
     if is_judge:
         # For judges: show tickets menu directly
-        from keyboards.reply import get_judge_tickets_keyboard
+        from handlers.judge import build_judge_menu_keyboard
         
         welcome_text = f"👋 Приветствуем тебя в саппорт боте Всероссийского турнира по фиджитал-спорту «Фиджитал — всем»\n\n"
         
@@ -46,7 +50,7 @@ async def cmd_start(message: Message, user: User, db: Database):
         
         await message.answer(
             welcome_text,
-            reply_markup=get_judge_tickets_keyboard()
+            reply_markup=await build_judge_menu_keyboard(db, user)
         )
     else:
         # For players: show regular menu
@@ -60,7 +64,7 @@ async def cmd_start(message: Message, user: User, db: Database):
 
 
 @router.callback_query(F.data == "back_to_menu")
-async def back_to_menu(callback: CallbackQuery, user: User, state: FSMContext):
+async def back_to_menu(callback: CallbackQuery, user: User, db: Storage, state: FSMContext):
     """Return to main menu"""
     await state.clear()
     
@@ -68,10 +72,10 @@ async def back_to_menu(callback: CallbackQuery, user: User, state: FSMContext):
     
     if is_judge:
         # For judges: return to tickets filter menu
-        from keyboards.reply import get_judge_tickets_keyboard
+        from handlers.judge import build_judge_menu_keyboard
         await callback.message.edit_text(
             "👨‍⚖️ Панель судьи\n\nВыберите фильтр для просмотра заявок:",
-            reply_markup=get_judge_tickets_keyboard()
+            reply_markup=await build_judge_menu_keyboard(db, user)
         )
     else:
         # For players: return to main menu
@@ -146,48 +150,60 @@ async def ticket_description_entered(message: Message, state: FSMContext):
     await message.answer(
         "✅ Проверьте данные перед отправкой:\n\n"
         f"📌 Тип: {type_name}\n"
-        f"📝 Описание: {description}\n\n"
+        f"📝 Описание: {escape(description)}\n\n"
         "Отправить заявку?",
         reply_markup=get_confirm_ticket_keyboard()
     )
 
 
 @router.callback_query(F.data == "confirm_ticket", TicketForm.confirming)
-async def confirm_ticket(callback: CallbackQuery, user: User, db: Database, state: FSMContext):
+async def confirm_ticket(
+    callback: CallbackQuery, user: User, db: Storage, outbox: OutboxWorker, routing: TicketRouter,
+    state: FSMContext
+):
     """Confirm and create ticket"""
     data = await state.get_data()
     ticket_type = data.get("ticket_type")
     description = data.get("description")
-    
-    # Create ticket
-    ticket = await db.create_ticket(user.id, ticket_type, description)
+    type_name = TICKET_TYPES.get(ticket_type, "Неизвестный тип")
+    # The judges best placed to take it; the router assigns it instead with auto-assign
+    judges = await routing.pick()
+    
+    def notify_judges(ticket: Ticket):
+        if routing.auto_assign:
+            return []
+        text = (
+            f"🔔 Новая заявка #{ticket.id}\n\n"
+            f"👤 От: {escape(user.first_name)} (@{user.username or 'нет username'})\n"
+            f"📌 Тип: {type_name}\n"
+            f"📝 Описание: {escape(description)}"
+        )
+        if NEW_TICKET_DIGEST_WINDOW > 0:
+            # Bursts of new tickets reach each judge as one digest per window
+            return [
+                Notice(judge.id, text, digest_key=DIGEST_NEW_TICKETS, delay=NEW_TICKET_DIGEST_WINDOW)
+                for judge in judges
+            ]
+        return [Notice(judge.id, text) for judge in judges]
+    
+    # Create ticket; the judges' notifications and its escalation are written in the same transaction
+    ticket = await db.create_ticket(
+        user.id, ticket_type, description, notify=notify_judges,
+        escalate_after=await routing.escalation(judges), routed=[judge.id for judge in judges]
+    )
+    await routing.dispatched(ticket, judges)
+    outbox.wake()
     
     await state.clear()
     
-    type_name = TICKET_TYPES.get(ticket_type, "Неизвестный тип")
-    
     await callback.message.edit_text(
         f"✅ Заявка #{ticket.id} успешно создана!\n\n"
         f"📌 Тип: {type_name}\n"
-        f"📝 Описание: {description}\n\n"
+        f"📝 Описание: {escape(description)}\n\n"
         "Судья свяжется с вами в ближайшее время.",
         reply_markup=get_back_to_menu_keyboard()
     )
     
-    # Notify judges
-    judges = await db.get_judges()
-    for judge in judges:
-        try:
-            await callback.bot.send_message(
-                judge.id,
-                f"🔔 Новая заявка #{ticket.id}\n\n"
-                f"👤 От: {user.first_name} (@{user.username or 'нет username'})\n"
-                f"📌 Тип: {type_name}\n"
-                f"📝 Описание: {description}"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify judge {judge.id}: {e}")
-    
     await callback.answer("✅ Заявка создана!")
 
 
@@ -204,12 +220,12 @@ async def cancel_ticket(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "my_tickets")
-async def show_my_tickets(callback: CallbackQuery, user: User, db: Database):
+async def show_my_tickets(callback: CallbackQuery, user: User, db: Storage):
     """Show user's tickets"""
-    tickets = await db.get_user_tickets(user.id)
+    ticket_page = await db.get_user_tickets_page(user.id, limit=TICKETS_PER_PAGE)
     
     try:
-        if not tickets:
+        if not ticket_page.tickets:
             await callback.message.edit_text(
                 "📋 У вас пока нет заявок.\n\n"
                 "Создайте новую заявку, если у вас возникла проблема.",
@@ -217,9 +233,9 @@ async def show_my_tickets(callback: CallbackQuery, user: User, db: Database):
             )
         else:
             await callback.message.edit_text(
-                f"📋 Ваши заявки ({len(tickets)}):\n\n"
+                f"📋 Ваши заявки ({ticket_page.total}):\n\n"
                 "Выберите заявку для просмотра:",
-                reply_markup=get_my_tickets_keyboard(tickets, page=0)
+                reply_markup=get_my_tickets_keyboard(ticket_page, page=0)
             )
     except TelegramBadRequest as e:
         if "message is not modified" in str(e):
@@ -232,17 +248,32 @@ async def show_my_tickets(callback: CallbackQuery, user: User, db: Database):
 
 
 @router.callback_query(F.data.startswith("my_tickets_page:"))
-async def my_tickets_pagination(callback: CallbackQuery, user: User, db: Database):
+async def my_tickets_pagination(callback: CallbackQuery, user: User, db: Storage):
     """Handle pagination for my tickets"""
-    page = int(callback.data.split(":")[1])
+    # my_tickets_page:<page>:<n|p>:<anchor ticket id>
+    parts = callback.data.split(":")
+    page = int(parts[1])
+    
+    after_id = before_id = None
+    if len(parts) == 4:
+        direction, anchor_id = parts[2], int(parts[3])
+        if direction == "n":
+            after_id = anchor_id
+        else:
+            before_id = anchor_id
+    else:
+        # Buttons from before keyset pagination: start over
+        page = 0
     
-    tickets = await db.get_user_tickets(user.id)
+    ticket_page = await db.get_user_tickets_page(
+        user.id, after_id=after_id, before_id=before_id, limit=TICKETS_PER_PAGE
+    )
     
     try:
         await callback.message.edit_text(
-            f"📋 Ваши заявки ({len(tickets)}):\n\n"
+            f"📋 Ваши заявки ({ticket_page.total}):\n\n"
             "Выберите заявку для просмотра:",
-            reply_markup=get_my_tickets_keyboard(tickets, page=page)
+            reply_markup=get_my_tickets_keyboard(ticket_page, page=page)
         )
     except TelegramBadRequest as e:
         if "message is not modified" in str(e):
@@ -261,25 +292,24 @@ async def noop_callback(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("view_my_ticket:"))
-async def view_my_ticket(callback: CallbackQuery, user: User, db: Database):
+async def view_my_ticket(callback: CallbackQuery, user: User, db: Storage):
     """View ticket details"""
     ticket_id = int(callback.data.split(":")[1])
     
-    ticket = await db.get_ticket(ticket_id)
+    # Ticket, assigned judge and comments with authors in one go
+    detail = await db.get_ticket_detail(ticket_id)
     
-    if not ticket or ticket.user_id != user.id:
+    if not detail or detail.ticket.user_id != user.id:
         await callback.answer("❌ Заявка не найдена", show_alert=True)
         return
     
-    # Get comments
-    comments = await db.get_ticket_comments(ticket_id)
+    ticket = detail.ticket
+    comments = detail.comments
     
-    # Get assigned judge info
+    # Assigned judge info
     judge_info = ""
-    if ticket.judge_id:
-        assigned_judge = await db.get_user(ticket.judge_id)
-        if assigned_judge:
-            judge_info = f"👨‍⚖️ Судья: {assigned_judge.first_name}\n"
+    if detail.assignee:
+        judge_info = f"👨‍⚖️ Судья: {escape(detail.assignee.first_name)}\n"
     
     type_name = TICKET_TYPES.get(ticket.ticket_type, "Неизвестно")
     status_name = TICKET_STATUSES.get(ticket.status, "Неизвестно")
@@ -290,15 +320,14 @@ async def view_my_ticket(callback: CallbackQuery, user: User, db: Database):
         f"📊 Статус: {status_name}\n"
         f"{judge_info}"
         f"📅 Создана: {ticket.created_at}\n"
-        f"📝 Описание:\n{ticket.description}\n"
+        f"📝 Описание:\n{escape(ticket.description)}\n"
     )
     
     if comments:
         text += f"\n💬 Комментарии судей ({len(comments)}):\n"
-        for comment in comments:
-            judge = await db.get_user(comment.judge_id)
-            judge_name = judge.first_name if judge else "Судья"
-            text += f"\n• {judge_name}: {comment.text}\n  ({comment.created_at})"
+        for comment, author in comments:
+            judge_name = escape(author.first_name) if author else "Судья"
+            text += f"\n• {judge_name}: {escape(comment.text)}\n  ({comment.created_at})"
     
     if ticket.closed_at:
         text += f"\n\n🔒 Закрыта: {ticket.closed_at}"
@@ -318,7 +347,7 @@ async def view_my_ticket(callback: CallbackQuery, user: User, db: Database):
 
 
 @router.callback_query(F.data.startswith("close_ticket:"))
-async def close_ticket(callback: CallbackQuery, user: User, db: Database):
+async def close_ticket(callback: CallbackQuery, user: User, db: Storage, outbox: OutboxWorker):
     """Close ticket by owner"""
     ticket_id = int(callback.data.split(":")[1])
     
@@ -332,24 +361,23 @@ async def close_ticket(callback: CallbackQuery, user: User, db: Database):
         await callback.answer("❌ Заявка уже закрыта", show_alert=True)
         return
     
-    # Close ticket
-    await db.update_ticket_status(ticket_id, "closed", user.id)
+    # Close ticket unless someone closed it in the meantime, queueing the judges' notifications
+    judges = await db.get_judges()
+    text = f"🔒 Заявка #{ticket_id} закрыта игроком {escape(user.first_name)}"
+    closed_ticket = await db.update_ticket_status(
+        ticket_id, "closed", user.id, from_statuses=("open", "in_progress"),
+        notify=lambda closed: [Notice(judge.id, text) for judge in judges]
+    )
+    outbox.wake()
+    
+    if not closed_ticket:
+        await callback.answer("❌ Заявка уже закрыта", show_alert=True)
+        return
     
     await callback.message.edit_text(
         f"✅ Заявка #{ticket_id} закрыта.",
         reply_markup=get_back_to_menu_keyboard()
     )
     
-    # Notify judges
-    judges = await db.get_judges()
-    for judge in judges:
-        try:
-            await callback.bot.send_message(
-                judge.id,
-                f"🔒 Заявка #{ticket_id} закрыта игроком {user.first_name}"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify judge {judge.id}: {e}")
-    
     await callback.answer("✅ Заявка закрыта")
 
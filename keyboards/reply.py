@@ -3,7 +3,7 @@ Inline keyboards for the bot
 """
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from typing import List
+from typing import Dict, Optional
 
 from database.models import (
     TICKET_TYPE_MATCH_RESCHEDULE,
@@ -13,9 +13,14 @@ from database.models import (
     TICKET_STATUS_OPEN,
     TICKET_STATUS_IN_PROGRESS,
     TICKET_STATUS_CLOSED,
-    Ticket
+    Ticket,
+    TicketPage,
+    TicketSearchPage
 )
 
+# Tickets shown per page in list keyboards
+TICKETS_PER_PAGE = 10
+
 
 def get_main_menu_keyboard(is_judge: bool = False) -> InlineKeyboardMarkup:
     """Main menu keyboard"""
@@ -80,10 +85,11 @@ def get_confirm_ticket_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_my_tickets_keyboard(tickets: List[Ticket], page: int = 0, per_page: int = 10) -> InlineKeyboardMarkup:
-    """Keyboard showing user's tickets with pagination"""
+def get_my_tickets_keyboard(ticket_page: TicketPage, page: int = 0, per_page: int = TICKETS_PER_PAGE) -> InlineKeyboardMarkup:
+    """Keyboard showing one page of user's tickets with pagination"""
     builder = InlineKeyboardBuilder()
     
+    tickets = ticket_page.tickets
     if not tickets:
         builder.row(
             InlineKeyboardButton(text="« Назад в меню", callback_data="back_to_menu")
@@ -91,12 +97,10 @@ def get_my_tickets_keyboard(tickets: List[Ticket], page: int = 0, per_page: int
         return builder.as_markup()
     
     # Calculate pagination
-    total_pages = (len(tickets) - 1) // per_page + 1
-    start_idx = page * per_page
-    end_idx = min(start_idx + per_page, len(tickets))
-    page_tickets = tickets[start_idx:end_idx]
+    total_pages = max((ticket_page.total - 1) // per_page + 1, 1)
+    page = min(page, total_pages - 1) if ticket_page.has_prev else 0
     
-    for ticket in page_tickets:
+    for ticket in tickets:
         status_emoji = {
             TICKET_STATUS_OPEN: "🟢",
             TICKET_STATUS_IN_PROGRESS: "🟡",
@@ -110,19 +114,19 @@ def get_my_tickets_keyboard(tickets: List[Ticket], page: int = 0, per_page: int
             )
         )
     
-    # Add pagination buttons if needed
-    if total_pages > 1:
+    # Add pagination buttons if needed; they carry the boundary ticket id as keyset cursor
+    if ticket_page.has_prev or ticket_page.has_next:
         pagination_row = []
-        if page > 0:
+        if ticket_page.has_prev:
             pagination_row.append(
-                InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"my_tickets_page:{page-1}")
+                InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"my_tickets_page:{max(page-1, 0)}:p:{tickets[0].id}")
             )
         pagination_row.append(
             InlineKeyboardButton(text=f"{page+1}/{total_pages}", callback_data="noop")
         )
-        if page < total_pages - 1:
+        if ticket_page.has_next:
             pagination_row.append(
-                InlineKeyboardButton(text="След. ➡️", callback_data=f"my_tickets_page:{page+1}")
+                InlineKeyboardButton(text="След. ➡️", callback_data=f"my_tickets_page:{page+1}:n:{tickets[-1].id}")
             )
         builder.row(*pagination_row)
     
@@ -154,31 +158,50 @@ def get_ticket_detail_keyboard(ticket: Ticket, is_owner: bool = False) -> Inline
     return builder.as_markup()
 
 
-def get_judge_tickets_keyboard() -> InlineKeyboardMarkup:
-    """Keyboard for judge ticket filters - this IS the main menu for judges"""
+def get_judge_tickets_keyboard(
+    counts: Optional[Dict[str, int]] = None,
+    my_counts: Optional[Dict[str, int]] = None
+) -> InlineKeyboardMarkup:
+    """
+    Keyboard for judge ticket filters - this IS the main menu for judges
+    
+    counts are global per-status ticket counts and my_counts the judge's own,
+    as returned by Database.get_ticket_counts(); when given, they are shown
+    on the filter buttons.
+    """
+    def label(text: str, source: Optional[Dict[str, int]], status: Optional[str] = None) -> str:
+        if source is None:
+            return text
+        count = source.get(status, 0) if status else sum(source.values())
+        return f"{text} ({count})"
+    
     builder = InlineKeyboardBuilder()
     
     builder.row(
-        InlineKeyboardButton(text="🟢 Открытые", callback_data="judge_filter:open")
+        InlineKeyboardButton(text=label("🟢 Открытые", counts, TICKET_STATUS_OPEN), callback_data="judge_filter:open")
     )
     builder.row(
-        InlineKeyboardButton(text="🟡 В работе", callback_data="judge_filter:in_progress")
+        InlineKeyboardButton(text=label("🟡 В работе", counts, TICKET_STATUS_IN_PROGRESS), callback_data="judge_filter:in_progress")
     )
     builder.row(
-        InlineKeyboardButton(text="👨‍⚖️ Мои в работе", callback_data="judge_filter:my_tickets")
+        InlineKeyboardButton(text=label("👨‍⚖️ Мои в работе", my_counts, TICKET_STATUS_IN_PROGRESS), callback_data="judge_filter:my_tickets")
     )
     builder.row(
-        InlineKeyboardButton(text="📋 Все заявки", callback_data="judge_filter:all")
+        InlineKeyboardButton(text=label("📋 Все заявки", counts), callback_data="judge_filter:all")
+    )
+    builder.row(
+        InlineKeyboardButton(text="🔍 Поиск", callback_data="judge_search")
     )
     # No "Back to menu" button - this IS the main menu for judges
     
     return builder.as_markup()
 
 
-def get_judge_ticket_list_keyboard(tickets: List[Ticket], filter_type: str, page: int = 0, per_page: int = 10) -> InlineKeyboardMarkup:
-    """Keyboard showing tickets list for judges with pagination"""
+def get_judge_ticket_list_keyboard(ticket_page: TicketPage, filter_type: str, page: int = 0, per_page: int = TICKETS_PER_PAGE) -> InlineKeyboardMarkup:
+    """Keyboard showing one page of tickets for judges with pagination"""
     builder = InlineKeyboardBuilder()
     
+    tickets = ticket_page.tickets
     if not tickets:
         builder.row(
             InlineKeyboardButton(text="« Назад", callback_data="judge_tickets")
@@ -186,12 +209,10 @@ def get_judge_ticket_list_keyboard(tickets: List[Ticket], filter_type: str, page
         return builder.as_markup()
     
     # Calculate pagination
-    total_pages = (len(tickets) - 1) // per_page + 1
-    start_idx = page * per_page
-    end_idx = min(start_idx + per_page, len(tickets))
-    page_tickets = tickets[start_idx:end_idx]
+    total_pages = max((ticket_page.total - 1) // per_page + 1, 1)
+    page = min(page, total_pages - 1) if ticket_page.has_prev else 0
     
-    for ticket in page_tickets:
+    for ticket in tickets:
         status_emoji = {
             TICKET_STATUS_OPEN: "🟢",
             TICKET_STATUS_IN_PROGRESS: "🟡",
@@ -205,19 +226,19 @@ def get_judge_ticket_list_keyboard(tickets: List[Ticket], filter_type: str, page
             )
         )
     
-    # Add pagination buttons if needed
-    if total_pages > 1:
+    # Add pagination buttons if needed; they carry the boundary ticket id as keyset cursor
+    if ticket_page.has_prev or ticket_page.has_next:
         pagination_row = []
-        if page > 0:
+        if ticket_page.has_prev:
             pagination_row.append(
-                InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"judge_page:{filter_type}:{page-1}")
+                InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"judge_page:{filter_type}:{max(page-1, 0)}:p:{tickets[0].id}")
             )
         pagination_row.append(
             InlineKeyboardButton(text=f"{page+1}/{total_pages}", callback_data="noop")
         )
-        if page < total_pages - 1:
+        if ticket_page.has_next:
             pagination_row.append(
-                InlineKeyboardButton(text="След. ➡️", callback_data=f"judge_page:{filter_type}:{page+1}")
+                InlineKeyboardButton(text="След. ➡️", callback_data=f"judge_page:{filter_type}:{page+1}:n:{tickets[-1].id}")
             )
         builder.row(*pagination_row)
     
@@ -233,6 +254,50 @@ def get_judge_ticket_list_keyboard(tickets: List[Ticket], filter_type: str, page
     return builder.as_markup()
 
 
+def get_search_results_keyboard(search_page: TicketSearchPage, per_page: int = TICKETS_PER_PAGE) -> InlineKeyboardMarkup:
+    """Keyboard showing one page of ticket search results with pagination"""
+    builder = InlineKeyboardBuilder()
+    
+    for ticket in search_page.tickets:
+        status_emoji = {
+            TICKET_STATUS_OPEN: "🟢",
+            TICKET_STATUS_IN_PROGRESS: "🟡",
+            TICKET_STATUS_CLOSED: "⚫"
+        }.get(ticket.status, "❓")
+        
+        builder.row(
+            InlineKeyboardButton(
+                text=f"{status_emoji} #{ticket.id} - {TICKET_TYPES.get(ticket.ticket_type, 'Неизвестно')}",
+                callback_data=f"judge_view_ticket:{ticket.id}"
+            )
+        )
+    
+    # Search results are ranked, so pages are addressed by offset into the ranking
+    if search_page.cursor or search_page.next_cursor is not None:
+        pagination_row = []
+        if search_page.cursor:
+            pagination_row.append(
+                InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"judge_search_page:{max(search_page.cursor - per_page, 0)}")
+            )
+        pagination_row.append(
+            InlineKeyboardButton(text=f"{search_page.cursor // per_page + 1}", callback_data="noop")
+        )
+        if search_page.next_cursor is not None:
+            pagination_row.append(
+                InlineKeyboardButton(text="След. ➡️", callback_data=f"judge_search_page:{search_page.next_cursor}")
+            )
+        builder.row(*pagination_row)
+    
+    builder.row(
+        InlineKeyboardButton(text="🔍 Новый поиск", callback_data="judge_search")
+    )
+    builder.row(
+        InlineKeyboardButton(text="« Главное меню", callback_data="back_to_menu")
+    )
+    
+    return builder.as_markup()
+
+
 def get_judge_ticket_actions_keyboard(ticket: Ticket) -> InlineKeyboardMarkup:
     """Keyboard for judge actions on a ticket"""
     builder = InlineKeyboardBuilder()
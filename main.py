@@ -10,11 +10,27 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
-from config import BOT_TOKEN, DB_PATH, RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_PERIOD, LOG_LEVEL
+from config import (
+    BOT_TOKEN, DB_PATH, DB_POOL_READERS,
+    DB_GROUP_COMMIT, DB_FLUSH_INTERVAL_MS, DB_FLUSH_MAX_OPS,
+    USER_CACHE_SIZE, USER_CACHE_TTL, ARCHIVE_DB_PATH,
+    DB_ENGINE, DB_SNAPSHOT_PATH,
+    NOTIFY_WORKERS, NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_INTERVAL,
+    OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX,
+    NOTIFY_CHAT_CAP, NOTIFY_CHAT_CAP_WINDOW,
+    CHAT_FAILURE_LIMIT, CHAT_PROBE_BASE, CHAT_PROBE_MAX,
+    ROUTING_FANOUT, ROUTING_AUTO_ASSIGN, ROUTING_ESCALATE_AFTER, ROUTING_ACTIVE_WINDOW,
+    RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_PERIOD, LOG_LEVEL
+)
 from database.db import Database
+from database.memory import MemoryDatabase
+from database.storage import Storage
 from middlewares.auth import AuthMiddleware, RoleMiddleware, RateLimitMiddleware
 from database.models import ROLE_JUDGE, ROLE_ADMIN
 from utils.scheduler import TicketScheduler
+from utils.notifier import Notifier
+from utils.outbox import OutboxWorker
+from utils.routing import TicketRouter
 
 # Import handlers
 from handlers import player, judge, admin
@@ -35,8 +51,23 @@ async def main():
     """Main function to start the bot"""
     logger.info("Starting CS2 Judge Bot...")
     
-    # Initialize database
-    db = Database(DB_PATH)
+    # Initialize database (connections stay open until shutdown)
+    db: Storage
+    if DB_ENGINE == "memory":
+        # Nothing touches disk until the optional snapshot on shutdown
+        db = MemoryDatabase(snapshot_path=DB_SNAPSHOT_PATH)
+    else:
+        db = Database(
+            DB_PATH,
+            readers=DB_POOL_READERS,
+            group_commit=DB_GROUP_COMMIT,
+            flush_interval=DB_FLUSH_INTERVAL_MS / 1000,
+            flush_max_ops=DB_FLUSH_MAX_OPS,
+            user_cache_size=USER_CACHE_SIZE,
+            user_cache_ttl=USER_CACHE_TTL,
+            archive_path=ARCHIVE_DB_PATH
+        )
+    await db.open()
     await db.init_db()
     logger.info("Database initialized")
     
@@ -47,10 +78,47 @@ async def main():
     )
     dp = Dispatcher()
     
+    # Notifications are written to the outbox with each change and delivered
+    # by the outbox worker through one paced queue; handlers get it as `outbox`
+    notifier = Notifier(
+        bot,
+        workers=NOTIFY_WORKERS,
+        global_rate=NOTIFY_GLOBAL_RATE,
+        chat_interval=NOTIFY_CHAT_INTERVAL
+    )
+    notifier.start()
+    outbox = OutboxWorker(
+        db,
+        notifier,
+        batch_size=OUTBOX_BATCH_SIZE,
+        max_attempts=OUTBOX_MAX_ATTEMPTS,
+        retry_base=OUTBOX_RETRY_BASE,
+        retry_max=OUTBOX_RETRY_MAX,
+        chat_cap=NOTIFY_CHAT_CAP,
+        cap_window=NOTIFY_CHAT_CAP_WINDOW,
+        failure_limit=CHAT_FAILURE_LIMIT,
+        probe_base=CHAT_PROBE_BASE,
+        probe_max=CHAT_PROBE_MAX
+    )
+    # Picks up whatever was left undelivered by the previous run
+    outbox.start()
+    dp["outbox"] = outbox
+    
+    # New tickets go to the least loaded active judges first; handlers get it as `routing`
+    routing = TicketRouter(
+        db,
+        fanout=ROUTING_FANOUT,
+        auto_assign=ROUTING_AUTO_ASSIGN,
+        escalate_after=ROUTING_ESCALATE_AFTER,
+        active_window=ROUTING_ACTIVE_WINDOW
+    )
+    dp["routing"] = routing
+    
     # Register middlewares
-    # Auth middleware for all handlers
-    dp.message.middleware(AuthMiddleware(db))
-    dp.callback_query.middleware(AuthMiddleware(db))
+    # Auth middleware for all handlers (one instance, served from the user cache)
+    auth_middleware = AuthMiddleware(db)
+    dp.message.middleware(auth_middleware)
+    dp.callback_query.middleware(auth_middleware)
     
     # Rate limiting middleware
     dp.message.middleware(RateLimitMiddleware(RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_PERIOD))
@@ -69,7 +137,7 @@ async def main():
     dp.include_router(admin.router)
     
     # Initialize and start scheduler
-    scheduler = TicketScheduler(db, bot)
+    scheduler = TicketScheduler(db, outbox, routing)
     scheduler.start()
     logger.info("Scheduler started")
     
@@ -80,7 +148,15 @@ async def main():
     finally:
         # Cleanup
         scheduler.stop()
+        await outbox.stop()
+        await notifier.stop()
+        logger.info(f"Outbox stats: {outbox.stats()}, pending: {await db.get_outbox_counts()}")
+        logger.info(f"Notifier stats: {notifier.stats()}")
         await bot.session.close()
+        if isinstance(db, Database):
+            logger.info(f"User cache stats: {db.user_cache.stats()}")
+            logger.info(f"Database writer stats: {db.writer_stats()}")
+        await db.close()
         logger.info("Bot stopped")
 
 
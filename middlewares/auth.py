@@ -4,11 +4,11 @@ Authentication and authorization middleware
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, User as TgUser, Message, CallbackQuery
-import time
 import logging
 
-from database.db import Database
+from database.storage import Storage
 from database.models import ROLE_JUDGE, ROLE_ADMIN
+from utils.rate_limiter import RateLimiter
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +18,7 @@ class AuthMiddleware(BaseMiddleware):
     Middleware for user authentication and registration
     """
     
-    def __init__(self, db: Database):
+    def __init__(self, db: Storage):
         super().__init__()
         self.db = db
     
@@ -47,6 +47,12 @@ class AuthMiddleware(BaseMiddleware):
                 tg_user.first_name
             )
         
+        # A user writing to the bot can get messages again, even if a
+        # notification to them failed before
+        outbox = data.get("outbox")
+        if outbox is not None:
+            outbox.chat_seen(tg_user.id)
+        
         # Add user to data for handlers
         data["user"] = user
         data["db"] = self.db
@@ -56,7 +62,8 @@ class AuthMiddleware(BaseMiddleware):
 
 class RoleMiddleware(BaseMiddleware):
     """
-    Middleware for role-based access control
+    Middleware for role-based access control, answered from the role
+    directory of the storage engine without a database read
     """
     
     def __init__(self, required_role: str):
@@ -70,15 +77,16 @@ class RoleMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         user = data.get("user")
+        db: Storage = data.get("db")
         
-        if not user:
+        if not user or db is None:
             logger.warning("RoleMiddleware: User not found in data")
             return
         
         # Check role
         if self.required_role == ROLE_JUDGE:
             # Judges and admins can access judge features
-            if user.role not in [ROLE_JUDGE, ROLE_ADMIN]:
+            if not db.roles.is_judge(user.id):
                 if isinstance(event, Message):
                     await event.answer("❌ У вас нет доступа к этой функции")
                 elif isinstance(event, CallbackQuery):
@@ -86,7 +94,7 @@ class RoleMiddleware(BaseMiddleware):
                 return
         elif self.required_role == ROLE_ADMIN:
             # Only admins can access admin features
-            if user.role != ROLE_ADMIN:
+            if not db.roles.is_admin(user.id):
                 if isinstance(event, Message):
                     await event.answer("❌ Только администраторы могут использовать эту команду")
                 elif isinstance(event, CallbackQuery):
@@ -105,7 +113,7 @@ class RateLimitMiddleware(BaseMiddleware):
         super().__init__()
         self.max_requests = max_requests
         self.period = period
-        self.user_requests: Dict[int, list] = {}
+        self.limiter = RateLimiter(max_requests, period)
     
     async def __call__(
         self,
@@ -123,20 +131,8 @@ class RateLimitMiddleware(BaseMiddleware):
         if not user_id:
             return await handler(event, data)
         
-        current_time = time.time()
-        
-        # Initialize user request history
-        if user_id not in self.user_requests:
-            self.user_requests[user_id] = []
-        
-        # Remove old requests
-        self.user_requests[user_id] = [
-            req_time for req_time in self.user_requests[user_id]
-            if current_time - req_time < self.period
-        ]
-        
-        # Check rate limit
-        if len(self.user_requests[user_id]) >= self.max_requests:
+        # Check rate limit; an allowed request takes a token
+        if not self.limiter.allow(user_id):
             if isinstance(event, Message):
                 await event.answer("⏳ Слишком много запросов. Пожалуйста, подождите немного.")
             elif isinstance(event, CallbackQuery):
@@ -144,8 +140,5 @@ class RateLimitMiddleware(BaseMiddleware):
             logger.warning(f"Rate limit exceeded for user {user_id}")
             return
         
-        # Add current request
-        self.user_requests[user_id].append(current_time)
-        
         return await handler(event, data)
 
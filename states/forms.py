@@ -15,3 +15,7 @@ class CommentForm(StatesGroup):
     """States for adding a comment to a ticket"""
     entering_comment = State()
 
+
+class SearchForm(StatesGroup):
+    """States for judge full-text ticket search"""
+    entering_query = State()
@@ -0,0 +1,196 @@
+"""
+Outbox delivery: what the worker sends, and what it acknowledges, retries or gives up on
+"""
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError
+
+from database.db import Database
+from database.memory import MemoryDatabase
+from database.models import (
+    Notice, TICKET_TYPE_HELP_NEEDED, OUTBOX_STATUS_PENDING, OUTBOX_STATUS_DEAD, CHAT_STATE_BLOCKED
+)
+from utils.notifier import Notifier
+from utils.outbox import OutboxWorker, DIGEST_NEW_TICKETS, MESSAGE_LIMIT, SPLIT_FOLLOWUP_DELAY
+
+
+class FakeBot:
+    """Records sent messages; raises the queued errors for a chat first"""
+    
+    def __init__(self):
+        self.sent = []
+        self.errors = {}
+    
+    def fail(self, chat_id: int, *errors: Exception):
+        self.errors.setdefault(chat_id, []).extend(errors)
+    
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def network_error() -> TelegramNetworkError:
+    return TelegramNetworkError(method=None, message="Request timeout error")
+
+
+def blocked() -> TelegramForbiddenError:
+    return TelegramForbiddenError(method=None, message="Forbidden: bot was blocked by the user")
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def run(request, tmp_path):
+    """Run scenario(db, bot, worker) against a fresh engine and a fake bot"""
+    def runner(scenario, **worker_options):
+        async def main():
+            if request.param == "sqlite":
+                db = Database(str(tmp_path / "bot.db"), readers=2)
+            else:
+                db = MemoryDatabase()
+            await db.init_db()
+            await db.create_user(1, "admin", "Admin")
+            bot = FakeBot()
+            notifier = Notifier(bot, global_rate=0, chat_interval=0, max_attempts=1)
+            options = {"retry_base": 0, **worker_options}
+            worker = OutboxWorker(db, notifier, **options)
+            try:
+                return await scenario(db, bot, worker)
+            finally:
+                await notifier.stop()
+                await db.close()
+        return asyncio.run(main())
+    return runner
+
+
+async def notify(db, *notices: Notice):
+    """Write notices to the outbox together with a new ticket"""
+    await db.create_ticket(1, TICKET_TYPE_HELP_NEEDED, "Заявка", notify=lambda ticket: list(notices))
+
+
+def test_delivered_messages_are_acknowledged(run):
+    async def scenario(db, bot, worker):
+        await notify(db, Notice(10, "first"), Notice(11, "second"))
+        handled = await worker.deliver_batch()
+        return handled, bot.sent, await db.get_outbox_counts(), await worker.deliver_batch()
+    
+    handled, sent, counts, again = run(scenario)
+    assert handled == 2
+    assert sorted(sent) == [(10, "first"), (11, "second")]
+    assert counts == {}
+    assert again == 0
+
+
+def test_transient_failures_are_retried_then_dead(run):
+    async def scenario(db, bot, worker):
+        bot.fail(10, network_error(), network_error())
+        bot.fail(11, network_error())
+        await notify(db, Notice(10, "unlucky"), Notice(11, "lucky"))
+        await worker.deliver_batch()
+        after_first = (await db.get_due_outbox(), await db.get_outbox_counts())
+        await worker.deliver_batch()
+        return after_first, bot.sent, await db.get_outbox_counts(), worker.stats()
+    
+    (pending, first_counts), sent, counts, stats = run(scenario, max_attempts=2)
+    assert sorted((m.chat_id, m.attempts) for m in pending) == [(10, 1), (11, 1)]
+    assert first_counts == {OUTBOX_STATUS_PENDING: 2}
+    assert sent == [(11, "lucky")]
+    assert counts == {OUTBOX_STATUS_DEAD: 1}
+    assert (stats["delivered"], stats["retried"], stats["dead"]) == (1, 2, 1)
+
+
+def test_permanent_failure_is_a_dead_letter_at_once(run):
+    async def scenario(db, bot, worker):
+        bot.fail(10, blocked())
+        await notify(db, Notice(10, "never"))
+        await worker.deliver_batch()
+        return await db.get_outbox_counts(), await db.get_due_outbox()
+    
+    counts, pending = run(scenario)
+    assert counts == {OUTBOX_STATUS_DEAD: 1}
+    assert pending == []
+
+
+def test_digest_is_sent_once_and_acknowledges_every_source(run):
+    async def scenario(db, bot, worker):
+        for i in range(3):
+            await notify(db, Notice(10, f"Заявка #{i}", digest_key=DIGEST_NEW_TICKETS))
+        await worker.deliver_batch()
+        return bot.sent, await db.get_outbox_counts()
+    
+    sent, counts = run(scenario)
+    assert len(sent) == 1
+    chat_id, text = sent[0]
+    assert chat_id == 10 and text.startswith("🆕 Новые заявки (3):")
+    assert all(f"Заявка #{i}" in text for i in range(3))
+    assert counts == {}
+
+
+def test_chat_over_its_budget_waits_without_spending_attempts(run):
+    async def scenario(db, bot, worker):
+        await notify(db, Notice(10, "one"))
+        await worker.deliver_batch()
+        await notify(db, Notice(10, "two"))
+        await worker.deliver_batch()
+        return bot.sent, await db.get_outbox_counts(), await db.get_due_outbox()
+    
+    sent, counts, due = run(scenario, chat_cap=1, cap_window=60)
+    assert sent == [(10, "one")]
+    assert counts == {OUTBOX_STATUS_PENDING: 1}
+    assert due == []
+
+
+def test_digest_cut_at_the_length_limit_keeps_the_rest_pending(run):
+    async def scenario(db, bot, worker):
+        for i in range(12):
+            await notify(db, Notice(10, f"{i:02d} " + "x" * 500, digest_key=DIGEST_NEW_TICKETS))
+        await worker.deliver_batch()
+        first = (list(bot.sent), await db.get_outbox_counts())
+        # The rest is held for a moment, then goes out as the next message
+        await asyncio.sleep(SPLIT_FOLLOWUP_DELAY + 0.1)
+        await worker.deliver_batch()
+        return first, bot.sent, await db.get_outbox_counts()
+    
+    (first_sent, first_counts), sent, counts = run(scenario)
+    assert len(first_sent) == 1
+    assert len(first_sent[0][1]) <= MESSAGE_LIMIT
+    included = first_sent[0][1].count(" x")
+    assert 0 < included < 12
+    assert first_counts == {OUTBOX_STATUS_PENDING: 12 - included}
+    
+    assert len(sent) == 2 and all(len(text) <= MESSAGE_LIMIT for _, text in sent)
+    numbers = [line[:2] for _, text in sent for line in text.split("\n") if " xx" in line]
+    assert numbers == [f"{i:02d}" for i in range(12)]
+    assert counts == {}
+
+
+def test_chat_is_marked_after_failure_limit_chat_errors(run):
+    async def scenario(db, bot, worker):
+        health = []
+        for i in range(2):
+            bot.fail(10, blocked())
+            await notify(db, Notice(10, f"try {i}"))
+            await worker.deliver_batch()
+            health.append(await db.get_chat_health())
+        return health
+    
+    after_one, after_two = run(scenario, failure_limit=2)
+    assert after_one == []
+    assert [(h.chat_id, h.state, h.failures) for h in after_two] == [(10, CHAT_STATE_BLOCKED, 2)]
+
+
+def test_rejected_messages_do_not_mark_the_chat(run):
+    async def scenario(db, bot, worker):
+        for i in range(3):
+            bot.fail(10, TelegramBadRequest(method=None, message="Bad Request: can't parse entities"))
+            await notify(db, Notice(10, f"<b>{i}"))
+            await worker.deliver_batch()
+        await notify(db, Notice(10, "fine"))
+        await worker.deliver_batch()
+        return await db.get_chat_health(), bot.sent, await db.get_outbox_counts()
+    
+    health, sent, counts = run(scenario, failure_limit=2)
+    assert health == []
+    assert sent == [(10, "fine")]
+    assert counts == {OUTBOX_STATUS_DEAD: 3}
@@ -0,0 +1,229 @@
+"""
+Query plan regression suite for the SQLite engine
+
+Every Storage method is run against a populated database with archiving on,
+every statement the connections execute is recorded, and each one is checked
+with EXPLAIN QUERY PLAN: none may scan a whole table or sort in a temp B-tree.
+Statements that must look at everything they read are listed in ALLOWED with
+the reason.
+"""
+import asyncio
+import inspect
+import re
+import sqlite3
+from typing import Dict, List
+
+import pytest
+
+from database.db import Database
+from database.models import (
+    ChatHealth, Notice, TICKET_STATUS_OPEN, TICKET_STATUS_IN_PROGRESS, TICKET_STATUS_CLOSED,
+    TICKET_TYPE_HELP_NEEDED, ROLE_JUDGE
+)
+from database.storage import Storage
+
+LIFECYCLE = {"open", "close", "init_db"}
+
+# Normalized statement prefix -> why it may scan or sort
+ALLOWED = {
+    "SELECT status, COUNT(*) FROM outbox GROUP BY status":
+        "admin stats count the whole outbox",
+    "SELECT chat_id, state, failures":
+        "the unreachable chat list is read whole, it only holds failing chats",
+    "WITH hits (ticket_id, rank) AS":
+        "search ranks every match by bm25 before taking a page",
+    "SELECT k, v FROM ?.?":
+        "FTS5 reading its own config table",
+}
+
+SCAN = re.compile(r"^SCAN (\S+)(?!.* USING (?:COVERING )?INDEX| USING INTEGER PRIMARY KEY| VIRTUAL TABLE)")
+
+
+def _normalize(statement: str) -> str:
+    """Statement with literals replaced by ?, so repeated calls collapse into one"""
+    statement = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    statement = re.sub(r"\b\d+\b", "?", statement)
+    return " ".join(statement.split())
+
+
+def _storage_methods() -> List[str]:
+    """Public data methods of the Storage protocol"""
+    return sorted(
+        name for name, member in inspect.getmembers(Storage, inspect.iscoroutinefunction)
+        if not name.startswith("_") and name not in LIFECYCLE
+    )
+
+
+def _planned(statements: Dict[str, str]) -> Dict[str, str]:
+    """Statements that read or write rows, without migrations, pragmas and transaction control"""
+    return {
+        key: statement for key, statement in statements.items()
+        if key.split(" ", 1)[0].upper() in ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+    }
+
+
+async def _workload(db: Database):
+    """Fill the database and call every Storage method at least once"""
+    for user_id in range(1, 31):
+        await db.create_user(user_id, f"user{user_id}", f"User {user_id}")
+    for judge_id in (2, 3, 4):
+        await db.update_user_role(judge_id, ROLE_JUDGE, notify=lambda user: [Notice(user.id, "judge")])
+    
+    tickets = []
+    for i in range(300):
+        ticket = await db.create_ticket(
+            5 + i % 25, TICKET_TYPE_HELP_NEEDED, f"Сервер упал в матче {i}",
+            notify=lambda ticket: [Notice(2, f"new {ticket.id}", digest_key="new_tickets")]
+        )
+        tickets.append(ticket.id)
+    
+    for i, ticket_id in enumerate(tickets[:120]):
+        await db.update_ticket_status(
+            ticket_id, TICKET_STATUS_IN_PROGRESS, judge_id=2 + i % 3, from_statuses=(TICKET_STATUS_OPEN,)
+        )
+        await db.create_comment(ticket_id, 2 + i % 3, f"Комментарий {i}", notify=lambda c: [Notice(5, "c")])
+    await db.update_ticket_status(tickets[0], TICKET_STATUS_CLOSED, closed_by=2)
+    await db.close_tickets(tickets[1:60], "Закрыта автоматически", notify=lambda t: [Notice(t.user_id, "closed")])
+    
+    # The archive takes everything closed so far; later closes stay hot
+    await db.archive_closed_tickets(0, batch_size=25)
+    await db.close_tickets(tickets[60:70], "Закрыта")
+    await db.create_ticket(6, TICKET_TYPE_HELP_NEEDED, "Никто не взял", escalate_after=0, routed=[2])
+    await db.pop_due_escalations(notify=lambda t, routed: [Notice(3, "late")])
+    
+    await db.get_user(7)
+    await db.get_user_by_username("user8")
+    await db.get_users([9, 10, 11])
+    await db.get_judges()
+    await db.get_ticket(tickets[0])
+    await db.get_ticket(tickets[250])
+    await db.get_user_tickets(5)
+    await db.get_user_tickets(5, TICKET_STATUS_CLOSED)
+    await db.get_all_tickets()
+    await db.get_all_tickets(TICKET_STATUS_OPEN)
+    await db.get_judge_tickets(2)
+    await db.get_judge_tickets(2, TICKET_STATUS_IN_PROGRESS)
+    
+    for scope_call in (
+        lambda **kw: db.get_all_tickets_page(**kw),
+        lambda **kw: db.get_all_tickets_page(TICKET_STATUS_OPEN, **kw),
+        lambda **kw: db.get_user_tickets_page(5, **kw),
+        lambda **kw: db.get_user_tickets_page(5, TICKET_STATUS_CLOSED, **kw),
+        lambda **kw: db.get_judge_tickets_page(2, **kw),
+        lambda **kw: db.get_judge_tickets_page(2, TICKET_STATUS_IN_PROGRESS, **kw),
+    ):
+        first = await scope_call(limit=3)
+        second = await scope_call(after_id=first.tickets[-1].id, limit=3)
+        await scope_call(before_id=second.tickets[0].id, limit=3)
+    
+    await db.get_ticket_counts()
+    await db.get_ticket_counts(user_id=5)
+    await db.get_ticket_counts(judge_id=2)
+    await db.get_judges_ticket_counts()
+    await db.search_tickets("сервер")
+    await db.search_tickets("комментарий", TICKET_STATUS_CLOSED, limit=5, cursor=5)
+    await db.get_old_open_tickets(0)
+    
+    await db.get_comment(1)
+    await db.get_ticket_comments(tickets[0])
+    await db.get_ticket_comments(tickets[100])
+    await db.get_ticket_detail(tickets[0])
+    await db.get_ticket_detail(tickets[100])
+    
+    due = await db.get_due_outbox(limit=50)
+    await db.complete_outbox(
+        delivered=[message.id for message in due[:10]],
+        retry=[(message.id, 60, "timeout") for message in due[10:20]],
+        dead=[(message.id, "blocked") for message in due[20:25]],
+        deferred=[(message.id, 30) for message in due[25:30]]
+    )
+    await db.get_outbox_counts()
+    
+    now = due[0].created_at
+    await db.save_chat_health([ChatHealth(9, "blocked", 1, "Forbidden", now, now)], reachable=[10])
+    await db.get_chat_health()
+
+
+async def _record(path) -> Dict[str, List[str]]:
+    """
+    Run the workload and return the plan of every statement it executed,
+    keyed by the normalized statement.
+    
+    Plans are taken before close() runs PRAGMA optimize, so the planner has
+    no statistics, as on a fresh database, and a test-sized table can't
+    talk it into a scan that a real one would not get.
+    """
+    db = Database(str(path / "bot.db"), readers=2, archive_path=str(path / "archive.db"))
+    await db.init_db()
+    
+    statements: Dict[str, str] = {}
+    
+    def trace(statement: str):
+        statements.setdefault(_normalize(statement), statement)
+    
+    for conn in [db._writer, *db._reader_conns]:
+        await conn.set_trace_callback(trace)
+    
+    called = set()
+    for name in _storage_methods():
+        method = getattr(db, name)
+        
+        async def counted(*args, _name=name, _method=method, **kwargs):
+            called.add(_name)
+            return await _method(*args, **kwargs)
+        
+        setattr(db, name, counted)
+    
+    try:
+        await _workload(db)
+        
+        for conn in [db._writer, *db._reader_conns]:
+            await conn.set_trace_callback(None)
+        explain = sqlite3.connect(path / "bot.db")
+        explain.execute("ATTACH DATABASE ? AS archive", (str(path / "archive.db"),))
+        plans = {
+            key: [row[3] for row in explain.execute(f"EXPLAIN QUERY PLAN {statement}")]
+            for key, statement in _planned(statements).items()
+        }
+        explain.close()
+    finally:
+        await db.close()
+    
+    missing = set(_storage_methods()) - called
+    assert not missing, f"workload does not exercise {sorted(missing)}"
+    return plans
+
+
+@pytest.fixture(scope="module")
+def plans(tmp_path_factory) -> Dict[str, List[str]]:
+    return asyncio.run(_record(tmp_path_factory.mktemp("plans")))
+
+
+def test_no_full_scans_or_temp_sorts(plans):
+    failures = []
+    for key, plan in sorted(plans.items()):
+        if any(key.startswith(prefix) for prefix in ALLOWED):
+            continue
+        if any(SCAN.match(step) or "USE TEMP B-TREE" in step for step in plan):
+            failures.append(f"{key}\n    " + "\n    ".join(plan))
+    assert not failures, "statements scanning or sorting:\n" + "\n".join(failures)
+
+
+def test_allowed_statements_still_exist(plans):
+    # An allowance for a statement that was removed or rewritten is stale
+    for prefix in ALLOWED:
+        assert any(key.startswith(prefix) for key in plans), f"no statement starts with {prefix!r}"
+
+
+@pytest.mark.parametrize("fragment, index", [
+    ("tickets WHERE status = ? AND closed_at <= ?", "idx_tickets_closed_at"),
+    ("FROM outbox WHERE status = ? AND next_attempt_at <= ?", "idx_outbox_due"),
+    ("FROM ticket_escalations e CROSS JOIN tickets t", "idx_ticket_escalations_due"),
+    ("main.tickets WHERE user_id = ?", "idx_tickets_user_created"),
+    ("tickets WHERE judge_id = ? ORDER BY", "idx_tickets_judge_created"),
+])
+def test_hot_paths_use_their_index(plans, fragment, index):
+    matching = {key: plan for key, plan in plans.items() if fragment in key}
+    assert matching, f"no statement contains {fragment!r}"
+    for key, plan in matching.items():
+        assert any(index in step for step in plan), f"{key}\n    " + "\n    ".join(plan)
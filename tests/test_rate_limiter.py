@@ -0,0 +1,70 @@
+"""
+RateLimiter: token buckets per user, refilled over the period and dropped when idle
+"""
+from utils.rate_limiter import RateLimiter
+
+
+def test_requests_within_capacity_are_allowed_then_rejected():
+    limiter = RateLimiter(3, 60)
+    
+    assert [limiter.allow(1, now=0) for _ in range(4)] == [True, True, True, False]
+    # Other users have their own bucket
+    assert limiter.allow(2, now=0)
+
+
+def test_bucket_refills_over_the_period():
+    limiter = RateLimiter(3, 60)
+    for _ in range(3):
+        limiter.allow(1, now=0)
+    
+    # One token comes back every period / capacity seconds
+    assert not limiter.allow(1, now=19)
+    assert limiter.allow(1, now=21)
+    assert not limiter.allow(1, now=22)
+
+
+def test_rejected_requests_do_not_take_tokens():
+    limiter = RateLimiter(2, 10)
+    limiter.allow(1, now=0)
+    limiter.allow(1, now=0)
+    for _ in range(5):
+        limiter.allow(1, now=1)
+    
+    assert limiter.allow(1, now=5.1)
+
+
+def test_idle_buckets_are_evicted():
+    limiter = RateLimiter(5, 60)
+    for user_id in range(1000):
+        limiter.allow(user_id, now=user_id * 0.01)
+    assert len(limiter) == 1000
+    
+    # A period later only the users active in it are tracked
+    limiter.allow(5000, now=70)
+    assert len(limiter) == 1
+    assert limiter.stats()["evicted"] == 1000
+
+
+def test_evicted_user_starts_with_a_full_bucket():
+    limiter = RateLimiter(2, 60)
+    limiter.allow(1, now=0)
+    limiter.allow(1, now=0)
+    
+    limiter.allow(2, now=61)
+    assert [limiter.allow(1, now=61) for _ in range(3)] == [True, True, False]
+
+
+def test_zero_period_never_limits():
+    limiter = RateLimiter(1, 0)
+    
+    assert all(limiter.allow(1, now=0) for _ in range(10))
+    assert len(limiter) == 1
+
+
+def test_stats_count_decisions():
+    limiter = RateLimiter(1, 60)
+    limiter.allow(1, now=0)
+    limiter.allow(1, now=0)
+    limiter.allow(2, now=0)
+    
+    assert limiter.stats() == {"allowed": 2, "rejected": 1, "evicted": 0, "tracked_users": 2}
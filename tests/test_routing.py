@@ -0,0 +1,54 @@
+"""
+TicketRouter: escalations are written with the ticket and skip the judges already told
+"""
+import asyncio
+
+from database.memory import MemoryDatabase
+from database.models import TICKET_TYPE_HELP_NEEDED, ROLE_JUDGE
+from utils.routing import TicketRouter
+
+
+async def _judges(db: MemoryDatabase, count: int):
+    """Register the admin (user 1) and count - 1 judges, plus player 100"""
+    await db.init_db()
+    for user_id in range(1, count + 1):
+        await db.create_user(user_id, f"judge{user_id}", f"Judge {user_id}")
+    for user_id in range(2, count + 1):
+        await db.update_user_role(user_id, ROLE_JUDGE)
+    await db.create_user(100, "player", "Player")
+
+
+def test_escalation_only_when_some_judges_were_not_told():
+    async def scenario():
+        db = MemoryDatabase()
+        await _judges(db, 4)
+        router = TicketRouter(db, fanout=2, escalate_after=900)
+        everyone = TicketRouter(db, fanout=0, escalate_after=900)
+        disabled = TicketRouter(db, fanout=2, escalate_after=0)
+        return (
+            await router.escalation(await router.pick()),
+            await everyone.escalation(await everyone.pick()),
+            await disabled.escalation(await disabled.pick()),
+        )
+    
+    assert asyncio.run(scenario()) == (900, None, None)
+
+
+def test_escalation_skips_the_routed_judges():
+    async def scenario():
+        db = MemoryDatabase()
+        await _judges(db, 5)
+        router = TicketRouter(db, fanout=2, escalate_after=900)
+        judges = await router.pick()
+        # Already due, as if escalate_after had passed
+        ticket = await db.create_ticket(
+            100, TICKET_TYPE_HELP_NEEDED, "Сервер <упал>", escalate_after=0, routed=[judge.id for judge in judges]
+        )
+        await router.dispatched(ticket, judges)
+        escalated = await router.escalate()
+        return [judge.id for judge in judges], escalated, await db.get_due_outbox()
+    
+    routed, escalated, due = asyncio.run(scenario())
+    assert escalated == 1
+    assert sorted(message.chat_id for message in due) == sorted(set(range(1, 6)) - set(routed))
+    assert all("Сервер &lt;упал&gt;" in message.text for message in due)
@@ -0,0 +1,78 @@
+"""
+Judge search handlers: the query is echoed back HTML-escaped
+"""
+import asyncio
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from database.memory import MemoryDatabase
+from database.models import TICKET_TYPE_HELP_NEEDED
+
+# Handlers read their limits from config; use the example settings when no config.py is deployed
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not os.path.exists(os.path.join(ROOT, "config.py")):
+    os.environ.setdefault("BOT_TOKEN", "test-token")
+    _loader = importlib.machinery.SourceFileLoader("config", os.path.join(ROOT, "config.py.example"))
+    sys.modules["config"] = importlib.util.module_from_spec(importlib.util.spec_from_loader("config", _loader))
+    _loader.exec_module(sys.modules["config"])
+
+from handlers.judge import search_query_entered, search_pagination  # noqa: E402
+
+
+class FakeMessage:
+    """Records the texts answered or edited in"""
+    
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.answers = []
+    
+    async def answer(self, text: str, **kwargs):
+        self.answers.append(text)
+    
+    async def edit_text(self, text: str, **kwargs):
+        self.answers.append(text)
+
+
+class FakeCallback:
+    def __init__(self, data: str, message: FakeMessage):
+        self.data = data
+        self.message = message
+    
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+def _state() -> FSMContext:
+    return FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+
+
+def test_query_is_escaped_in_search_replies():
+    async def scenario():
+        db = MemoryDatabase()
+        await db.init_db()
+        await db.create_user(1, "player", "Player")
+        await db.create_ticket(1, TICKET_TYPE_HELP_NEEDED, "R&D <team> lost a<b")
+        state = _state()
+        
+        found = FakeMessage("R&D <team>")
+        await search_query_entered(found, db, state)
+        
+        page = FakeMessage()
+        await search_pagination(FakeCallback("judge_search_page:0", page), db, state)
+        
+        missing = FakeMessage("a<b & nothing")
+        await search_query_entered(missing, db, _state())
+        return found.answers, page.answers, missing.answers
+    
+    found, page, missing = asyncio.run(scenario())
+    
+    assert "«R&amp;D &lt;team&gt;»" in found[0]
+    assert "«R&amp;D &lt;team&gt;»" in page[0]
+    assert "«a&lt;b &amp; nothing»" in missing[0]
+    assert "ничего не найдено" in missing[0]
@@ -0,0 +1,350 @@
+"""
+Storage contract: both engines must behave the same through the Storage protocol
+
+Every test runs once on the SQLite engine and once on the in-memory engine.
+"""
+import asyncio
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.db import Database
+from database.memory import MemoryDatabase
+from database.models import (
+    ChatHealth, Notice, ROLE_ADMIN, ROLE_JUDGE, ROLE_PLAYER,
+    TICKET_STATUS_OPEN, TICKET_STATUS_IN_PROGRESS, TICKET_STATUS_CLOSED,
+    TICKET_TYPE_HELP_NEEDED, TICKET_TYPE_MATCH_RESCHEDULE,
+    OUTBOX_STATUS_PENDING, OUTBOX_STATUS_DEAD, CHAT_STATE_BLOCKED
+)
+from database.storage import Storage
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def run(request, tmp_path):
+    """Run scenario(db) on a fresh engine and return its result"""
+    def runner(scenario):
+        async def main():
+            if request.param == "sqlite":
+                db = Database(str(tmp_path / "bot.db"), readers=2)
+            else:
+                db = MemoryDatabase()
+            await db.init_db()
+            try:
+                return await scenario(db)
+            finally:
+                await db.close()
+        return asyncio.run(main())
+    return runner
+
+
+async def _users(db: Storage, count: int = 4):
+    """Register users 1..count; user 1 becomes the admin, user 2 a judge"""
+    for user_id in range(1, count + 1):
+        await db.create_user(user_id, f"user{user_id}", f"User {user_id}")
+    await db.update_user_role(2, ROLE_JUDGE)
+
+
+def test_engines_implement_storage(run):
+    assert run(lambda db: asyncio.sleep(0, isinstance(db, Storage)))
+
+
+def test_first_user_is_admin_and_keeps_role_on_update(run):
+    async def scenario(db):
+        admin = await db.create_user(1, "first", "First")
+        player = await db.create_user(2, "second", "Second")
+        again = await db.create_user(1, "renamed", "Renamed")
+        return admin, player, again, await db.get_user_by_username("renamed"), await db.get_user_by_username("first")
+    
+    admin, player, again, by_name, old_name = run(scenario)
+    assert admin.role == ROLE_ADMIN and player.role == ROLE_PLAYER
+    assert again.role == ROLE_ADMIN and again.first_name == "Renamed"
+    assert by_name == again
+    assert old_name is None
+
+
+def test_get_users_returns_known_users_by_id(run):
+    async def scenario(db):
+        await _users(db)
+        # One of them cached, the rest read
+        await db.get_user(3)
+        return await db.get_users([4, 3, 99, 1, 3])
+    
+    users = run(scenario)
+    assert sorted(users) == [1, 3, 4]
+    assert all(user.id == user_id for user_id, user in users.items())
+    assert users[4].username == "user4"
+
+
+def test_role_updates_and_judges(run):
+    async def scenario(db):
+        await _users(db)
+        missing = await db.update_user_role(99, ROLE_JUDGE)
+        judges = await db.get_judges()
+        await db.update_user_role(2, ROLE_PLAYER)
+        return missing, judges, await db.get_judges(), db.roles.is_judge(2), (await db.get_user(2)).role
+    
+    missing, judges, after, is_judge, role = run(scenario)
+    assert missing is None
+    assert [judge.id for judge in judges] == [1, 2]
+    assert [judge.id for judge in after] == [1]
+    assert not is_judge and role == ROLE_PLAYER
+
+
+def test_status_update_guard(run):
+    async def scenario(db):
+        await _users(db)
+        ticket = await db.create_ticket(3, TICKET_TYPE_HELP_NEEDED, "Сервер упал")
+        taken = await db.update_ticket_status(
+            ticket.id, TICKET_STATUS_IN_PROGRESS, judge_id=2, from_statuses=(TICKET_STATUS_OPEN,)
+        )
+        again = await db.update_ticket_status(
+            ticket.id, TICKET_STATUS_IN_PROGRESS, judge_id=1, from_statuses=(TICKET_STATUS_OPEN,)
+        )
+        closed = await db.update_ticket_status(ticket.id, TICKET_STATUS_CLOSED, closed_by=2)
+        return ticket, taken, again, closed, await db.get_ticket(ticket.id), await db.get_ticket(999)
+    
+    ticket, taken, again, closed, stored, missing = run(scenario)
+    assert ticket.status == TICKET_STATUS_OPEN and ticket.judge_id is None
+    assert taken.judge_id == 2 and taken.status == TICKET_STATUS_IN_PROGRESS
+    assert again is None
+    assert closed.closed_by == 2 and closed.closed_at is not None
+    assert stored == closed
+    assert missing is None
+
+
+def test_bulk_close_skips_closed_and_comments_each(run):
+    async def scenario(db):
+        await _users(db)
+        ids = [(await db.create_ticket(3, TICKET_TYPE_HELP_NEEDED, f"Заявка {i}")).id for i in range(4)]
+        await db.update_ticket_status(ids[0], TICKET_STATUS_CLOSED, closed_by=2)
+        closed = await db.close_tickets(list(reversed(ids)) + [999], "Закрыта автоматически")
+        return ids, closed, [await db.get_ticket_comments(ticket_id) for ticket_id in ids]
+    
+    ids, closed, comments = run(scenario)
+    assert [ticket.id for ticket in closed] == ids[1:]
+    assert all(ticket.closed_by is None for ticket in closed)
+    assert comments[0] == []
+    assert [[(c.judge_id, c.text) for c in cs] for cs in comments[1:]] == [[(3, "Закрыта автоматически")]] * 3
+
+
+def test_keyset_pages_walk_both_ways(run):
+    async def scenario(db):
+        await _users(db)
+        ids = [(await db.create_ticket(3 + i % 2, TICKET_TYPE_HELP_NEEDED, f"Заявка {i}")).id for i in range(7)]
+        pages = [await db.get_all_tickets_page(limit=3)]
+        while pages[-1].has_next:
+            pages.append(await db.get_all_tickets_page(after_id=pages[-1].tickets[-1].id, limit=3))
+        back = await db.get_all_tickets_page(before_id=pages[-1].tickets[0].id, limit=3)
+        user = await db.get_user_tickets_page(3, limit=10)
+        gone = await db.get_all_tickets_page(after_id=12345, limit=3)
+        return ids, pages, back, user, gone
+    
+    ids, pages, back, user, gone = run(scenario)
+    newest_first = list(reversed(ids))
+    assert [[t.id for t in page.tickets] for page in pages] == [newest_first[:3], newest_first[3:6], newest_first[6:]]
+    assert [(page.has_prev, page.has_next) for page in pages] == [(False, True), (True, True), (True, False)]
+    assert all(page.total == 7 for page in pages)
+    assert [t.id for t in back.tickets] == newest_first[3:6] and back.has_prev and back.has_next
+    assert [t.id for t in user.tickets] == newest_first[::2] and user.total == 4
+    assert gone.tickets == pages[0].tickets
+
+
+def test_counts(run):
+    async def scenario(db):
+        await _users(db)
+        ids = [(await db.create_ticket(3 + i % 2, TICKET_TYPE_HELP_NEEDED, f"Заявка {i}")).id for i in range(5)]
+        await db.update_ticket_status(ids[0], TICKET_STATUS_IN_PROGRESS, judge_id=2)
+        await db.update_ticket_status(ids[1], TICKET_STATUS_IN_PROGRESS, judge_id=2)
+        await db.update_ticket_status(ids[1], TICKET_STATUS_CLOSED, closed_by=2)
+        return (
+            await db.get_ticket_counts(),
+            await db.get_ticket_counts(user_id=3),
+            await db.get_ticket_counts(judge_id=2),
+            await db.get_judges_ticket_counts(),
+        )
+    
+    everything, user, judge, judges = run(scenario)
+    assert everything == {TICKET_STATUS_OPEN: 3, TICKET_STATUS_IN_PROGRESS: 1, TICKET_STATUS_CLOSED: 1}
+    assert user == {TICKET_STATUS_OPEN: 2, TICKET_STATUS_IN_PROGRESS: 1}
+    assert judge == {TICKET_STATUS_IN_PROGRESS: 1, TICKET_STATUS_CLOSED: 1}
+    assert judges == {2: judge}
+
+
+def test_search_matches_descriptions_and_comments(run):
+    async def scenario(db):
+        await _users(db)
+        first = await db.create_ticket(3, TICKET_TYPE_MATCH_RESCHEDULE, "Перенос матча с командой Спартак")
+        second = await db.create_ticket(4, TICKET_TYPE_HELP_NEEDED, "Сервер не отвечает")
+        await db.create_comment(second.id, 2, "Спартак тоже жаловался")
+        await db.update_ticket_status(second.id, TICKET_STATUS_CLOSED, closed_by=2)
+        return (
+            first, second,
+            await db.search_tickets("спарт"),
+            await db.search_tickets("спарт", TICKET_STATUS_CLOSED),
+            await db.search_tickets("!!!"),
+        )
+    
+    first, second, both, closed, empty = run(scenario)
+    assert {t.id for t in both.tickets} == {first.id, second.id} and both.next_cursor is None
+    assert [t.id for t in closed.tickets] == [second.id]
+    assert empty.tickets == []
+
+
+def test_ticket_detail(run):
+    async def scenario(db):
+        await _users(db)
+        ticket = await db.create_ticket(3, TICKET_TYPE_HELP_NEEDED, "Нужна помощь")
+        await db.update_ticket_status(ticket.id, TICKET_STATUS_IN_PROGRESS, judge_id=2)
+        comment = await db.create_comment(ticket.id, 2, "Смотрю")
+        return comment, await db.get_comment(comment.id), await db.get_ticket_detail(ticket.id), await db.get_ticket_detail(999)
+    
+    comment, stored, detail, missing = run(scenario)
+    assert stored == comment
+    assert detail.owner.id == 3 and detail.assignee.id == 2 and detail.closer is None
+    assert [(c.id, author.id) for c, author in detail.comments] == [(comment.id, 2)]
+    assert missing is None
+
+
+def test_old_open_tickets(run):
+    async def scenario(db):
+        await _users(db)
+        ids = [(await db.create_ticket(3, TICKET_TYPE_HELP_NEEDED, f"Заявка {i}")).id for i in range(3)]
+        await db.update_ticket_status(ids[1], TICKET_STATUS_IN_PROGRESS, judge_id=2)
+        await db.update_ticket_status(ids[2], TICKET_STATUS_CLOSED, closed_by=2)
+        return ids, await db.get_old_open_tickets(0), await db.get_old_open_tickets(1)
+    
+    ids, old, recent = run(scenario)
+    assert sorted(t.id for t in old) == ids[:2]
+    assert recent == []
+
+
+def test_notices_are_written_with_the_change(run):
+    async def scenario(db):
+        await _users(db)
+        ticket = await db.create_ticket(
+            3, TICKET_TYPE_HELP_NEEDED, "Заявка",
+            notify=lambda t: [Notice(2, f"new {t.id}"), Notice(1, f"new {t.id}", digest_key="new", delay=3600)]
+        )
+        not_taken = await db.update_ticket_status(
+            ticket.id, TICKET_STATUS_CLOSED, from_statuses=(TICKET_STATUS_IN_PROGRESS,),
+            notify=lambda t: [Notice(3, "never")]
+        )
+        return ticket, not_taken, await db.get_due_outbox(), await db.get_outbox_counts()
+    
+    ticket, not_taken, due, counts = run(scenario)
+    assert not_taken is None
+    assert [(m.chat_id, m.text) for m in due] == [(2, f"new {ticket.id}")]
+    assert counts == {OUTBOX_STATUS_PENDING: 2}
+
+
+def test_digest_siblings_come_with_due_messages(run):
+    async def scenario(db):
+        await _users(db)
+        for i, delay in enumerate((0, 600, 600)):
+            await db.create_ticket(
+                3, TICKET_TYPE_HELP_NEEDED, f"Заявка {i}",
+                notify=lambda t, delay=delay: [Notice(2, f"new {t.id}", digest_key="new", delay=delay)]
+            )
+        return await db.get_due_outbox()
+    
+    due = run(scenario)
+    assert [m.text for m in due] == ["new 1", "new 2", "new 3"]
+
+
+def test_digest_siblings_in_backoff_wait_until_due(run):
+    async def scenario(db):
+        await _users(db)
+        for i, delay in enumerate((0, 600, 600)):
+            await db.create_ticket(
+                3, TICKET_TYPE_HELP_NEEDED, f"Заявка {i}",
+                notify=lambda t, delay=delay: [Notice(2, f"new {t.id}", digest_key="new", delay=delay)]
+            )
+        await db.complete_outbox([], [(2, 600, "timeout")], [])
+        return await db.get_due_outbox()
+    
+    due = run(scenario)
+    assert [m.text for m in due] == ["new 1", "new 3"]
+
+
+def test_outbox_completion(run):
+    async def scenario(db):
+        await _users(db)
+        for chat_id in (1, 2, 3, 4):
+            await db.create_ticket(3, TICKET_TYPE_HELP_NEEDED, "Заявка", notify=lambda t, c=chat_id: [Notice(c, "x")])
+        sent, retried, dead, deferred = [m.id for m in await db.get_due_outbox()]
+        await db.complete_outbox([sent], [(retried, 0, "timeout")], [(dead, "blocked")], [(deferred, 600)])
+        return retried, await db.get_due_outbox(), await db.get_outbox_counts()
+    
+    retried, due, counts = run(scenario)
+    assert [(m.id, m.attempts) for m in due] == [(retried, 1)]
+    assert counts == {OUTBOX_STATUS_PENDING: 2, OUTBOX_STATUS_DEAD: 1}
+
+
+def test_escalations(run):
+    async def scenario(db):
+        await _users(db)
+        ids = [
+            (await db.create_ticket(3, TICKET_TYPE_HELP_NEEDED, f"Заявка {i}", escalate_after=delay, routed=[1, 2])).id
+            for i, delay in enumerate((0, 0, 3600))
+        ]
+        # Without escalate_after a ticket is never escalated
+        await db.create_ticket(3, TICKET_TYPE_HELP_NEEDED, "Всем сразу")
+        await db.update_ticket_status(ids[1], TICKET_STATUS_IN_PROGRESS, judge_id=2)
+        routed = []
+        
+        def notify(ticket, judges):
+            routed.append(judges)
+            return [Notice(4, f"late {ticket.id}")]
+        
+        first = await db.pop_due_escalations(notify=notify)
+        return ids, first, routed, await db.pop_due_escalations(), await db.get_due_outbox()
+    
+    ids, first, routed, second, due = run(scenario)
+    assert [t.id for t in first] == [ids[0]]
+    assert routed == [frozenset({1, 2})]
+    assert second == []
+    assert [m.text for m in due] == [f"late {ids[0]}"]
+
+
+def test_chat_health(run):
+    now = datetime.now().replace(microsecond=0)
+    
+    async def scenario(db):
+        await db.save_chat_health(
+            [ChatHealth(10, CHAT_STATE_BLOCKED, 1, "Forbidden", now, now + timedelta(hours=1)),
+             ChatHealth(11, CHAT_STATE_BLOCKED, 2, "Forbidden", now + timedelta(seconds=5), now)],
+            reachable=[]
+        )
+        await db.save_chat_health([], reachable=[10])
+        return await db.get_chat_health()
+    
+    health = run(scenario)
+    assert [(h.chat_id, h.failures, h.updated_at) for h in health] == [(11, 2, now + timedelta(seconds=5))]
+
+
+def test_memory_snapshot_goes_to_a_fresh_file(tmp_path):
+    path = str(tmp_path / "snapshot.db")
+    
+    async def event(first_name: str):
+        db = MemoryDatabase(snapshot_path=path)
+        await db.init_db()
+        await db.create_user(1, "admin", first_name)
+        await db.create_ticket(1, TICKET_TYPE_HELP_NEEDED, first_name)
+        await db.close()
+    
+    asyncio.run(event("First"))
+    asyncio.run(event("Second"))
+    
+    with pytest.raises(FileExistsError):
+        asyncio.run(MemoryDatabase().snapshot(path))
+    
+    snapshots = sorted(os.listdir(tmp_path))
+    assert len(snapshots) == 2
+    descriptions = []
+    for name in snapshots:
+        conn = sqlite3.connect(tmp_path / name)
+        descriptions += [row[0] for row in conn.execute("SELECT description FROM tickets")]
+        conn.close()
+    assert sorted(descriptions) == ["First", "Second"]
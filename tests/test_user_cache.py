@@ -0,0 +1,42 @@
+"""
+UserCache: reads that overlap a write must not cache the old row
+"""
+from datetime import datetime
+
+from database.cache import UserCache
+from database.models import User, ROLE_PLAYER, ROLE_JUDGE
+
+
+def _user(role: str) -> User:
+    return User(1, "player", "Player", role, datetime(2026, 1, 1))
+
+
+def test_read_finishing_after_a_write_is_not_cached():
+    cache = UserCache()
+    token = cache.begin_read()
+    cache.put(_user(ROLE_JUDGE))
+    cache.end_read(token, _user(ROLE_PLAYER))
+    
+    assert cache.get(1).role == ROLE_JUDGE
+
+
+def test_read_after_an_invalidation_is_not_cached():
+    cache = UserCache()
+    cache.put(_user(ROLE_PLAYER))
+    token = cache.begin_read()
+    cache.invalidate(1)
+    cache.end_read(token, _user(ROLE_PLAYER))
+    
+    assert cache.get(1) is None
+
+
+def test_read_without_overlapping_write_is_cached():
+    cache = UserCache()
+    token = cache.begin_read()
+    cache.end_read(token, _user(ROLE_PLAYER))
+    
+    assert cache.get(1).role == ROLE_PLAYER
+    # No read is in flight, so nothing is remembered about writes
+    cache.put(_user(ROLE_JUDGE))
+    assert cache._written == {}
+
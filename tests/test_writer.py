@@ -0,0 +1,48 @@
+"""
+Database writer: a failed commit must not leave the writer connection inside a transaction
+"""
+import asyncio
+import sqlite3
+
+import pytest
+
+from database.db import Database
+
+
+class FailingCommit:
+    """Wraps the writer connection; the next COMMIT fails without ending the transaction"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.fail_next_commit = True
+    
+    def execute(self, sql, *args, **kwargs):
+        if sql == "COMMIT" and self.fail_next_commit:
+            self.fail_next_commit = False
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.conn.execute(sql, *args, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+@pytest.mark.parametrize("group_commit", [False, True])
+def test_write_after_a_failed_commit_succeeds(tmp_path, group_commit):
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"), readers=1, group_commit=group_commit)
+        await db.init_db()
+        try:
+            db._writer = FailingCommit(db._writer)
+            with pytest.raises(sqlite3.OperationalError):
+                await db.create_user(1, "lost", "Lost")
+            
+            saved = await db.create_user(2, "saved", "Saved")
+            return saved, await db.get_user(1), await db.get_user(2)
+        finally:
+            await db.close()
+    
+    saved, lost, stored = asyncio.run(scenario())
+    
+    assert saved.id == 2
+    assert lost is None
+    assert stored.username == "saved"
@@ -0,0 +1,226 @@
+"""
+Notification dispatcher for messages the bot sends on its own initiative
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Iterable, Any
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramNetworkError, TelegramServerError, TelegramAPIError,
+    TelegramForbiddenError, TelegramBadRequest, TelegramNotFound
+)
+
+from database.models import CHAT_STATE_BLOCKED, CHAT_STATE_DEACTIVATED, CHAT_STATE_NOT_FOUND
+
+logger = logging.getLogger(__name__)
+
+
+def _unreachable_state(error: TelegramAPIError) -> Optional[str]:
+    """Chat health state for errors meaning the chat cannot get messages at all, else None"""
+    text = error.message.lower()
+    if isinstance(error, TelegramForbiddenError):
+        # "bot was blocked by the user", "bot was kicked from the group chat", "user is deactivated"
+        return CHAT_STATE_DEACTIVATED if "deactivated" in text else CHAT_STATE_BLOCKED
+    if isinstance(error, (TelegramBadRequest, TelegramNotFound)) and "chat not found" in text:
+        return CHAT_STATE_NOT_FOUND
+    return None
+
+
+@dataclass(slots=True, frozen=True)
+class Delivery:
+    """Outcome of one message to one recipient"""
+    chat_id: int
+    ok: bool
+    attempts: int
+    error: Optional[str] = None  # Last error when the message was not delivered
+    retryable: bool = False  # Failed on a transient error, worth trying again later
+    unreachable: Optional[str] = None  # Chat health state when the chat cannot get messages
+
+
+class Notification:
+    """One message fanned out to a set of recipients; await wait() for the per-recipient results"""
+    
+    def __init__(self, label: str, chat_ids: List[int]):
+        self.label = label
+        self.chat_ids = chat_ids
+        self.results: Dict[int, Delivery] = {}
+        self._done = asyncio.Event()
+        if not chat_ids:
+            self._done.set()
+    
+    def _record(self, delivery: Delivery):
+        """Store one recipient's outcome, completing the notification after the last one"""
+        self.results[delivery.chat_id] = delivery
+        if len(self.results) == len(self.chat_ids):
+            self._done.set()
+            failed = [result.chat_id for result in self.results.values() if not result.ok]
+            if failed:
+                logger.warning(
+                    f"Notification '{self.label}' delivered to "
+                    f"{len(self.chat_ids) - len(failed)}/{len(self.chat_ids)}, failed for {failed}"
+                )
+            else:
+                logger.debug(f"Notification '{self.label}' delivered to {len(self.chat_ids)} recipients")
+    
+    @property
+    def done(self) -> bool:
+        """Whether every recipient has an outcome"""
+        return self._done.is_set()
+    
+    async def wait(self) -> Dict[int, Delivery]:
+        """Wait until every recipient has an outcome and return them by chat id"""
+        await self._done.wait()
+        return self.results
+
+
+class Notifier:
+    """Sends notifications from a queue with a pool of concurrent workers, under Telegram's rate limits"""
+    
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = 8,
+        global_rate: float = 25.0,
+        chat_interval: float = 1.0,
+        max_attempts: int = 3
+    ):
+        self.bot = bot
+        self.workers = max(1, workers)
+        self.global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self.chat_interval = chat_interval
+        self.max_attempts = max(1, max_attempts)
+        
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        
+        # Send slots already handed out, as monotonic times; reserving a slot
+        # moves the next one forward, so concurrent workers never burst
+        self._next_global = 0.0
+        self._next_by_chat: Dict[int, float] = {}
+        self._paused_until = 0.0
+        
+        # Metrics, see stats()
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._max_queue_depth = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+    
+    def start(self):
+        """Start the worker tasks"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Notifier started with {self.workers} workers")
+    
+    async def stop(self, timeout: float = 10.0):
+        """Deliver what is still queued, up to timeout seconds, then stop the workers"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Notifier stopped with {self._queue.qsize()} messages undelivered")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+        logger.info("Notifier stopped")
+    
+    def notify(self, chat_ids: Iterable[int], text: str, label: str = "message", **kwargs: Any) -> Notification:
+        """
+        Queue text for every chat in chat_ids and return without waiting.
+        
+        Duplicate chat ids get a single message. Extra keyword arguments are
+        passed to Bot.send_message.
+        """
+        if self._queue is None:
+            self.start()
+        
+        notification = Notification(label, list(dict.fromkeys(chat_ids)))
+        queued_at = time.monotonic()
+        for chat_id in notification.chat_ids:
+            self._queue.put_nowait((notification, chat_id, text, kwargs, queued_at))
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return notification
+    
+    def _reserve(self, chat_id: int) -> float:
+        """Reserve the next send slot for a chat and return how long to wait for it"""
+        now = time.monotonic()
+        slot = max(now, self._paused_until, self._next_by_chat.get(chat_id, 0.0))
+        self._next_by_chat[chat_id] = slot + self.chat_interval
+        
+        slot = max(slot, self._next_global)
+        self._next_global = slot + self.global_interval
+        
+        # Forget chats whose last slot is over, the map only needs pending ones
+        if len(self._next_by_chat) > 1024:
+            self._next_by_chat = {
+                chat: next_at for chat, next_at in self._next_by_chat.items() if next_at > now
+            }
+        return slot - now
+    
+    async def _send(self, chat_id: int, text: str, kwargs: Dict[str, Any]) -> Delivery:
+        """Send one message, retrying flood control and network errors"""
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            delay = self._reserve(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                return Delivery(chat_id, True, attempt)
+            except TelegramRetryAfter as e:
+                # Flood control applies to the whole bot, so every worker waits
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                error = str(e)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                error = str(e)
+            except TelegramAPIError as e:
+                return Delivery(chat_id, False, attempt, str(e), unreachable=_unreachable_state(e))
+            if attempt < self.max_attempts:
+                self._retries += 1
+        return Delivery(chat_id, False, self.max_attempts, error, retryable=True)
+    
+    async def _worker(self):
+        """Deliver queued messages one at a time"""
+        while True:
+            notification, chat_id, text, kwargs, queued_at = await self._queue.get()
+            try:
+                try:
+                    delivery = await self._send(chat_id, text, kwargs)
+                except Exception as e:
+                    logger.error(f"Failed to notify {chat_id}: {e}", exc_info=True)
+                    delivery = Delivery(chat_id, False, 1, str(e))
+                
+                if delivery.ok:
+                    self._sent += 1
+                    latency = time.monotonic() - queued_at
+                    self._total_latency += latency
+                    self._max_latency = max(self._max_latency, latency)
+                else:
+                    self._failed += 1
+                    logger.error(f"Failed to notify {chat_id} ({notification.label}): {delivery.error}")
+                notification._record(delivery)
+            finally:
+                self._queue.task_done()
+    
+    def stats(self) -> dict:
+        """Delivery counters, queue depth and enqueue-to-delivery latency"""
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self._max_queue_depth,
+            "sent": self._sent,
+            "failed": self._failed,
+            "retries": self._retries,
+            "avg_latency_ms": round(self._total_latency / self._sent * 1000, 2) if self._sent else 0.0,
+            "max_latency_ms": round(self._max_latency * 1000, 2),
+        }
@@ -0,0 +1,344 @@
+"""
+Outbox worker delivering notifications written to the outbox table
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, List, Tuple, Dict, Deque
+import logging
+
+from database.models import OutboxMessage, ChatHealth
+from database.storage import Storage
+from utils.notifier import Notifier, Delivery
+
+logger = logging.getLogger(__name__)
+
+# Digest keys: pending messages to one chat with the same key go out as one message
+DIGEST_AUTO_CLOSED = "auto_closed"
+DIGEST_NEW_TICKETS = "new_tickets"
+
+DIGEST_TITLES = {
+    DIGEST_AUTO_CLOSED: "🔒 Автоматически закрыты заявки",
+    DIGEST_NEW_TICKETS: "🆕 Новые заявки",
+}
+# Title of the message that merges whatever exceeds a chat's message budget
+OVERFLOW_TITLE = "📬 Несколько уведомлений"
+
+MESSAGE_LIMIT = 4096  # Telegram's limit on message length
+
+# Seconds the rest of an undeliverable chat's messages wait for the outcome of its probe
+PROBE_FOLLOWUP_DELAY = 1
+# Seconds until the part of a list that did not fit in MESSAGE_LIMIT is sent
+SPLIT_FOLLOWUP_DELAY = 1
+
+
+def _compose(title: str, texts: List[str]) -> Tuple[str, int]:
+    """
+    One message out of several: a single text as is, otherwise a titled list
+    of as many texts as fit in MESSAGE_LIMIT. Returns the message and the
+    number of texts it includes; the rest have to go in a later message.
+    """
+    if len(texts) == 1:
+        return texts[0], 1
+    
+    # One-line items read best as a list, longer ones need a blank line between them
+    separator = "\n\n" if any("\n" in item for item in texts) else "\n"
+    text = f"{title} ({len(texts)}):"
+    for index, item in enumerate(texts):
+        rest = len(texts) - index
+        # Keep room for the "and N more" line in case a later item does not fit
+        tail = f"{separator}…и еще {rest} в следующем сообщении"
+        if len(text) + len(separator) + len(item) + (len(tail) if rest > 1 else 0) > MESSAGE_LIMIT:
+            if index == 0:
+                # Not even the first one fits under the title, send it on its own
+                return texts[0], 1
+            return text + tail, index
+        text += separator + item
+    return text, len(texts)
+
+
+class OutboxWorker:
+    """Delivers outbox messages in batches, retrying failures and holding unreachable chats"""
+    
+    def __init__(
+        self,
+        db: Storage,
+        notifier: Notifier,
+        batch_size: int = 100,
+        poll_interval: float = 5.0,
+        max_attempts: int = 8,
+        retry_base: int = 10,
+        retry_max: int = 3600,
+        chat_cap: int = 20,
+        cap_window: int = 60,
+        failure_limit: int = 5,
+        probe_base: int = 3600,
+        probe_max: int = 7 * 24 * 3600
+    ):
+        self.db = db
+        self.notifier = notifier
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.chat_cap = chat_cap  # 0 disables the per-chat budget
+        self.cap_window = cap_window
+        self.failure_limit = max(1, failure_limit)
+        self.probe_base = probe_base
+        self.probe_max = probe_max
+        
+        # Monotonic times of recent sends per chat, for the per-chat budget
+        self._chat_sends: Dict[int, Deque[float]] = {}
+        
+        # Undeliverable chats, loaded from storage with the first batch; failed
+        # deliveries in a row for chats not marked yet; chats seen writing to
+        # the bot whose health row still has to be dropped
+        self._health: Optional[Dict[int, ChatHealth]] = None
+        self._failures: Dict[int, int] = {}
+        self._seen: List[int] = []
+        
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        
+        # Metrics, see stats()
+        self._batches = 0
+        self._delivered = 0
+        self._retried = 0
+        self._dead = 0
+        self._coalesced = 0
+        self._deferred = 0
+        self._held = 0
+    
+    def start(self):
+        """Start the worker task; it first drains whatever survived the last run"""
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info("Outbox worker started")
+    
+    async def stop(self):
+        """Finish the batch in progress and stop"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        logger.info("Outbox worker stopped")
+    
+    def wake(self):
+        """Check the outbox now instead of at the next poll; call after writing notifications"""
+        self._wakeup.set()
+    
+    def chat_seen(self, chat_id: int):
+        """Mark a chat reachable because its user wrote to the bot; a dict lookup for healthy chats"""
+        self._failures.pop(chat_id, None)
+        if self._health is not None and self._health.pop(chat_id, None) is not None:
+            logger.info(f"Chat {chat_id} wrote to the bot, delivering to it again")
+            self._seen.append(chat_id)
+            self.wake()
+    
+    def _retry_delay(self, attempts: int) -> int:
+        """Seconds to wait before the next attempt of a message that failed attempts times"""
+        return min(self.retry_base * 2 ** attempts, self.retry_max)
+    
+    async def _run(self):
+        """Deliver due batches until stopped, sleeping until woken or the next poll"""
+        while not self._stopping:
+            try:
+                count = await self.deliver_batch()
+            except Exception as e:
+                logger.error(f"Outbox delivery failed: {e}", exc_info=True)
+                count = 0
+            
+            # A full batch means more may be waiting: go again right away
+            if count >= self.batch_size:
+                continue
+            
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+    
+    def _quota(self, chat_id: int, now: float) -> Tuple[int, float]:
+        """Messages a chat may still get in the current window and seconds until its budget grows"""
+        sends = self._chat_sends.get(chat_id)
+        if not sends:
+            return self.chat_cap, 0.0
+        while sends and sends[0] <= now - self.cap_window:
+            sends.popleft()
+        if not sends:
+            del self._chat_sends[chat_id]
+            return self.chat_cap, 0.0
+        return self.chat_cap - len(sends), sends[0] + self.cap_window - now
+    
+    def _plan(
+        self, messages: List[OutboxMessage]
+    ) -> Tuple[List[Tuple[int, str, List[OutboxMessage]]], List[Tuple[int, int]]]:
+        """
+        Turn a batch into the messages to send and the ids to postpone.
+        
+        Returns (chat id, text, source messages) per message to send, and
+        (id, delay) for messages held back because their chat has no budget
+        left or is undeliverable.
+        """
+        # Group into units: a digest collects its key's messages, the rest go alone
+        by_chat: Dict[int, Dict[object, List[OutboxMessage]]] = {}
+        for message in messages:
+            key = message.digest_key or message.id
+            by_chat.setdefault(message.chat_id, {}).setdefault(key, []).append(message)
+        
+        now = time.monotonic()
+        wall_now = datetime.now()
+        sends = []
+        deferred = []
+        for chat_id, units in by_chat.items():
+            units = list(units.items())
+            health = self._health.get(chat_id)
+            if health is not None:
+                wait = (health.next_probe_at - wall_now).total_seconds()
+                if wait > 0:
+                    # Undeliverable: hold everything until the next probe
+                    held = [(message.id, math.ceil(wait)) for _, unit in units for message in unit]
+                    deferred.extend(held)
+                    self._held += len(held)
+                    continue
+                # Probe with the oldest message only, the rest waits for its outcome
+                deferred.extend(
+                    (message.id, PROBE_FOLLOWUP_DELAY) for _, unit in units[1:] for message in unit
+                )
+                units = units[:1]
+            
+            if self.chat_cap > 0:
+                quota, wait = self._quota(chat_id, now)
+            else:
+                quota, wait = len(units), 0.0
+            if quota <= 0:
+                delay = max(1, math.ceil(wait))
+                deferred.extend((message.id, delay) for _, unit in units for message in unit)
+                continue
+            
+            if len(units) > quota:
+                # Everything past the budget goes out as one merged message
+                overflow = [message for _, unit in units[quota - 1:] for message in unit]
+                units = units[:quota - 1] + [(None, overflow)]
+            
+            for key, unit in units:
+                title = DIGEST_TITLES.get(key, OVERFLOW_TITLE)
+                text, included = _compose(title, [message.text for message in unit])
+                sends.append((chat_id, text, unit[:included]))
+                # What did not fit stays pending for the next message to this chat
+                deferred.extend((message.id, SPLIT_FOLLOWUP_DELAY) for message in unit[included:])
+            if self.chat_cap > 0:
+                self._chat_sends.setdefault(chat_id, deque()).extend([now] * len(units))
+        return sends, deferred
+    
+    def _update_health(self, deliveries: List[Delivery]) -> Tuple[List[ChatHealth], List[int]]:
+        """Fold delivery outcomes into the chat health map; returns the marked and the recovered chats"""
+        now = datetime.now().replace(microsecond=0)
+        unreachable: Dict[int, ChatHealth] = {}
+        reachable, self._seen = self._seen, []
+        for delivery in deliveries:
+            chat_id = delivery.chat_id
+            if delivery.ok:
+                self._failures.pop(chat_id, None)
+                if self._health.pop(chat_id, None) is not None:
+                    logger.info(f"Chat {chat_id} is reachable again")
+                    reachable.append(chat_id)
+                continue
+            # Only chat-level errors say something about the chat; transient
+            # errors and rejected messages (bad markup, too long) do not
+            state = delivery.unreachable
+            if state is None or chat_id in unreachable:
+                continue
+            
+            previous = self._health.get(chat_id)
+            failures = (previous.failures if previous else self._failures.get(chat_id, 0)) + 1
+            # A chat is marked after failure_limit such errors in a row
+            if previous is None and failures < self.failure_limit:
+                self._failures[chat_id] = failures
+                continue
+            
+            self._failures.pop(chat_id, None)
+            if previous is None:
+                probe_delay = self.probe_base
+                logger.warning(f"Chat {chat_id} marked undeliverable ({state}): {delivery.error}")
+            else:
+                # Each failed probe doubles the wait for the next one
+                last_delay = (previous.next_probe_at - previous.updated_at).total_seconds()
+                probe_delay = min(max(2 * int(last_delay), self.probe_base), self.probe_max)
+            health = ChatHealth(chat_id, state, failures, delivery.error, now, now + timedelta(seconds=probe_delay))
+            self._health[chat_id] = health
+            unreachable[chat_id] = health
+        
+        return list(unreachable.values()), [chat_id for chat_id in reachable if chat_id not in unreachable]
+    
+    async def _save_health(self, unreachable: List[ChatHealth], reachable: List[int]):
+        """Store chat health changes, if any"""
+        if unreachable or reachable:
+            await self.db.save_chat_health(unreachable, reachable)
+    
+    async def deliver_batch(self) -> int:
+        """Send one batch of due messages and record the outcomes. Returns the number of messages handled."""
+        if self._health is None:
+            self._health = {health.chat_id: health for health in await self.db.get_chat_health()}
+        
+        messages = await self.db.get_due_outbox(self.batch_size)
+        if not messages:
+            await self._save_health(*self._update_health([]))
+            return 0
+        
+        sends, deferred = self._plan(messages)
+        notifications = [
+            self.notifier.notify([chat_id], text, label=f"outbox #{unit[0].id}" + (f" +{len(unit) - 1}" if len(unit) > 1 else ""))
+            for chat_id, text, unit in sends
+        ]
+        results = await asyncio.gather(*(notification.wait() for notification in notifications))
+        
+        delivered: List[int] = []
+        retry: List[Tuple[int, int, str]] = []
+        dead: List[Tuple[int, str]] = []
+        for (chat_id, _, unit), result in zip(sends, results):
+            # A merged message succeeds or fails for all of its sources together;
+            # after max_attempts or on a permanent error the sources become dead letters
+            delivery = result[chat_id]
+            attempts = max(message.attempts for message in unit)
+            if delivery.ok:
+                delivered.extend(message.id for message in unit)
+            elif delivery.retryable and attempts + 1 < self.max_attempts:
+                delay = self._retry_delay(attempts)
+                retry.extend((message.id, delay, delivery.error) for message in unit)
+            else:
+                dead.extend((message.id, delivery.error) for message in unit)
+        
+        # Delivery is at least once: a crash before this write sends the batch again
+        await self.db.complete_outbox(delivered, retry, dead, deferred)
+        deliveries = [result[chat_id] for (chat_id, _, _), result in zip(sends, results)]
+        await self._save_health(*self._update_health(deliveries))
+        
+        self._batches += 1
+        self._delivered += len(delivered)
+        self._retried += len(retry)
+        self._dead += len(dead)
+        self._coalesced += len(messages) - len(deferred) - len(sends)
+        self._deferred += len(deferred)
+        return len(messages)
+    
+    def stats(self) -> dict:
+        """Batch and outcome counters since start"""
+        return {
+            "batches": self._batches,
+            "delivered": self._delivered,
+            "retried": self._retried,
+            "dead": self._dead,
+            "coalesced": self._coalesced,
+            "deferred": self._deferred,
+            "held_unreachable": self._held,
+            "unreachable_chats": len(self._health or ()),
+        }
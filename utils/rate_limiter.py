@@ -0,0 +1,82 @@
+"""
+Per-user token bucket rate limiter with fixed-size state
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import time
+
+
+class RateLimiter:
+    """Allows each user max_requests requests per period seconds, using a token bucket per user"""
+    
+    def __init__(self, max_requests: int, period: float):
+        self.capacity = max(1, max_requests)
+        self.period = period
+        # With no period every bucket is idle at once, so nothing is limited
+        self.rate = self.capacity / period if period > 0 else 0.0
+        # user id -> [tokens, updated_at], least recently used first, so idle
+        # buckets are evicted from the front at O(1) amortized cost per call
+        self._buckets: "OrderedDict[int, List[float]]" = OrderedDict()
+        # Nothing can be idle before this time: the front bucket's last use plus a period
+        self._evict_at = 0.0
+        
+        # Metrics, see stats()
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+    
+    def _evict(self, now: float):
+        """Drop the buckets nobody has used for a whole period"""
+        # Such a bucket has refilled completely, so dropping it loses nothing
+        cutoff = now - self.period
+        buckets = self._buckets
+        while buckets:
+            bucket = buckets[next(iter(buckets))]
+            if bucket[1] > cutoff:
+                self._evict_at = bucket[1] + self.period
+                return
+            buckets.popitem(last=False)
+            self.evicted += 1
+        self._evict_at = now
+    
+    def allow(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Take a token for one request of user_id; False if they are over the limit"""
+        if now is None:
+            now = time.monotonic()
+        if now >= self._evict_at:
+            self._evict(now)
+        
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            tokens = self.capacity
+            self._buckets[user_id] = bucket = [tokens, now]
+        else:
+            # Refill continuously at capacity / period tokens per second
+            tokens = bucket[0] + (now - bucket[1]) * self.rate
+            if tokens > self.capacity:
+                tokens = self.capacity
+            # Keep the front for the least recently used bucket
+            self._buckets.move_to_end(user_id)
+        
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            bucket[1] = now
+            self.allowed += 1
+            return True
+        
+        bucket[0] = tokens
+        bucket[1] = now
+        self.rejected += 1
+        return False
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+    
+    def stats(self) -> Dict[str, int]:
+        """Decision and eviction counters and the number of tracked users"""
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "tracked_users": len(self._buckets),
+        }
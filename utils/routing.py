@@ -0,0 +1,139 @@
+"""
+Routing of new tickets to the judges best placed to take them
+"""
+import time
+from typing import Optional, Dict, List, FrozenSet
+import logging
+from html import escape
+
+from database.models import User, Ticket, Notice, TICKET_TYPES, TICKET_STATUS_OPEN, TICKET_STATUS_IN_PROGRESS
+from database.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class TicketRouter:
+    """Picks which judges hear about a new ticket and escalates it to the rest if nobody takes it"""
+    
+    def __init__(
+        self,
+        db: Storage,
+        fanout: int = 3,
+        auto_assign: bool = False,
+        escalate_after: int = 900,
+        active_window: int = 1800
+    ):
+        self.db = db
+        self.fanout = fanout
+        self.auto_assign = auto_assign
+        self.escalate_after = escalate_after  # 0 disables escalation
+        self.active_window = active_window
+        
+        # Monotonic times of each judge's last ticket action and last routed ticket;
+        # kept in memory only, so after a restart judges rank by load until they act again
+        self._last_active: Dict[int, float] = {}
+        self._last_routed: Dict[int, float] = {}
+        
+        # Metrics, see stats()
+        self._routed = 0
+        self._notified = 0
+        self._assigned = 0
+        self._escalated = 0
+    
+    def touch(self, judge_id: int):
+        """Record that a judge acted on a ticket; call from the judge handlers"""
+        self._last_active[judge_id] = time.monotonic()
+    
+    async def rank(self) -> List[User]:
+        """All judges and admins, best placed to take a new ticket first"""
+        judges = await self.db.get_judges()
+        counts = await self.db.get_judges_ticket_counts()
+        now = time.monotonic()
+        
+        # Active judges first, then the least loaded, then the longest since their last ticket
+        def score(judge: User):
+            active = now - self._last_active.get(judge.id, float("-inf")) <= self.active_window
+            load = counts.get(judge.id, {}).get(TICKET_STATUS_IN_PROGRESS, 0)
+            return (not active, load, self._last_routed.get(judge.id, 0.0))
+        
+        return sorted(judges, key=score)
+    
+    async def pick(self) -> List[User]:
+        """Judges to tell about a new ticket: the assignee alone with auto_assign"""
+        ranked = await self.rank()
+        count = 1 if self.auto_assign else self.fanout
+        return ranked[:count] if count > 0 else ranked
+    
+    async def escalation(self, judges: List[User]) -> Optional[int]:
+        """
+        Seconds until a ticket routed to judges from pick() is escalated, or
+        None when it needs no escalation because every judge is told at once.
+        
+        Pass it to create_ticket() with the judges as routed, so the
+        escalation is written together with the ticket.
+        """
+        if self.escalate_after > 0 and len(judges) < len(await self.db.get_judges()):
+            return self.escalate_after
+        return None
+    
+    async def dispatched(self, ticket: Ticket, judges: List[User]):
+        """Finish routing a ticket created for judges from pick(), assigning it with auto_assign"""
+        now = time.monotonic()
+        for judge in judges:
+            self._last_routed[judge.id] = now
+        self._routed += 1
+        self._notified += len(judges)
+        
+        if self.auto_assign and judges:
+            await self._assign(ticket, judges[0])
+    
+    async def _assign(self, ticket: Ticket, judge: User):
+        """Put the ticket in progress with judge, telling the judge and the owner"""
+        type_name = TICKET_TYPES.get(ticket.ticket_type, "Неизвестный тип")
+        assigned = await self.db.update_ticket_status(
+            ticket.id,
+            TICKET_STATUS_IN_PROGRESS,
+            judge_id=judge.id,
+            from_statuses=(TICKET_STATUS_OPEN,),
+            notify=lambda taken: [
+                Notice(
+                    judge.id,
+                    f"📥 Вам назначена заявка #{taken.id}\n\n"
+                    f"📌 Тип: {type_name}\n"
+                    f"📝 Описание: {escape(taken.description)}"
+                ),
+                Notice(taken.user_id, f"🟡 Ваша заявка #{taken.id} взята в работу судьей {escape(judge.first_name)}")
+            ]
+        )
+        if assigned:
+            self._assigned += 1
+            logger.info(f"Ticket {ticket.id} auto-assigned to judge {judge.id}")
+    
+    async def escalate(self) -> int:
+        """Tell the remaining judges about routed tickets still open past escalate_after; returns how many"""
+        judges = await self.db.get_judges()
+        minutes = self.escalate_after // 60
+        
+        def notify_rest(ticket: Ticket, routed: FrozenSet[int]):
+            type_name = TICKET_TYPES.get(ticket.ticket_type, "Неизвестный тип")
+            text = (
+                f"⏰ Заявка #{ticket.id} ждет судью больше {minutes} мин.\n\n"
+                f"📌 Тип: {type_name}\n"
+                f"📝 Описание: {escape(ticket.description)}"
+            )
+            return [Notice(judge.id, text) for judge in judges if judge.id not in routed]
+        
+        tickets = await self.db.pop_due_escalations(notify=notify_rest)
+        if tickets:
+            self._escalated += len(tickets)
+            logger.info(f"Escalated {len(tickets)} unassigned tickets to the judges not told yet")
+        return len(tickets)
+    
+    def stats(self) -> dict:
+        """Routing counters since start"""
+        return {
+            "routed": self._routed,
+            "avg_recipients": round(self._notified / self._routed, 2) if self._routed else 0.0,
+            "assigned": self._assigned,
+            "escalated": self._escalated,
+        }
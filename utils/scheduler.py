@@ -1,13 +1,17 @@
 """
-Scheduler for automatic ticket closing
+Scheduler for automatic ticket closing and archiving
 """
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from aiogram import Bot
 import logging
 
-from database.db import Database
-from database.models import TICKET_STATUS_CLOSED
-from config import AUTO_CLOSE_DAYS
+from database.models import Notice
+from database.storage import Storage
+from utils.outbox import OutboxWorker, DIGEST_AUTO_CLOSED
+from utils.routing import TicketRouter
+from config import (
+    AUTO_CLOSE_DAYS, AUTO_CLOSE_BATCH_SIZE, AUTO_CLOSE_DIGEST_WINDOW,
+    ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +19,10 @@ logger = logging.getLogger(__name__)
 class TicketScheduler:
     """Scheduler for automatic ticket operations"""
     
-    def __init__(self, db: Database, bot: Bot):
+    def __init__(self, db: Storage, outbox: OutboxWorker, routing: TicketRouter):
         self.db = db
-        self.bot = bot
+        self.outbox = outbox
+        self.routing = routing
         self.scheduler = AsyncIOScheduler()
     
     async def close_old_tickets(self):
@@ -31,49 +36,66 @@ class TicketScheduler:
             
             logger.info(f"Found {len(old_tickets)} old tickets to close")
             
-            for ticket in old_tickets:
-                # Close ticket
-                await self.db.update_ticket_status(
-                    ticket.id,
-                    TICKET_STATUS_CLOSED,
-                    closed_by=None  # System closed
+            judges = await self.db.get_judges()
+            
+            def notify_closed(ticket):
+                """Owner and judge notifications for one auto-closed ticket"""
+                owner_text = (
+                    f"🔒 Ваша заявка #{ticket.id} автоматически закрыта.\n\n"
+                    f"Причина: прошло {AUTO_CLOSE_DAYS} дней с момента создания.\n\n"
+                    f"Если проблема не решена, создайте новую заявку."
                 )
-                
-                # Add system comment
-                await self.db.create_comment(
-                    ticket.id,
-                    ticket.user_id,  # Using user_id as placeholder for system
-                    f"Заявка автоматически закрыта через {AUTO_CLOSE_DAYS} дней неактивности"
+                judge_text = (
+                    f"🔒 Заявка #{ticket.id} автоматически закрыта системой "
+                    f"(неактивна {AUTO_CLOSE_DAYS} дней)"
                 )
+                if AUTO_CLOSE_DIGEST_WINDOW > 0:
+                    # Judges get one summary per run instead of a message per ticket
+                    judge_notices = [
+                        Notice(judge.id, judge_text, digest_key=DIGEST_AUTO_CLOSED, delay=AUTO_CLOSE_DIGEST_WINDOW)
+                        for judge in judges
+                    ]
+                else:
+                    judge_notices = [Notice(judge.id, judge_text) for judge in judges]
+                return [Notice(ticket.user_id, owner_text)] + judge_notices
+            
+            # Close in bounded chunks so one run never holds the write lock for long
+            for start in range(0, len(old_tickets), AUTO_CLOSE_BATCH_SIZE):
+                chunk = old_tickets[start:start + AUTO_CLOSE_BATCH_SIZE]
                 
-                # Notify ticket owner
-                try:
-                    await self.bot.send_message(
-                        ticket.user_id,
-                        f"🔒 Ваша заявка #{ticket.id} автоматически закрыта.\n\n"
-                        f"Причина: прошло {AUTO_CLOSE_DAYS} дней с момента создания.\n\n"
-                        f"Если проблема не решена, создайте новую заявку."
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify ticket owner {ticket.user_id}: {e}")
-                
-                # Notify judges
-                judges = await self.db.get_judges()
-                for judge in judges:
-                    try:
-                        await self.bot.send_message(
-                            judge.id,
-                            f"🔒 Заявка #{ticket.id} автоматически закрыта системой "
-                            f"(неактивна {AUTO_CLOSE_DAYS} дней)"
-                        )
-                    except Exception as e:
-                        logger.error(f"Failed to notify judge {judge.id}: {e}")
+                # Close tickets, add system comments and queue the
+                # notifications in one transaction
+                closed_tickets = await self.db.close_tickets(
+                    [ticket.id for ticket in chunk],
+                    f"Заявка автоматически закрыта через {AUTO_CLOSE_DAYS} дней неактивности",
+                    closed_by=None,  # System closed
+                    notify=notify_closed
+                )
+                self.outbox.wake()
                 
-                logger.info(f"Ticket {ticket.id} automatically closed")
+                for ticket in closed_tickets:
+                    logger.info(f"Ticket {ticket.id} automatically closed")
         
         except Exception as e:
             logger.error(f"Error in close_old_tickets: {e}", exc_info=True)
     
+    async def escalate_tickets(self):
+        """Notify every judge about routed tickets nobody picked up in time"""
+        try:
+            if await self.routing.escalate():
+                self.outbox.wake()
+        except Exception as e:
+            logger.error(f"Error in escalate_tickets: {e}", exc_info=True)
+    
+    async def archive_old_tickets(self):
+        """Move tickets closed more than ARCHIVE_AFTER_DAYS ago into the archive database"""
+        try:
+            moved = await self.db.archive_closed_tickets(ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+            if not moved:
+                logger.info("No closed tickets to archive")
+        except Exception as e:
+            logger.error(f"Error in archive_old_tickets: {e}", exc_info=True)
+    
     def start(self):
         """Start the scheduler"""
         # Run ticket closing check every hour
@@ -85,6 +107,27 @@ class TicketScheduler:
             replace_existing=True
         )
         
+        if self.routing.escalate_after > 0:
+            # Escalations are due escalate_after seconds after creation, a
+            # minute of slack is fine
+            self.scheduler.add_job(
+                self.escalate_tickets,
+                'interval',
+                minutes=1,
+                id='escalate_tickets',
+                replace_existing=True
+            )
+        
+        if self.db.archive_path:
+            # Archiving only moves old history, once every few hours is plenty
+            self.scheduler.add_job(
+                self.archive_old_tickets,
+                'interval',
+                hours=6,
+                id='archive_old_tickets',
+                replace_existing=True
+            )
+        
         self.scheduler.start()
         logger.info("Scheduler started")
     